@@ -1,19 +1,23 @@
 """
 Identificación de plantas
 """
-import io
 import os
+import hmac
+import json
 import time
+import base64
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, contextmanager
 
-import cv2
 import numpy as np
-from fastapi import FastAPI, File, UploadFile, HTTPException, Query
+import orjson
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
-from PIL import Image
 from pydantic import BaseModel, Field
 
 import plantid
@@ -22,13 +26,88 @@ from plantid.invasive import InvasiveChecker
 
 # ==================== configs ====================
 
+# Micro-batching: concurrent requests are merged into one forward pass of at
+# most MAX_BATCH_SIZE images, waiting at most MAX_WAIT_MS for the batch to fill.
+MAX_BATCH_SIZE = int(os.getenv("PLANTID_MAX_BATCH_SIZE", "16"))
+MAX_WAIT_MS = float(os.getenv("PLANTID_MAX_WAIT_MS", "5"))
+
+# Backpressure: at most MAX_CONCURRENCY requests decode and infer at the same
+# time, at most MAX_QUEUE_SIZE more wait for a slot, the rest get 503. Requests
+# hold their slot while waiting for the batch, so the default lets one full
+# batch run while the next one fills; decoding is bounded by DECODE_WORKERS.
+MAX_CONCURRENCY = int(os.getenv("PLANTID_MAX_CONCURRENCY", str(max(os.cpu_count() or 4, 2 * MAX_BATCH_SIZE))))
+MAX_QUEUE_SIZE = int(os.getenv("PLANTID_MAX_QUEUE_SIZE", "64"))
+DECODE_WORKERS = int(os.getenv("PLANTID_DECODE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Invasive lookups for the top INVASIVE_PREFETCH_TOPK candidates are started
+# together, so a later request for a runner-up hits the warm cache. Each costs
+# one upstream call per (species, location) until cached; 1 looks up the top
+# candidate only.
+INVASIVE_PREFETCH_TOPK = int(os.getenv("PLANTID_INVASIVE_PREFETCH_TOPK", "3"))
+INVASIVE_JOB_TIMEOUT = float(os.getenv("PLANTID_INVASIVE_JOB_TIMEOUT", "60"))
+# Key signing the invasive job ids, so only ids issued by /identify are accepted.
+# Set the same value on all workers; without it every worker uses a random key and
+# only answers polls of its own jobs.
+INVASIVE_JOB_SECRET = os.getenv("PLANTID_INVASIVE_JOB_SECRET", "").encode("utf-8") or os.urandom(32)
+
+# Model variant, see plantid.PlantIdentifier.MODEL_FILENAMES; model directory,
+# defaults to the models directory of the plantid package
+PRECISION = os.getenv("PLANTID_PRECISION", "fp32")
+MODEL_DIR = os.getenv("PLANTID_MODEL_DIR") or None
+
+# Model cascade: a small model with the same classes answers first; images whose
+# top-1 probability is below CASCADE_MIN_PROB, or whose margin over the runner-up
+# is below CASCADE_MIN_MARGIN, go on to the full model, see plantid.ModelCascade.
+CASCADE_MODEL = os.getenv("PLANTID_CASCADE_MODEL") or None
+CASCADE_MIN_PROB = float(os.getenv("PLANTID_CASCADE_MIN_PROB", "0.5"))
+CASCADE_MIN_MARGIN = float(os.getenv("PLANTID_CASCADE_MIN_MARGIN", "0"))
+
+# Gemini endpoint of the invasive checker, e.g. tools/mock_gemini_server.py for load tests
+INVASIVE_API_URL = os.getenv("PLANTID_INVASIVE_API_URL") or None
+
+# Results of repeated uploads are served from memory, keyed by a hash of the
+# upload bytes and, if RESULT_CACHE_PERCEPTUAL is set, of the decoded image.
+RESULT_CACHE_MB = float(os.getenv("PLANTID_RESULT_CACHE_MB", "64"))
+RESULT_CACHE_PERCEPTUAL = os.getenv("PLANTID_RESULT_CACHE_PERCEPTUAL", "0") == "1"
+
+# Multi-worker serving: if set ('host:port' or a Unix socket path), workers send
+# preprocessed images through shared memory to tools/inference_server.py
+# instead of loading the model themselves. INFERENCE_AUTHKEY, the secret shared
+# with the server (at least 16 bytes), is then required.
+INFERENCE_SERVER = os.getenv("PLANTID_INFERENCE_SERVER")
+INFERENCE_AUTHKEY = os.getenv("PLANTID_INFERENCE_AUTHKEY", "").encode("utf-8")
+if INFERENCE_SERVER:
+    plantid.inference_server.check_authkey(INFERENCE_AUTHKEY)
+
+# Test-time augmentation for low-confidence results: predictions whose top-1
+# probability is below TTA_THRESHOLD are run again with all TTA views ('flip'
+# or 'multicrop5') in one batch. Not available with INFERENCE_SERVER.
+TTA = None if INFERENCE_SERVER else (os.getenv("PLANTID_TTA") or None)
+TTA_THRESHOLD = float(os.getenv("PLANTID_TTA_THRESHOLD", "0.5"))
+# also validates TTA
+DECODE_MIN_SIZE = plantid.PlantIdentifier.get_decode_size(TTA)
+
+# Run dummy batches at startup (and before a reloaded model serves) so the first
+# real request does not pay for allocation.
+WARMUP = os.getenv("PLANTID_WARMUP", "1") == "1"
+
+# Model reload without downtime, see plantid.ModelManager: POST /admin/reload with
+# the X-Admin-Token header equal to ADMIN_TOKEN (the endpoint is disabled without
+# one), or, if MODEL_WATCH_INTERVAL > 0, when the model files change, polled every
+# MODEL_WATCH_INTERVAL seconds. The replaced model is closed once the last request
+# on it finishes. Not available with INFERENCE_SERVER.
+ADMIN_TOKEN = os.getenv("PLANTID_ADMIN_TOKEN") or None
+MODEL_WATCH_INTERVAL = float(os.getenv("PLANTID_MODEL_WATCH_INTERVAL", "0"))
+
 # Lifespan
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # run when start
-    print("Loading model...")
-    load_model()
-    load_model()
+    if INFERENCE_SERVER:
+        print(f"Connecting to inference server {INFERENCE_SERVER}...")
+    else:
+        print("Loading model...")
+    load_batch_scheduler()
     print("Model loaded！")
     print("Loading invasive checker...")
     load_invasive_checker()
@@ -36,6 +115,15 @@ async def lifespan(app: FastAPI):
     yield
     # run when shut down
     print("Service shutting down...")
+    if batch_scheduler is not None:
+        batch_scheduler.close()
+    if model_manager is not None:
+        model_manager.close()
+    for task in list(invasive_tasks.values()):
+        task.cancel()
+    if invasive_checker is not None:
+        await invasive_checker.close()
+    decode_executor.shutdown(wait=False)
 
 app = FastAPI(
     title="API de Identificación de plantas",
@@ -61,8 +149,137 @@ app.add_middleware(
 
 # Iniciar plant identifier
 # Iniciar plant identifier
-plant_identifier = None
+model_manager = None
 invasive_checker = None
+batch_scheduler = None
+decode_executor = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="plantid-decode")
+
+
+class RequestLimiter:
+    """
+    Bound the number of requests doing CPU work at the same time
+
+    Args:
+        max_concurrency: requests allowed to run at once
+        max_queue_size: requests allowed to wait for a free slot
+    """
+
+    def __init__(self, max_concurrency: int, max_queue_size: int):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_queue_size = max_queue_size
+        self.num_waiting = 0
+
+    @asynccontextmanager
+    async def acquire(self):
+        if self._semaphore.locked() and self.num_waiting >= self.max_queue_size:
+            raise HTTPException(
+                status_code=503,
+                detail="Server is busy, please retry later.",
+                headers={"Retry-After": "1"}
+            )
+        self.num_waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.num_waiting -= 1
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+
+request_limiter = RequestLimiter(MAX_CONCURRENCY, MAX_QUEUE_SIZE)
+
+result_cache = None
+if RESULT_CACHE_MB > 0:
+    result_cache = plantid.ResultCache(
+        max_bytes=int(RESULT_CACHE_MB * 1024 * 1024), use_perceptual_hash=RESULT_CACHE_PERCEPTUAL)
+
+# strong references to running invasive lookups, asyncio only keeps weak ones
+invasive_tasks = {}
+
+
+# ==================== Invasive enrichment ====================
+
+def encode_invasive_job_id(latin_name: str, location: str) -> str:
+    """
+    Job ids carry the lookup key itself, so any worker can answer a poll
+    from the shared invasive cache, not only the one that started the job.
+    They are signed with INVASIVE_JOB_SECRET, so clients cannot make up
+    lookups of their own
+    """
+    payload = json.dumps([latin_name, location, int(time.time())], ensure_ascii=False).encode('utf-8')
+    signature = hmac.new(INVASIVE_JOB_SECRET, payload, hashlib.sha256).digest()[:16]
+    return '.'.join(base64.urlsafe_b64encode(item).decode('ascii').rstrip('=') for item in (payload, signature))
+
+
+def decode_invasive_job_id(job_id: str):
+    """
+    Returns:
+        (latin_name, location, issued_at) of a job id of encode_invasive_job_id
+
+    Raises:
+        HTTPException: 404 for ids not issued by this service
+    """
+    try:
+        payload, signature = [base64.urlsafe_b64decode(item + '=' * (-len(item) % 4)) for item in job_id.split('.')]
+        expected = hmac.new(INVASIVE_JOB_SECRET, payload, hashlib.sha256).digest()[:16]
+        if not hmac.compare_digest(signature, expected):
+            raise ValueError('bad signature')
+        latin_name, location, issued_at = json.loads(payload.decode('utf-8'))
+        return str(latin_name), str(location), float(issued_at)
+    except Exception:
+        raise HTTPException(status_code=404, detail="Unknown invasive job id.")
+
+
+async def wait_invasive_job(latin_name: str, location: str, issued_at: float, timeout: float):
+    """
+    Wait at most timeout seconds for the result of an invasive job, reading
+    only the running lookups of this worker and the invasive cache; never
+    starts a lookup
+
+    Returns:
+        (status, invasive_info): status is "done", "pending", or "error" once
+        the job is INVASIVE_JOB_TIMEOUT seconds old without a result
+    """
+    deadline = time.time() + timeout
+    while True:
+        task = invasive_tasks.get((latin_name, location))
+        if task is not None:
+            try:
+                return "done", await asyncio.wait_for(asyncio.shield(task), timeout=max(0.0, deadline - time.time()))
+            except asyncio.TimeoutError:
+                return "pending", None
+            except Exception:
+                return "error", None
+        invasive_info = await load_invasive_checker().get_cached(latin_name, location)
+        if invasive_info is not None:
+            return "done", invasive_info
+        now = time.time()
+        if now > issued_at + INVASIVE_JOB_TIMEOUT:
+            return "error", None
+        if now >= deadline:
+            return "pending", None
+        # started by another worker, its result shows up in the shared cache
+        await asyncio.sleep(min(0.5, deadline - now))
+
+
+def start_invasive_lookup(latin_name: str, location: str) -> asyncio.Task:
+    """Start (or join) an invasive lookup in the background"""
+    key = (latin_name, location)
+    task = invasive_tasks.get(key)
+    if task is None:
+        checker = load_invasive_checker()
+        task = asyncio.create_task(checker.check_invasive(latin_name, location))
+        invasive_tasks[key] = task
+        task.add_done_callback(lambda _: invasive_tasks.pop(key, None))
+    return task
+
+
+def prefetch_invasive(results: List[dict], location: str):
+    """Speculatively start lookups for the top INVASIVE_PREFETCH_TOPK candidates"""
+    for item in results[:INVASIVE_PREFETCH_TOPK]:
+        start_invasive_lookup(item['latin_name'], location)
 
 
 # ==================== Model ====================
@@ -79,12 +296,45 @@ class IdentifyResponse(BaseModel):
     """model status result"""
     status: int = Field(..., description="Code：0-success，negative-fail")
     message: str = Field(..., description="Status")
-    inference_time: float = Field(..., description="Time (sec)")
+    inference_time: float = Field(..., description="Time (sec), model_time + enrichment_time")
+    model_time: float = Field(0.0, description="Time (sec) of image identification")
+    enrichment_time: float = Field(0.0, description="Time (sec) waiting for the invasive species check")
+    invasive_job_id: Optional[str] = Field(default=None, description="Poll /invasive/jobs/{id} for the invasive species check")
     results: List[PlantResult] = Field(default=[], description="Resultados de la clasificación")
     genus_results: List[PlantResult] = Field(default=[], description="Resultado de la identificación de la clasificación de especies")
     family_results: List[PlantResult] = Field(default=[], description="Resultados de la identificación a nivel departamental")
 
 
+def json_response(content: dict) -> Response:
+    """
+    Serialize with orjson, skipping FastAPI's response_model validation and
+    jsonable_encoder pass
+
+    Args:
+        content: JSON-compatible response content
+
+    Returns:
+        Response: application/json response
+    """
+    return Response(content=orjson.dumps(content), media_type="application/json")
+
+
+def to_plant_results(items: List[dict]) -> List[dict]:
+    """
+    PlantResult dicts of get_topk_results items, built without per-item
+    Pydantic validation
+
+    Args:
+        items: results of PlantIdentifier.get_topk_results
+
+    Returns:
+        List[dict]: the PlantResult fields of every item
+    """
+    return [{"latin_name": item['latin_name'],
+             "probability": item['probability'],
+             "invasive_info": item.get('invasive_info')} for item in items]
+
+
 class HealthResponse(BaseModel):
     """Health check"""
     status: str
@@ -92,60 +342,213 @@ class HealthResponse(BaseModel):
     supported_species: int
     supported_genus: int
     supported_family: int
-
-def load_model():
-    """Load model from plantid"""
-    global plant_identifier
-    if plant_identifier is None:
-        plant_identifier = plantid.PlantIdentifier()
-    return plant_identifier
+    result_cache: Optional[dict] = None
+    cascade: Optional[dict] = None
+    model: Optional[dict] = None
+
+def create_batch_scheduler():
+    """Load and warm model from plantid behind a new micro-batching scheduler, on start and on every reload"""
+    cascade = None
+    if CASCADE_MODEL:
+        cascade = plantid.ModelCascade(CASCADE_MODEL, CASCADE_MIN_PROB, CASCADE_MIN_MARGIN)
+    identifier = plantid.PlantIdentifier(MODEL_DIR, precision=PRECISION, cascade=cascade)
+    if WARMUP:
+        identifier.warmup(batch_sizes=sorted({1, MAX_BATCH_SIZE}))
+    return plantid.BatchScheduler(identifier, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS)
+
+
+def on_model_swap(scheduler, version):
+    """Drop the cached results of the replaced model, their keys no longer match anyway"""
+    print(f"Model {version} loaded")
+    if result_cache is not None:
+        result_cache.clear()
+
+
+def load_model_manager():
+    """Load the hot-swappable model, see plantid.ModelManager"""
+    global model_manager
+    if model_manager is None:
+        paths = plantid.PlantIdentifier.get_model_paths(MODEL_DIR, PRECISION)
+        if CASCADE_MODEL:
+            paths.append(CASCADE_MODEL)
+        model_manager = plantid.ModelManager(
+            create_batch_scheduler, close=plantid.BatchScheduler.close, paths=paths,
+            poll_interval=MODEL_WATCH_INTERVAL or None,
+            on_swap=on_model_swap)
+    return model_manager
 
 
 def load_invasive_checker():
     """Load invasive checker"""
     global invasive_checker
     if invasive_checker is None:
-        invasive_checker = InvasiveChecker()
+        invasive_checker = InvasiveChecker(api_url=INVASIVE_API_URL)
     return invasive_checker
 
 
-async def read_image_file(file: UploadFile) -> np.ndarray:
+def load_batch_scheduler():
+    """Micro-batching scheduler of the current model, or the client of the inference server"""
+    global batch_scheduler
+    if not INFERENCE_SERVER:
+        return load_model_manager().model
+    if batch_scheduler is None:
+        batch_scheduler = plantid.InferenceClient(INFERENCE_SERVER, INFERENCE_AUTHKEY, model_dir=MODEL_DIR)
+    return batch_scheduler
+
+
+@contextmanager
+def lease_batch_scheduler():
+    """
+    Hold the scheduler of the current model for a whole request, so a
+    reload cannot swap the model between predict and get_topk_results
+
+    Returns:
+        (scheduler, model version), the version is None with INFERENCE_SERVER
+    """
+    if INFERENCE_SERVER:
+        yield load_batch_scheduler(), None
+        return
+    with load_model_manager().acquire() as (scheduler, version):
+        yield scheduler, version
+
+
+def get_plant_names():
+    """Species, family and genus names, without loading the model in inference server mode"""
+    taxonomy = load_batch_scheduler().taxonomy
+    return taxonomy.species_chinese_names, taxonomy.family_chinese_names, taxonomy.genus_chinese_names
+
+
+def decode_image(contents: bytes) -> np.ndarray:
     """
-    read upload picture and to Opencv
+    decode picture bytes to Opencv, blocking
+
+    JPEG files are decoded at reduced resolution, just large enough for the
+    model input (or the TTA views), see plantid.decode_image
 
     Args:
-        file: picture
+        contents: picture file content
 
     Returns:
         numpy.ndarray: OpenCV picture file
+    """
+    return plantid.decode_image(contents, min_size=DECODE_MIN_SIZE)
+
+
+async def decode_upload(contents: bytes) -> np.ndarray:
+    """
+    decode upload bytes off the event loop, see decode_image
 
     Raises:
         HTTPException:
     """
     try:
-        # read file content
-        contents = await file.read()
+        loop = asyncio.get_running_loop()
+        start_time = time.perf_counter()
+        image = await loop.run_in_executor(decode_executor, decode_image, contents)
+        plantid.STAGE_SECONDS.observe(time.perf_counter() - start_time, 'decode')
+        return image
+    except Exception as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Failed to read picture file: {str(e)}"
+        )
 
-        # use pil to read pic
-        image = Image.open(io.BytesIO(contents))
 
-        # RGB mode or RGBA
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
+async def predict_upload(scheduler, version: Optional[str], file: UploadFile) -> dict:
+    """
+    PlantIdentifier.predict outputs of an upload, served from result_cache
+    when the same picture was seen before by the same model version
 
-        # convert to numpy arry
-        image_np = np.array(image)
+    Args:
+        scheduler, version: from lease_batch_scheduler
+        file: picture
 
-        # PIL use RGB, opencv use BGR convert
-        image_cv = cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
+    Returns:
+        dict: predict outputs, convert them with PlantIdentifier.get_topk_results
+    """
+    start_time = time.perf_counter()
+    contents = await file.read()
+    plantid.STAGE_SECONDS.observe(time.perf_counter() - start_time, 'upload_read')
+    if result_cache is None:
+        image = await decode_upload(contents)
+        return await predict_image(scheduler, image)
+
+    loop = asyncio.get_running_loop()
+    key = await loop.run_in_executor(decode_executor, plantid.hash_bytes, contents)
+    key = f"{version}:{key}"
+    outputs = result_cache.get(key)
+    if outputs is not None:
+        return outputs
+    image = await decode_upload(contents)
+    outputs, phash = await loop.run_in_executor(decode_executor, result_cache.get_by_image, image, version)
+    if outputs is None:
+        outputs = await predict_image(scheduler, image)
+    result_cache.put(key, outputs, phash)
+    return outputs
+
+
+async def predict_image(scheduler, image: np.ndarray) -> dict:
+    """
+    PlantIdentifier.predict outputs of a decoded picture, run again with
+    test-time augmentation when the top-1 probability is below TTA_THRESHOLD
 
-        return image_cv
+    Args:
+        scheduler: from lease_batch_scheduler
+        image: decoded picture
 
-    except Exception as e:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Failed to read picture file: {str(e)}"
-        )
+    Returns:
+        dict: predict outputs
+    """
+    outputs = await scheduler.predict_async(image)
+    if TTA is not None and plantid.PlantIdentifier.is_low_confidence(outputs, TTA_THRESHOLD):
+        outputs = await scheduler.predict_async(image, tta=TTA)
+    return outputs
+
+
+def get_topk_results(scheduler, outputs: dict, topk: int) -> dict:
+    """get_topk_results of the leased scheduler, timed as the topk stage"""
+    start_time = time.perf_counter()
+    results = scheduler.get_topk_results(outputs, topk)
+    plantid.STAGE_SECONDS.observe(time.perf_counter() - start_time, 'topk')
+    return results
+
+
+# ==================== metrics ====================
+
+def collect_cache_lookups():
+    """Lookups of the result cache and the invasive cache by result"""
+    values = {}
+    if result_cache is not None:
+        stats = result_cache.get_stats()
+        values[('result', 'hit')] = stats['hits'] - stats['perceptual_hits']
+        values[('result', 'perceptual_hit')] = stats['perceptual_hits']
+        values[('result', 'miss')] = stats['misses']
+    cache = invasive_checker.cache if invasive_checker is not None else None
+    if cache is not None:
+        values[('invasive', 'hit')] = cache.hits
+        values[('invasive', 'coalesced')] = cache.coalesced
+        values[('invasive', 'miss')] = cache.misses
+    return values
+
+
+def collect_external_api_events():
+    """Retries, failures and circuit breaker rejections of the invasive API client"""
+    client = invasive_checker.client if invasive_checker is not None else None
+    if client is None or not hasattr(client, 'get_stats'):
+        return {}
+    stats = client.get_stats()
+    return {(name,): stats[name] for name in ('requests', 'retries', 'failures', 'rejected')}
+
+
+plantid.REGISTRY.register(plantid.CallbackMetric(
+    'plantid_cache_lookups_total', 'Cache lookups by cache and result.',
+    collect_cache_lookups, ('cache', 'result'), type='counter'))
+plantid.REGISTRY.register(plantid.CallbackMetric(
+    'plantid_external_api_events_total', 'Invasive API client events.',
+    collect_external_api_events, ('event',), type='counter'))
+plantid.REGISTRY.register(plantid.CallbackMetric(
+    'plantid_requests_waiting', 'Requests waiting for a free slot of the request limiter.',
+    lambda: {(): request_limiter.num_waiting}))
 
 
 # ==================== API router ====================
@@ -165,32 +568,85 @@ async def root():
         "web_ui": "/static/index.html",
         "docs": "/docs",
         "health": "/health",
+        "metrics": "/metrics",
         "version": "1.0.0"
     }
 
 
+def get_cascade_stats() -> Optional[dict]:
+    """Routing statistics of the model cascade, None without one or in inference server mode"""
+    if model_manager is None or model_manager.model.identifier.cascade is None:
+        return None
+    return model_manager.model.identifier.cascade.get_stats()
+
+
+def get_model_status() -> Optional[dict]:
+    """Active model version and reload state, None in inference server mode"""
+    if model_manager is None:
+        return None
+    return model_manager.get_status()
+
+
 @app.get("/health", response_model=HealthResponse, tags=["System"])
 async def health_check():
     """
     to check model, health, running?
     """
-    identifier = load_model()
-    names, family_names, genus_names = identifier.get_plant_names()
+    names, family_names, genus_names = get_plant_names()
 
     return HealthResponse(
         status="healthy",
         model_loaded=True,
         supported_species=len(names),
         supported_genus=len(genus_names),
-        supported_family=len(family_names)
+        supported_family=len(family_names),
+        result_cache=result_cache.get_stats() if result_cache is not None else None,
+        cascade=get_cascade_stats(),
+        model=get_model_status()
     )
 
 
+@app.post("/admin/reload", tags=["System"])
+async def reload_model(
+    x_admin_token: Optional[str] = Header(None),
+    wait: bool = Query(True, description="Return once the new model serves instead of at once")
+):
+    """
+    Load the model files again and swap the new model in without downtime;
+    requests still on the old model finish on it, see plantid.ModelManager
+    """
+    if INFERENCE_SERVER:
+        raise HTTPException(status_code=409, detail="Reload the inference server instead, by restarting it")
+    if ADMIN_TOKEN is None:
+        raise HTTPException(status_code=403, detail="Reload is disabled, set PLANTID_ADMIN_TOKEN")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Wrong admin token")
+
+    future = load_model_manager().reload()
+    if not wait:
+        return {"status": "reloading", "model": get_model_status()}
+    try:
+        status = await asyncio.wrap_future(future)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Reload failed, still serving the old model: {str(e)}")
+    return {"status": "reloaded", "model": status}
+
+
+@app.get("/metrics", tags=["System"])
+async def metrics():
+    """
+    Prometheus metrics: per-stage latency histograms, predict status
+    counters, batch sizes, cascade routing, cache lookups and external API latency
+    """
+    return Response(content=plantid.REGISTRY.render(), media_type=plantid.MetricsRegistry.CONTENT_TYPE)
+
+
 @app.post("/identify", response_model=IdentifyResponse, tags=["Identificación"])
 async def identify_plant(
     file: UploadFile = File(..., description="Identificación de plantas API, usa jpg,png..."),
     topk: int = Query(5, ge=1, le=20, description="Return 5 results"),
-    location: Optional[str] = Query(None, description="User location for invasive species check")
+    location: Optional[str] = Query(None, description="User location for invasive species check"),
+    invasive_async: bool = Query(False, description="Return at once with invasive_job_id instead of waiting for the invasive check")
 ):
     """
     Return example：
@@ -200,6 +656,9 @@ async def identify_plant(
         "status": 0,
         "message": "True",
         "inference_time": 0.123,
+        "model_time": 0.123,
+        "enrichment_time": 0.0,
+        "invasive_job_id": null,
         "results": [
             {
                 "chinese_name": "一串红",
@@ -217,55 +676,67 @@ async def identify_plant(
             detail="Tipo de archivo incorrecto. Sube un archivo de imagen."
         )
 
-    # read image
-    image = await read_image_file(file)
+    async with request_limiter.acquire():
+        with lease_batch_scheduler() as (scheduler, version):
+            # read image and run identify
+            start_time = time.time()
+            outputs = get_topk_results(scheduler, await predict_upload(scheduler, version, file), topk)
+    model_time = time.time() - start_time
 
-    # load model
-    identifier = load_model()
-
-    # run identify
-    start_time = time.time()
-    outputs = identifier.identify(image, topk=topk)
-    
     # Invasive check for the top result
+    invasive_job_id = None
+    enrichment_start_time = time.time()
     if location and outputs['status'] == 0 and outputs['results']:
-        checker = load_invasive_checker()
         top_result = outputs['results'][0]
-        invasive_info = await checker.check_invasive(top_result['latin_name'], location)
-        top_result['invasive_info'] = invasive_info
-        
-    inference_time = time.time() - start_time
-
-    # response
-    response = IdentifyResponse(
-        status=outputs['status'],
-        message=outputs['message'],
-        inference_time=round(inference_time, 4),
-        results=[PlantResult(**item) for item in outputs.get('results', [])],
-        genus_results=[PlantResult(**item) for item in outputs.get('genus_results', [])],
-        family_results=[PlantResult(**item) for item in outputs.get('family_results', [])]
-    )
-
-    return response
+        prefetch_invasive(outputs['results'], location)
+        task = start_invasive_lookup(top_result['latin_name'], location)
+        if invasive_async:
+            invasive_job_id = encode_invasive_job_id(top_result['latin_name'], location)
+        else:
+            top_result['invasive_info'] = await asyncio.shield(task)
+    enrichment_time = time.time() - enrichment_start_time
+    if location:
+        plantid.STAGE_SECONDS.observe(enrichment_time, 'enrichment')
+
+    # response, serialized directly: the content already matches IdentifyResponse
+    return json_response({
+        "status": outputs['status'],
+        "message": outputs['message'],
+        "inference_time": round(model_time + enrichment_time, 4),
+        "model_time": round(model_time, 4),
+        "enrichment_time": round(enrichment_time, 4),
+        "invasive_job_id": invasive_job_id,
+        "results": to_plant_results(outputs.get('results', [])),
+        "genus_results": to_plant_results(outputs.get('genus_results', [])),
+        "family_results": to_plant_results(outputs.get('family_results', []))
+    })
 
 
 @app.post("/identify/quick", tags=["identift quick only ONE result"])
 async def identify_plant_quick(
     file: UploadFile = File(..., description="Upload plant image"),
-    location: Optional[str] = Query(None, description="User location for invasive species check")
+    location: Optional[str] = Query(None, description="User location for invasive species check"),
+    invasive_async: bool = Query(False, description="Return at once with invasive_job_id instead of waiting for the invasive check")
 ):
-    image = await read_image_file(file)
-    identifier = load_model()
-    start_time = time.time()
-    outputs = identifier.identify(image, topk=1)
-    
+    async with request_limiter.acquire():
+        with lease_batch_scheduler() as (scheduler, version):
+            start_time = time.time()
+            outputs = get_topk_results(scheduler, await predict_upload(scheduler, version, file), 1)
+    model_time = time.time() - start_time
+
     invasive_info = None
+    invasive_job_id = None
+    enrichment_start_time = time.time()
     if location and outputs['status'] == 0 and outputs['results']:
-        checker = load_invasive_checker()
         top_result = outputs['results'][0]
-        invasive_info = await checker.check_invasive(top_result['latin_name'], location)
-        
-    inference_time = time.time() - start_time
+        task = start_invasive_lookup(top_result['latin_name'], location)
+        if invasive_async:
+            invasive_job_id = encode_invasive_job_id(top_result['latin_name'], location)
+        else:
+            invasive_info = await asyncio.shield(task)
+    enrichment_time = time.time() - enrichment_start_time
+    if location:
+        plantid.STAGE_SECONDS.observe(enrichment_time, 'enrichment')
 
     if outputs['status'] != 0:
         return JSONResponse(
@@ -277,15 +748,56 @@ async def identify_plant_quick(
         )
 
     result = outputs['results'][0]
-    return {
+    return json_response({
         "status": 0,
         "message": "True",
-        "inference_time": round(inference_time, 4),
+        "inference_time": round(model_time + enrichment_time, 4),
+        "model_time": round(model_time, 4),
+        "enrichment_time": round(enrichment_time, 4),
         ##"chinese_name": result['chinese_name'],
         "latin_name": result['latin_name'],
         "probability": result['probability'],
-        "invasive_info": invasive_info
-    }
+        "invasive_info": invasive_info,
+        "invasive_job_id": invasive_job_id
+    })
+
+
+@app.get("/invasive/jobs/{job_id}", tags=["Invasive"])
+async def get_invasive_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=30, description="Seconds to wait for a pending check")
+):
+    """
+    Result of an invasive species check started with invasive_async=true
+
+    status is "pending" until the check finishes, then "done" with invasive_info,
+    or "error" if it failed or timed out
+    """
+    latin_name, location, issued_at = decode_invasive_job_id(job_id)
+    status, invasive_info = await wait_invasive_job(latin_name, location, issued_at, wait)
+    return {"job_id": job_id, "status": status, "latin_name": latin_name, "invasive_info": invasive_info}
+
+
+@app.get("/invasive/jobs/{job_id}/events", tags=["Invasive"])
+async def stream_invasive_job(job_id: str):
+    """
+    Server-sent events stream of an invasive species check: keep-alive
+    comments while pending, then one "invasive" event and the stream ends
+    """
+    latin_name, location, issued_at = decode_invasive_job_id(job_id)
+
+    async def events():
+        while True:
+            status, invasive_info = await wait_invasive_job(latin_name, location, issued_at, 10.0)
+            if status != "pending":
+                break
+            yield ": pending\n\n"
+        content = {"job_id": job_id, "status": status, "latin_name": latin_name, "invasive_info": invasive_info}
+        event = "invasive" if status == "done" else "error"
+        yield f"event: {event}\ndata: {json.dumps(content, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
 
 
 @app.get("/species", tags=["Species check"])
@@ -297,8 +809,7 @@ async def list_species(
     - **limit**: return limit（max 100）
     - **offset**: offset（multiple pages?）
     """
-    identifier = load_model()
-    names, _, _ = identifier.get_plant_names()
+    names, _, _ = get_plant_names()
 
     total = len(names)
     species_list = names[offset:offset + limit]
@@ -316,8 +827,7 @@ async def search_species(
     keyword: str = Query(..., min_length=1, description="keyword search"),
     limit: int = Query(20, ge=1, le=100, description="return limit")
 ):
-    identifier = load_model()
-    names, _, _ = identifier.get_plant_names()
+    names, _, _ = get_plant_names()
 
     matched_species = [name for name in names if keyword in name][:limit]
 
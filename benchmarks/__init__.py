@@ -0,0 +1,12 @@
+"""Reproducible benchmarks, run from the repository root:
+
+    python -m benchmarks.micro --output results/micro.json
+    python -m benchmarks.load --concurrency 1 8 32 --output results/load.json
+    python -m benchmarks.compare base/micro.json results/micro.json
+
+`micro` times the pipeline stages, `load` drives the FastAPI app with a
+mocked invasive API, and both write JSON tagged with the commit which
+`compare` diffs. Everything runs on CPU with synthetic images, and with a
+synthetic model when plantid/models has none. `preprocess` and
+`postprocess` compare the fused paths with the original implementations.
+"""
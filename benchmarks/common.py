@@ -0,0 +1,193 @@
+"""Helpers shared by the benchmarks: synthetic inputs, timing and result files."""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import platform
+import subprocess
+
+import cv2
+import numpy as np
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LABEL_MAP_PATH = os.path.join(REPO_DIR, 'plantid', 'models', 'quarrying_plantid_label_map.json')
+MODEL_FILENAME = 'quarrying_plantid_model.onnx'
+
+
+def parse_sizes(sizes):
+    """['640x480', ...] -> [(640, 480), ...]"""
+    return [tuple(int(item) for item in size.split('x')) for size in sizes]
+
+
+def parse_size_mix(text):
+    """'640x480:0.6,4032x3024:0.4' -> ([(640, 480), (4032, 3024)], [0.6, 0.4]),
+    weights are normalized to sum to 1; a missing weight counts as 1.
+    """
+    sizes, weights = [], []
+    for item in text.split(','):
+        size, _, weight = item.partition(':')
+        sizes.extend(parse_sizes([size]))
+        weights.append(float(weight or 1))
+    weights = np.asarray(weights) / np.sum(weights)
+    return sizes, weights.tolist()
+
+
+def make_image(width, height, seed=0):
+    """Synthetic BGR uint8 photo: noise smoothed by a down and up resize, so
+    that resizing and JPEG coding cost about as much as on real photos.
+    """
+    rng = np.random.default_rng(seed)
+    image = rng.integers(0, 256, (max(height // 8, 1), max(width // 8, 1), 3), dtype=np.uint8)
+    return cv2.resize(image, (width, height), interpolation=cv2.INTER_LINEAR)
+
+
+def encode_jpeg(image, quality=90):
+    ok, data = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError('Cannot encode the synthetic image!')
+    return data.tobytes()
+
+
+def build_synthetic_model(model_dir, label_map_path=LABEL_MAP_PATH, opset=13):
+    """Write a small random ONNX model with the interface of the real one
+    (NCHW float32 224x224 input, one logit per species of the label map)
+    and a copy of the label map to `model_dir`.
+
+    Two strided convolutions, global pooling and a linear layer: cheap, but
+    with the real output size, so pre- and postprocessing numbers are real
+    and forward numbers are only comparable to runs on the same model.
+    """
+    import onnx
+    from onnx import TensorProto, helper, numpy_helper
+
+    with open(label_map_path, 'r', encoding='utf-8') as f:
+        num_classes = len(json.load(f)['species_taxons'])
+    rng = np.random.default_rng(0)
+
+    def initializer(name, shape, scale):
+        return numpy_helper.from_array((rng.standard_normal(shape) * scale).astype(np.float32), name)
+
+    initializers = [
+        initializer('conv1_w', (32, 3, 3, 3), 0.2), initializer('conv1_b', (32,), 0.0),
+        initializer('conv2_w', (64, 32, 3, 3), 0.05), initializer('conv2_b', (64,), 0.0),
+        initializer('fc_w', (64, num_classes), 0.5), initializer('fc_b', (num_classes,), 0.0),
+    ]
+    conv_attrs = {'kernel_shape': [3, 3], 'strides': [2, 2], 'pads': [1, 1, 1, 1]}
+    nodes = [
+        helper.make_node('Conv', ['input', 'conv1_w', 'conv1_b'], ['conv1'], **conv_attrs),
+        helper.make_node('Relu', ['conv1'], ['relu1']),
+        helper.make_node('Conv', ['relu1', 'conv2_w', 'conv2_b'], ['conv2'], **conv_attrs),
+        helper.make_node('Relu', ['conv2'], ['relu2']),
+        helper.make_node('GlobalAveragePool', ['relu2'], ['pool']),
+        helper.make_node('Flatten', ['pool'], ['features']),
+        helper.make_node('Gemm', ['features', 'fc_w', 'fc_b'], ['logits']),
+    ]
+    graph = helper.make_graph(
+        nodes, 'synthetic_plantid',
+        [helper.make_tensor_value_info('input', TensorProto.FLOAT, ['N', 3, 224, 224])],
+        [helper.make_tensor_value_info('logits', TensorProto.FLOAT, ['N', num_classes])],
+        initializers)
+    # older IR version, so that older ONNX Runtime releases can load the model
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', opset)], ir_version=8)
+    onnx.checker.check_model(model)
+
+    os.makedirs(model_dir, exist_ok=True)
+    onnx.save(model, os.path.join(model_dir, MODEL_FILENAME))
+    shutil.copyfile(label_map_path, os.path.join(model_dir, os.path.basename(label_map_path)))
+    return model_dir
+
+
+def resolve_model_dir(model_dir, work_dir):
+    """`model_dir` if given, the package models if they include the model,
+    otherwise a synthetic model built once in `work_dir`.
+
+    Returns:
+        (model_dir, model name recorded in the results)
+    """
+    if model_dir is not None:
+        return model_dir, os.path.abspath(model_dir)
+    package_model_dir = os.path.dirname(LABEL_MAP_PATH)
+    if os.path.exists(os.path.join(package_model_dir, MODEL_FILENAME)):
+        return package_model_dir, 'plantid/models'
+    synthetic_model_dir = os.path.join(work_dir, 'synthetic_model')
+    if not os.path.exists(os.path.join(synthetic_model_dir, MODEL_FILENAME)):
+        build_synthetic_model(synthetic_model_dir)
+    return synthetic_model_dir, 'synthetic'
+
+
+def summarize(latencies):
+    """Statistics in milliseconds of latencies in seconds."""
+    latencies = np.asarray(latencies, dtype=np.float64) * 1000
+    if len(latencies) == 0:
+        return {'count': 0}
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]).tolist()
+    return {'count': len(latencies), 'mean_ms': float(latencies.mean()), 'median_ms': p50,
+            'p90_ms': p90, 'p99_ms': p99, 'min_ms': float(latencies.min()), 'max_ms': float(latencies.max())}
+
+
+def measure(func, repeats, min_seconds=0.0, warmup=1):
+    """Call `func` `warmup` times untimed, then at least `repeats` times and
+    for at least `min_seconds`, and summarize the per-call latencies.
+    """
+    for _ in range(warmup):
+        func()
+    latencies = []
+    end_time = time.perf_counter() + min_seconds
+    while len(latencies) < repeats or time.perf_counter() < end_time:
+        start_time = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start_time)
+    return summarize(latencies)
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _git(*args):
+    try:
+        return subprocess.run(['git', *args], cwd=REPO_DIR, capture_output=True, text=True,
+                              timeout=30).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+def get_environment():
+    """Commit and machine description stored with every result file, so
+    that results of different commits can be matched up and compared.
+    """
+    import onnxruntime
+    return {
+        'commit': _git('rev-parse', 'HEAD'),
+        'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'onnxruntime': onnxruntime.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def save_results(filename, suite, config, results):
+    """Write one result file: {'suite', 'environment', 'config', 'results'},
+    where results maps benchmark names to dicts of statistics.
+    """
+    content = {'suite': suite, 'environment': get_environment(), 'config': config, 'results': results}
+    if filename is None or filename == '-':
+        json.dump(content, sys.stdout, indent=2)
+        print()
+        return
+    dirname = os.path.dirname(filename)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(content, f, indent=2)
@@ -0,0 +1,111 @@
+"""Compare two benchmark result files, e.g. of two commits.
+
+    git checkout main && python -m benchmarks.micro --output base.json
+    git checkout my-branch && python -m benchmarks.micro --output new.json
+    python -m benchmarks.compare base.json new.json --threshold 0.1
+
+Metrics ending in `_ms` are better when lower, metrics ending in `_per_s`
+when higher. Changes beyond --threshold are marked; the exit code is 1 if
+any is a regression and --fail_on_regression is given.
+"""
+import sys
+import json
+import argparse
+
+
+_ENVIRONMENT_KEYS = ('machine', 'processor', 'cpu_count', 'onnxruntime', 'numpy', 'opencv', 'python')
+
+
+def load_results(filename):
+    with open(filename, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def flatten(results, prefix=''):
+    """{benchmark name: {metric: value}}, nested dicts become 'name/key' benchmarks."""
+    flat = {}
+    for name, value in results.items():
+        name = f'{prefix}{name}'
+        metrics = {key: item for key, item in value.items() if isinstance(item, (int, float))}
+        if metrics:
+            flat[name] = metrics
+        for key, item in value.items():
+            if isinstance(item, dict):
+                flat.update(flatten({key: item}, f'{name}/'))
+    return flat
+
+
+def get_direction(metric):
+    """-1 if lower is better, 1 if higher is better, 0 if not comparable."""
+    if metric.endswith('_ms'):
+        return -1
+    if metric.endswith('_per_s'):
+        return 1
+    return 0
+
+
+def compare(base, new, metrics, threshold):
+    """Rows of (benchmark, metric, base value, new value, relative change, mark)."""
+    base_results, new_results = flatten(base['results']), flatten(new['results'])
+    rows = []
+    for name in sorted(set(base_results) & set(new_results)):
+        for metric in sorted(set(base_results[name]) & set(new_results[name])):
+            direction = get_direction(metric)
+            if direction == 0 or (metrics and metric not in metrics):
+                continue
+            base_value, new_value = base_results[name][metric], new_results[name][metric]
+            if base_value == 0:
+                continue
+            change = (new_value - base_value) / base_value
+            mark = ''
+            if change * direction < -threshold:
+                mark = 'REGRESSION'
+            elif change * direction > threshold:
+                mark = 'improved'
+            rows.append((name, metric, base_value, new_value, change, mark))
+    return rows
+
+
+def describe(content, filename):
+    environment = content.get('environment', {})
+    commit = environment.get('commit', '')[:10] or 'unknown commit'
+    dirty = ' (dirty)' if environment.get('dirty') else ''
+    return f"{filename}: {content.get('suite')} suite, {commit}{dirty}, {environment.get('time', '')}"
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('base', type=str)
+    parser.add_argument('new', type=str)
+    parser.add_argument('--metrics', type=str, nargs='*',
+                        default=['median_ms', 'p99_ms', 'items_per_s', 'requests_per_s'],
+                        help='metrics to compare, none for every _ms and _per_s metric')
+    parser.add_argument('--threshold', type=float, default=0.05, help='relative change to mark')
+    parser.add_argument('--fail_on_regression', action='store_true')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+    base, new = load_results(args.base), load_results(args.new)
+    print(describe(base, args.base))
+    print(describe(new, args.new))
+    if base.get('suite') != new.get('suite'):
+        print(f"Warning: comparing a {base.get('suite')} suite with a {new.get('suite')} suite.")
+    for key in _ENVIRONMENT_KEYS:
+        base_value, new_value = base['environment'].get(key), new['environment'].get(key)
+        if base_value != new_value:
+            print(f'Warning: {key} differs, {base_value} vs {new_value}.')
+    if base['config'].get('model') != new['config'].get('model'):
+        print(f"Warning: model differs, {base['config'].get('model')} vs {new['config'].get('model')}.")
+
+    rows = compare(base, new, args.metrics, args.threshold)
+    width = max([len(row[0]) for row in rows] + [9])
+    print('{:<{}} {:<14} {:>12} {:>12} {:>8}'.format('benchmark', width, 'metric', 'base', 'new', 'change'))
+    for name, metric, base_value, new_value, change, mark in rows:
+        print('{:<{}} {:<14} {:>12.4f} {:>12.4f} {:>+7.1%} {}'.format(
+            name, width, metric, base_value, new_value, change, mark).rstrip())
+    num_regressions = sum(1 for row in rows if row[-1] == 'REGRESSION')
+    print(f'{len(rows)} metrics compared, {num_regressions} regression(s) beyond {args.threshold:.0%}.')
+    if args.fail_on_regression and num_regressions > 0:
+        sys.exit(1)
@@ -0,0 +1,222 @@
+"""End-to-end load generator for the FastAPI app.
+
+Starts app.py under uvicorn with the given model (a synthetic one by
+default, see `benchmarks.micro`) and the invasive API pointed at a local
+tools/mock_gemini_server.py, then keeps `concurrency` uploads in flight
+for `duration` seconds per concurrency level. Image sizes are drawn from
+--size_mix, a --location_rate fraction of requests ask for the invasive
+check. Reports latency percentiles and throughput per level and per size,
+plus the mean per-stage seconds from /metrics.
+
+    python -m benchmarks.load --concurrency 1 8 32 --output results/load.json
+    python -m benchmarks.load --url http://127.0.0.1:8000 --concurrency 16
+
+With --url the running server is used as is; its result cache will serve
+repeated synthetic images unless PLANTID_RESULT_CACHE_MB=0.
+"""
+import os
+import re
+import sys
+import time
+import asyncio
+import argparse
+import threading
+import subprocess
+
+import httpx
+import numpy as np
+
+from plantid.filecache import get_cache_dir
+
+from .common import (REPO_DIR, encode_jpeg, get_free_port, make_image, parse_size_mix,
+                     resolve_model_dir, save_results, summarize)
+
+sys.path.insert(0, os.path.join(REPO_DIR, 'tools'))
+import mock_gemini_server
+
+
+_STAGE_PATTERN = re.compile(r'^plantid_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$', re.M)
+
+
+def make_payloads(sizes, num_images):
+    """`num_images` different JPEG uploads per size."""
+    return {size: [encode_jpeg(make_image(size[0], size[1], seed=seed)) for seed in range(num_images)]
+            for size in sizes}
+
+
+def start_server(args, model_dir, mock_url):
+    port = get_free_port()
+    env = dict(os.environ)
+    env.setdefault('GEMINI_API_KEY', 'mock')
+    env.update({
+        'PLANTID_MODEL_DIR': model_dir,
+        'PLANTID_PRECISION': args.precision,
+        'PLANTID_INVASIVE_API_URL': mock_url,
+        # every lookup of a run goes to the mock API, not to a cache left by earlier runs
+        'PLANTID_INVASIVE_CACHE_PATH': '',
+        'PLANTID_INVASIVE_KB_PATH': '',
+        'PLANTID_RESULT_CACHE_MB': str(args.result_cache_mb),
+    })
+    command = [sys.executable, '-m', 'uvicorn', 'app:app', '--host', '127.0.0.1', '--port', str(port),
+               '--workers', str(args.workers), '--log-level', 'warning']
+    process = subprocess.Popen(command, cwd=REPO_DIR, env=env)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Server exited with code {process.returncode}!')
+        try:
+            if httpx.get(url + '/health', timeout=1).status_code == 200:
+                return process, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'Server did not start in {args.startup_timeout} seconds!')
+
+
+def get_stage_totals(client_url):
+    """{stage: (sum, count)} of plantid_stage_seconds; per worker process
+    when uvicorn runs several, so only indicative then.
+    """
+    try:
+        text = httpx.get(client_url + '/metrics', timeout=10).text
+    except httpx.HTTPError:
+        return {}
+    totals = {}
+    for kind, stage, value in _STAGE_PATTERN.findall(text):
+        total, count = totals.get(stage, (0.0, 0))
+        if kind == 'sum':
+            totals[stage] = (float(value), count)
+        else:
+            totals[stage] = (total, int(float(value)))
+    return totals
+
+
+async def run_level(url, args, payloads, weights, concurrency, duration, seed=0):
+    """Keep `concurrency` requests in flight for `duration` seconds.
+
+    Returns:
+        list of (size, seconds, status code or -1 for a client error).
+    """
+    sizes = list(payloads)
+    records = []
+    params = {'topk': args.topk}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=args.timeout) as client:
+        end_time = time.perf_counter() + duration
+
+        async def worker(worker_index):
+            rng = np.random.default_rng((seed, worker_index))
+            while time.perf_counter() < end_time:
+                size = sizes[rng.choice(len(sizes), p=weights)]
+                data = payloads[size][rng.integers(len(payloads[size]))]
+                request_params = dict(params)
+                if rng.random() < args.location_rate:
+                    request_params['location'] = args.locations[rng.integers(len(args.locations))]
+                start_time = time.perf_counter()
+                try:
+                    response = await client.post(args.endpoint, params=request_params,
+                                                 files={'file': ('image.jpg', data, 'image/jpeg')})
+                    status_code = response.status_code
+                except httpx.HTTPError:
+                    status_code = -1
+                records.append((size, time.perf_counter() - start_time, status_code))
+
+        await asyncio.gather(*[worker(k) for k in range(concurrency)])
+    return records
+
+
+def summarize_level(records, elapsed, stages_before, stages_after):
+    ok = [latency for _, latency, status_code in records if status_code == 200]
+    result = summarize(ok)
+    result['requests'] = len(records)
+    result['errors'] = len(records) - len(ok)
+    result['requests_per_s'] = len(ok) / elapsed
+    result['by_size'] = {}
+    for size in sorted({size for size, _, _ in records}):
+        latencies = [latency for one_size, latency, status_code in records
+                     if one_size == size and status_code == 200]
+        result['by_size']['{}x{}'.format(*size)] = summarize(latencies)
+    stage_mean_ms = {}
+    for stage, (total, count) in stages_after.items():
+        total_before, count_before = stages_before.get(stage, (0.0, 0))
+        if count > count_before:
+            stage_mean_ms[f'{stage}_ms'] = (total - total_before) / (count - count_before) * 1000
+    result['stage_mean_ms'] = stage_mean_ms
+    return result
+
+
+def benchmark(url, args, payloads, weights):
+    results = {}
+    if args.warmup > 0:
+        asyncio.run(run_level(url, args, payloads, weights, max(args.concurrency), args.warmup, seed=1))
+    print('{:>11} {:>9} {:>7} {:>10} {:>10} {:>10} {:>10}'.format(
+        'concurrency', 'requests', 'errors', 'req/s', 'p50(ms)', 'p90(ms)', 'p99(ms)'))
+    for concurrency in args.concurrency:
+        stages_before = get_stage_totals(url)
+        start_time = time.perf_counter()
+        records = asyncio.run(run_level(url, args, payloads, weights, concurrency, args.duration))
+        elapsed = time.perf_counter() - start_time
+        result = summarize_level(records, elapsed, stages_before, get_stage_totals(url))
+        results[f'{args.endpoint.strip("/")}/c{concurrency}'] = result
+        print('{:>11} {:>9} {:>7} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+            concurrency, result['requests'], result['errors'], result['requests_per_s'],
+            result.get('median_ms', float('nan')), result.get('p90_ms', float('nan')),
+            result.get('p99_ms', float('nan'))), flush=True)
+    return results
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', type=str, default=None, help='use a running server instead of starting one')
+    parser.add_argument('--model_dir', type=str, default=None,
+                        help='defaults to plantid/models, or a synthetic model if that has no model')
+    parser.add_argument('--work_dir', type=str, default=os.path.join(get_cache_dir(), 'benchmarks'))
+    parser.add_argument('--precision', type=str, default='fp32')
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn worker processes')
+    parser.add_argument('--result_cache_mb', type=float, default=0)
+    parser.add_argument('--startup_timeout', type=float, default=120)
+    parser.add_argument('--endpoint', type=str, default='/identify', choices=['/identify', '/identify/quick'])
+    parser.add_argument('--topk', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--duration', type=float, default=10, help='seconds per concurrency level')
+    parser.add_argument('--warmup', type=float, default=2, help='seconds of untimed requests before the first level')
+    parser.add_argument('--timeout', type=float, default=60, help='client timeout per request')
+    parser.add_argument('--size_mix', type=str, default='640x480:0.3,1920x1080:0.4,4032x3024:0.3',
+                        help="comma separated 'WxH:weight'")
+    parser.add_argument('--num_images', type=int, default=8, help='different images per size')
+    parser.add_argument('--location_rate', type=float, default=0.0,
+                        help='fraction of requests with a location, which calls the invasive API')
+    parser.add_argument('--locations', type=str, nargs='+', default=['Spain', 'France', 'California'])
+    parser.add_argument('--mock_latency', type=float, default=0.2, help='seconds per mock invasive API call')
+    parser.add_argument('--output', type=str, default=None, help='JSON result file, see benchmarks.compare')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+    sizes, weights = parse_size_mix(args.size_mix)
+    payloads = make_payloads(sizes, args.num_images)
+    config = dict(vars(args))
+
+    process = mock_server = None
+    url = args.url
+    try:
+        if url is None:
+            model_dir, config['model'] = resolve_model_dir(args.model_dir, args.work_dir)
+            mock_server = mock_gemini_server.serve('127.0.0.1', get_free_port(), args.mock_latency)
+            threading.Thread(target=mock_server.serve_forever, daemon=True).start()
+            mock_url = 'http://127.0.0.1:{}/v1beta/models/mock:generateContent'.format(mock_server.server_port)
+            process, url = start_server(args, model_dir, mock_url)
+        results = benchmark(url, args, payloads, weights)
+        if mock_server is not None:
+            results['mock_invasive_api'] = {'calls': mock_gemini_server.MockGeminiHandler.num_calls}
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if mock_server is not None:
+            mock_server.shutdown()
+    if args.output is not None:
+        save_results(args.output, 'load', config, results)
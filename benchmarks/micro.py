@@ -0,0 +1,114 @@
+"""Microbenchmarks of the identification pipeline, stage by stage.
+
+    python -m benchmarks.micro --output results/micro.json
+
+Stages: JPEG decode and `_preprocess` per image size, `forward` and
+`_postprocess` per batch size, family/genus roll-up, `top_k` and
+`get_topk_results` per k, and `predict` with each test-time augmentation
+mode per image size. Without --model_dir and without a model in
+plantid/models, a synthetic model is built (see `build_synthetic_model`),
+so only the forward numbers depend on the model.
+"""
+import os
+import sys
+import argparse
+
+import khandy
+import numpy as np
+
+import plantid
+from plantid.filecache import get_cache_dir
+from plantid.identifier import top_k
+
+from .common import encode_jpeg, make_image, measure, parse_sizes, resolve_model_dir, save_results
+
+
+SUITES = ('decode', 'preprocess', 'forward', 'postprocess', 'rollup', 'topk', 'tta')
+
+
+def make_outputs(identifier, batch_size, seed=0):
+    """`predict`-like outputs of random logits, peaked like real predictions."""
+    rng = np.random.default_rng(seed)
+    logits = rng.standard_normal((batch_size, len(identifier.names))).astype(np.float32) * 3
+    probs = khandy.softmax(logits)
+    return {'status': 0, 'message': 'OK', 'results': {
+        'probs': probs,
+        'family_probs': identifier.family_rollup(probs),
+        'genus_probs': identifier.genus_rollup(probs)}}
+
+
+def benchmark(identifier, suites, sizes, batch_sizes, topks, repeats, min_seconds):
+    results = {}
+
+    def run(name, func, num_items=1):
+        stats = measure(func, repeats, min_seconds)
+        stats['items_per_s'] = num_items * 1000 / stats['median_ms']
+        results[name] = stats
+        print('{:<28} {:>10.4f} {:>10.4f} {:>12.1f}'.format(
+            name, stats['median_ms'], stats['p90_ms'], stats['items_per_s']), flush=True)
+
+    print('{:<28} {:>10} {:>10} {:>12}'.format('benchmark', 'p50(ms)', 'p90(ms)', 'items/s'))
+    for width, height in sizes:
+        size = '{}x{}'.format(width, height)
+        image = make_image(width, height)
+        if 'decode' in suites:
+            data = encode_jpeg(image)
+            run(f'decode/{size}', lambda: plantid.decode_image(data, min_size=identifier.INPUT_SIZE))
+        if 'preprocess' in suites:
+            run(f'preprocess/{size}', lambda: identifier._preprocess(image))
+        if 'tta' in suites:
+            # as decoded by the service, at the smallest draft scale covering the views
+            for tta in (None,) + tuple(plantid.TTA_MODES):
+                decoded = plantid.decode_image(encode_jpeg(image), min_size=identifier.get_decode_size(tta))
+                run(f'predict/{tta or "single"}/{size}', lambda: identifier.predict(decoded, tta))
+
+    for batch_size in batch_sizes:
+        inputs = np.random.default_rng(0).standard_normal(
+            (batch_size, 3, identifier.INPUT_SIZE, identifier.INPUT_SIZE)).astype(np.float32)
+        raw_outputs = identifier.forward(inputs)
+        if 'forward' in suites:
+            run(f'forward/bs{batch_size}', lambda: identifier.forward(inputs), batch_size)
+        if 'postprocess' in suites:
+            run(f'postprocess/bs{batch_size}', lambda: identifier._postprocess(raw_outputs), batch_size)
+        if 'rollup' in suites:
+            probs = make_outputs(identifier, batch_size)['results']['probs']
+            run(f'rollup/family/bs{batch_size}', lambda: identifier.family_rollup(probs), batch_size)
+            run(f'rollup/genus/bs{batch_size}', lambda: identifier.genus_rollup(probs), batch_size)
+
+    if 'topk' in suites:
+        outputs = make_outputs(identifier, 1)
+        probs = outputs['results']['probs'][0]
+        for topk in topks:
+            k = topk if topk > 0 else len(probs)
+            name = 'all' if topk <= 0 else topk
+            run(f'top_k/k{name}', lambda: top_k(probs, k))
+            run(f'topk_results/k{name}', lambda: identifier.get_topk_results(outputs, topk))
+    return results
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_dir', type=str, default=None,
+                        help='defaults to plantid/models, or a synthetic model if that has no model')
+    parser.add_argument('--work_dir', type=str, default=os.path.join(get_cache_dir(), 'benchmarks'),
+                        help='where the synthetic model is built')
+    parser.add_argument('--precision', type=str, default='fp32')
+    parser.add_argument('--suites', type=str, nargs='+', default=list(SUITES), choices=SUITES)
+    parser.add_argument('--sizes', type=str, nargs='+', default=['640x480', '1920x1080', '4032x3024'])
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument('--topks', type=int, nargs='+', default=[1, 5, 20, 0], help='0 for all classes')
+    parser.add_argument('--repeats', type=int, default=20, help='minimum timed calls per benchmark')
+    parser.add_argument('--min_seconds', type=float, default=0.2, help='minimum timed seconds per benchmark')
+    parser.add_argument('--output', type=str, default=None, help='JSON result file, see benchmarks.compare')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+    model_dir, model_name = resolve_model_dir(args.model_dir, args.work_dir)
+    identifier = plantid.PlantIdentifier(model_dir, precision=args.precision)
+    results = benchmark(identifier, args.suites, parse_sizes(args.sizes), args.batch_sizes,
+                        args.topks, args.repeats, args.min_seconds)
+    if args.output is not None:
+        config = dict(vars(args), model=model_name, profile=vars(identifier.profile))
+        save_results(args.output, 'micro', config, results)
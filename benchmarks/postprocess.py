@@ -0,0 +1,132 @@
+"""Benchmark the per-request work after inference: top-k, result records and JSON response.
+
+The reference path is the original one: khandy.top_k, OrderedDict records
+with .item() per value, Pydantic models and the default JSONResponse;
+the lean path is get_topk_results and orjson, as in app.py.
+
+    python -m benchmarks.postprocess --topks 5 0
+"""
+import os
+import sys
+import time
+import argparse
+from collections import OrderedDict
+from typing import List, Optional
+
+import khandy
+import numpy as np
+import orjson
+from fastapi.responses import JSONResponse, Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+import plantid
+from plantid.filecache import get_cache_dir
+
+from .common import resolve_model_dir
+
+
+class PlantResult(BaseModel):
+    latin_name: str
+    probability: float
+    invasive_info: Optional[dict] = None
+
+
+class IdentifyResponse(BaseModel):
+    status: int
+    message: str
+    inference_time: float
+    results: List[PlantResult] = []
+    genus_results: List[PlantResult] = []
+    family_results: List[PlantResult] = []
+
+
+def reference_topk_results(identifier, outputs, topk):
+    if topk <= 0:
+        topk = max(len(identifier.names), len(identifier.family_names), len(identifier.genus_names))
+    taxonomy = identifier.taxonomy
+    levels = [('results', 'probs', identifier.names, taxonomy.species_latin_names),
+              ('family_results', 'family_probs', identifier.family_names, taxonomy.family_latin_names),
+              ('genus_results', 'genus_probs', identifier.genus_names, taxonomy.genus_latin_names)]
+    response = {"status": outputs['status'], "message": outputs['message']}
+    for key, probs_key, names, latin_names in levels:
+        probs = outputs['results'][probs_key]
+        topk_probs, topk_indices = khandy.top_k(probs, min(probs.shape[-1], topk))
+        items = []
+        for ind, prob in zip(topk_indices[0], topk_probs[0]):
+            one_result = OrderedDict()
+            one_result['chinese_name'] = names[ind]
+            one_result['latin_name'] = latin_names[ind]
+            one_result['probability'] = prob.item()
+            items.append(one_result)
+        response[key] = items
+    return response
+
+
+def reference_response(identifier, outputs, topk):
+    results = reference_topk_results(identifier, outputs, topk)
+    response = IdentifyResponse(
+        status=results['status'], message=results['message'], inference_time=0.0,
+        results=[PlantResult(**item) for item in results['results']],
+        genus_results=[PlantResult(**item) for item in results['genus_results']],
+        family_results=[PlantResult(**item) for item in results['family_results']])
+    # what FastAPI does with a response_model return value
+    return JSONResponse(jsonable_encoder(response)).body
+
+
+def lean_response(identifier, outputs, topk):
+    results = identifier.get_topk_results(outputs, topk)
+    def to_plant_results(items):
+        return [{"latin_name": item['latin_name'], "probability": item['probability'],
+                 "invasive_info": item.get('invasive_info')} for item in items]
+    return Response(orjson.dumps({
+        "status": results['status'], "message": results['message'], "inference_time": 0.0,
+        "results": to_plant_results(results['results']),
+        "genus_results": to_plant_results(results['genus_results']),
+        "family_results": to_plant_results(results['family_results'])}), media_type='application/json').body
+
+
+def time_it(func, repeats):
+    func()
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        func()
+    return (time.perf_counter() - start_time) / repeats * 1000
+
+
+def benchmark(identifier, topks, repeats):
+    rng = np.random.default_rng(0)
+    logits = rng.standard_normal((1, len(identifier.names))).astype(np.float32) * 3
+    probs = khandy.softmax(logits)
+    outputs = {"status": 0, "message": "OK", "results": {
+        'probs': probs,
+        'family_probs': identifier.family_rollup(probs),
+        'genus_probs': identifier.genus_rollup(probs)}}
+
+    print('{:>6} {:>14} {:>12} {:>8} {:>14} {:>12} {:>8}'.format(
+        'topk', 'khandy+dict', 'top_k+dict', 'speedup', 'pydantic(ms)', 'orjson(ms)', 'speedup'))
+    for topk in topks:
+        reference_topk_ms = time_it(lambda: reference_topk_results(identifier, outputs, topk), repeats)
+        topk_ms = time_it(lambda: identifier.get_topk_results(outputs, topk), repeats)
+        reference_ms = time_it(lambda: reference_response(identifier, outputs, topk), repeats)
+        lean_ms = time_it(lambda: lean_response(identifier, outputs, topk), repeats)
+        print('{:>6} {:>14.4f} {:>12.4f} {:>7.2f}x {:>14.4f} {:>12.4f} {:>7.2f}x'.format(
+            topk, reference_topk_ms, topk_ms, reference_topk_ms / topk_ms,
+            reference_ms, lean_ms, reference_ms / lean_ms))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_dir', type=str, default=None,
+                        help='defaults to plantid/models, or a synthetic model if that has no model')
+    parser.add_argument('--work_dir', type=str, default=os.path.join(get_cache_dir(), 'benchmarks'))
+    parser.add_argument('--topks', type=int, nargs='+', default=[1, 5, 20, 0], help='0 for all classes')
+    parser.add_argument('--repeats', type=int, default=200)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+    model_dir, _ = resolve_model_dir(args.model_dir, args.work_dir)
+    identifier = plantid.PlantIdentifier(model_dir)
+    benchmark(identifier, args.topks, args.repeats)
@@ -0,0 +1,62 @@
+"""Benchmark plantid.Preprocessor against the original khandy preprocessing.
+
+    python -m benchmarks.preprocess --sizes 640x480 4032x3024
+"""
+import sys
+import time
+import argparse
+
+import khandy
+import numpy as np
+
+import plantid
+
+
+def reference_preprocess(image):
+    image = khandy.resize_image_short(image, 224)
+    image = khandy.center_crop_image(image, 224, 224)
+    image = khandy.normalize_image_channel(image, swap_rb=True)
+    mean, stddev = [0.485, 0.456, 0.406], [0.229, 0.224, 0.225]
+    image = khandy.normalize_image_value(image, mean, stddev, 'auto')
+    image = np.transpose(image, (2,0,1))
+    image = np.expand_dims(image, axis=0)
+    return image
+
+
+def time_it(func, repeats):
+    func()
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        func()
+    return (time.perf_counter() - start_time) / repeats * 1000
+
+
+def benchmark(sizes, repeats, batch_size):
+    preprocessor = plantid.Preprocessor(224)
+    rng = np.random.default_rng(0)
+    print('{:>11} {:>12} {:>12} {:>8} {:>10}'.format('size', 'khandy(ms)', 'fused(ms)', 'speedup', 'max|diff|'))
+    for width, height in sizes:
+        image = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        # smooth the noise so the interpolation difference is representative of real photos
+        image = khandy.resize_image(khandy.resize_image(image, width // 8, height // 8), width, height)
+        buffer = preprocessor.get_buffer(batch_size)
+
+        reference_ms = time_it(lambda: reference_preprocess(image), repeats)
+        fused_ms = time_it(lambda: preprocessor(image, out=buffer[0]), repeats)
+        max_diff = np.abs(reference_preprocess(image)[0] - preprocessor(image)[0]).max()
+        print('{:>11} {:>12.3f} {:>12.3f} {:>7.2f}x {:>10.4f}'.format(
+            '{}x{}'.format(width, height), reference_ms, fused_ms, reference_ms / fused_ms, max_diff))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=str, nargs='+', default=['640x480', '1920x1080', '4032x3024', '3024x4032'])
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--batch_size', type=int, default=16)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+    sizes = [tuple(int(item) for item in size.split('x')) for size in args.sizes]
+    benchmark(sizes, args.repeats, args.batch_size)
@@ -0,0 +1,42 @@
+import os
+import sys
+import threading
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(REPO_DIR, 'tools'))
+# plantid.invasive requires a key at import, the mock server ignores it
+os.environ.setdefault('GEMINI_API_KEY', 'test')
+
+
+@pytest.fixture(scope='session')
+def synthetic_model_dir(tmp_path_factory):
+    """Small random model with the interface and label map of the real one, see benchmarks.common."""
+    from benchmarks.common import build_synthetic_model
+
+    model_dir = str(tmp_path_factory.mktemp('synthetic_model'))
+    build_synthetic_model(model_dir)
+    return model_dir
+
+
+@pytest.fixture
+def mock_gemini():
+    """Start tools/mock_gemini_server.py on a free port and yield its
+    generateContent URL; tests change the injected failures through the
+    MockGeminiHandler class attributes.
+    """
+    import mock_gemini_server
+
+    server = mock_gemini_server.serve('127.0.0.1', 0)
+    handler = mock_gemini_server.MockGeminiHandler
+    handler.num_calls = handler.num_errors = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+    try:
+        yield f'http://{host}:{port}/v1beta/models/mock:generateContent'
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
@@ -1,5 +1,5 @@
-import os
 import time
+import itertools
 
 import cv2
 import khandy
@@ -10,18 +10,19 @@ import plantid
 
 if __name__ == '__main__':
     src_dirs = [r'images']
-    src_filenames = sum([khandy.get_all_filenames(src_dir) for src_dir in src_dirs], [])
-    src_filenames = sorted(src_filenames, key=lambda t: os.stat(t).st_mtime, reverse=True)
+    src_filenames = itertools.chain.from_iterable(plantid.iter_image_files(src_dir) for src_dir in src_dirs)
 
     plant_identifier = plantid.PlantIdentifier()
     start_time = time.time()
-    for k, name in enumerate(src_filenames):
-        image = khandy.imread_cv(name)
+    # the stream decodes every file once in its workers and returns the image for display;
+    # a small prefetch keeps few full resolution images in memory while waiting for a key
+    stream = plant_identifier.identify_stream(src_filenames, topk=5, prefetch=2, return_images=True)
+    for k, (name, image, outputs) in enumerate(stream):
+        print('[{}] Time: {:.3f}s  {}'.format(k+1, time.time() - start_time, name))
+        start_time = time.time()
         if image is None:
             continue
-        outputs = plant_identifier.identify(image, topk=5)
-        print('[{}/{}] Time: {:.3f}s  {}'.format(k+1, len(src_filenames), time.time() - start_time, name))
-        start_time = time.time()
+        image = np.ascontiguousarray(image)
 
         if max(image.shape[:2]) > 1080:
             image = khandy.resize_image_long(image, 1080)
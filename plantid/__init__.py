@@ -1,2 +1,13 @@
 from .identifier import *
-
+from .batching import *
+from .cascade import *
+from .vector_index import *
+from .embedding import *
+from .model_manager import *
+from .taxonomy import *
+from .ort_profile import *
+from .preprocess import *
+from .image_io import *
+from .result_cache import *
+from .inference_server import *
+from .metrics import *
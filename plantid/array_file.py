@@ -0,0 +1,72 @@
+import json
+import struct
+
+import numpy as np
+
+
+ALIGNMENT = 64
+
+
+def _align(size):
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save_array_file(filename, magic, version, arrays, metadata=None):
+    """Save named numpy arrays to a binary file which `load_array_file` memory-maps.
+
+    Layout: magic, version and header length, a JSON header with the
+    `metadata` items and a description of every array under 'arrays', then
+    the raw arrays, each aligned to 64 bytes.
+    """
+    array_infos, contiguous, offset = {}, {}, 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        contiguous[name] = array
+        array_infos[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += _align(array.nbytes)
+    header = dict(metadata or {}, arrays=array_infos)
+    header_bytes = json.dumps(header).encode('utf-8')
+    prefix_size = len(magic) + 8 + len(header_bytes)
+
+    with open(filename, 'wb') as f:
+        f.write(magic)
+        f.write(struct.pack('<II', version, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b'\0' * (_align(prefix_size) - prefix_size))
+        for array in contiguous.values():
+            f.write(array.tobytes())
+            f.write(b'\0' * (_align(array.nbytes) - array.nbytes))
+
+
+def load_array_file(filename, magic, version, description, mmap=True):
+    """Load a file saved by `save_array_file`, memory-mapped read-only by default.
+
+    Returns:
+        (arrays, metadata): dict of the named arrays, and the other header items.
+
+    Raises:
+        ValueError: the file does not start with `magic`, or has another version;
+            `description` names the expected kind of file in the message.
+    """
+    if mmap:
+        buffer = np.memmap(filename, dtype=np.uint8, mode='r')
+    else:
+        buffer = np.fromfile(filename, dtype=np.uint8)
+    magic_size = len(magic)
+    if buffer[:magic_size].tobytes() != magic:
+        raise ValueError(f'{filename} is not a {description}!')
+    file_version, header_size = struct.unpack('<II', buffer[magic_size: magic_size + 8].tobytes())
+    if file_version != version:
+        raise ValueError(f'Unsupported {description} version {file_version}, expected {version}!')
+    header_start = magic_size + 8
+    header = json.loads(buffer[header_start: header_start + header_size].tobytes().decode('utf-8'))
+    data_start = _align(header_start + header_size)
+
+    arrays = {}
+    for name, info in header.pop('arrays').items():
+        dtype = np.dtype(info['dtype'])
+        count = int(np.prod(info['shape'], dtype=np.int64))
+        start = data_start + info['offset']
+        array = buffer[start: start + count * dtype.itemsize].view(dtype)
+        arrays[name] = array.reshape(info['shape'])
+    return arrays, header
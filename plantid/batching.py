@@ -0,0 +1,144 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from .metrics import BATCH_SIZE, STAGE_SECONDS
+from .preprocess import Preprocessor
+
+
+__all__ = ['BatchScheduler']
+
+
+class _Request(object):
+    __slots__ = ('image', 'tta', 'future', 'enqueue_time')
+
+    def __init__(self, image, tta=None):
+        self.image = image
+        self.tta = tta
+        self.future = Future()
+        self.enqueue_time = time.perf_counter()
+
+
+class BatchScheduler(object):
+    """Dynamic micro-batching in front of a `PlantIdentifier`.
+
+    Concurrent requests are collected by a background thread into one NCHW
+    tensor, which is run through a single `forward` call. A batch is closed
+    as soon as it holds `max_batch_size` images or the oldest request has
+    waited `max_wait_ms` milliseconds, whichever comes first.
+
+    Args:
+        identifier: PlantIdentifier instance.
+        max_batch_size: maximum number of images per forward call.
+        max_wait_ms: maximum time in milliseconds a request waits for
+            other requests to join its batch.
+    """
+    def __init__(self, identifier, max_batch_size=16, max_wait_ms=5.0):
+        if max_batch_size < 1:
+            raise ValueError(f'max_batch_size must be >= 1, got {max_batch_size}!')
+        if max_wait_ms < 0:
+            raise ValueError(f'max_wait_ms must be >= 0, got {max_wait_ms}!')
+        self.identifier = identifier
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='plantid-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, image, tta=None):
+        """Queue one image and return a `concurrent.futures.Future` which
+        resolves to the `PlantIdentifier.predict` outputs of that image.
+
+        With test-time augmentation mode `tta` all views of the image go
+        into the batch, see `PlantIdentifier.predict`.
+        """
+        if self._closed:
+            raise RuntimeError('BatchScheduler is closed!')
+        # reject unknown modes here rather than failing the whole batch
+        Preprocessor.get_num_views(tta)
+        request = _Request(image, tta)
+        self._queue.put(request)
+        return request.future
+
+    def predict(self, image, tta=None):
+        return self.submit(image, tta).result()
+
+    @property
+    def taxonomy(self):
+        return self.identifier.taxonomy
+
+    def get_topk_results(self, outputs, topk=5):
+        return self.identifier.get_topk_results(outputs, topk)
+
+    def identify(self, image, topk=5):
+        return self.identifier.get_topk_results(self.predict(image), topk)
+
+    async def predict_async(self, image, tta=None):
+        return await asyncio.wrap_future(self.submit(image, tta))
+
+    async def identify_async(self, image, topk=5):
+        outputs = await self.predict_async(image)
+        return self.identifier.get_topk_results(outputs, topk)
+
+    def close(self):
+        """Stop the worker thread after the queued requests are served."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = first.enqueue_time + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                if timeout <= 0:
+                    request = self._queue.get_nowait()
+                else:
+                    request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                # re-queue the sentinel so the loop stops after this batch
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                break
+            try:
+                self._run_batch(batch)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def _observe_batch(self, batch):
+        now = time.perf_counter()
+        for request in batch:
+            STAGE_SECONDS.observe(now - request.enqueue_time, 'queue_wait')
+        BATCH_SIZE.observe(len(batch))
+
+    def _run_batch(self, batch):
+        self._observe_batch(batch)
+        # one forward pass per augmentation mode, almost always just one
+        groups = {}
+        for request in batch:
+            groups.setdefault(request.tta, []).append(request)
+        for tta, requests in groups.items():
+            images = [request.image for request in requests]
+            outputs = self.identifier.predict_batch(images, batch_size=len(images), tta=tta)
+            for request, one_outputs in zip(requests, outputs):
+                request.future.set_result(one_outputs)
@@ -0,0 +1,75 @@
+import threading
+
+import numpy as np
+
+from .filecache import get_cache_dir
+from .identifier import OnnxModel, top_k
+from .metrics import CASCADE_IMAGES
+
+
+__all__ = ['ModelCascade']
+
+
+def get_escalation_mask(probs, min_prob, min_margin=0.0):
+    """Boolean mask of the rows of species `probs` whose top-1 probability
+    is below `min_prob` or whose margin over the top-2 is below `min_margin`.
+    """
+    topk_probs, _ = top_k(probs, 2)
+    mask = topk_probs[:, 0] < min_prob
+    if min_margin > 0 and topk_probs.shape[-1] > 1:
+        mask |= (topk_probs[:, 0] - topk_probs[:, 1]) < min_margin
+    return mask
+
+
+class ModelCascade(object):
+    """Confidence-gated early exit in front of the full model of a
+    `PlantIdentifier`.
+
+    A small, fast model with the same input and the same species as the
+    full model predicts every image first. Only images whose top-1 species
+    probability is below `min_prob`, or whose margin over the runner-up is
+    below `min_margin`, are run through the full model; the others are
+    answered by the small model alone. Use tools/eval_cascade.py to pick
+    thresholds which keep the agreement with the full model.
+
+    Args:
+        model_path: path of the small ONNX model, which outputs either
+            species logits or, like models exported by
+            tools/fuse_taxon_rollup.py, 'probs', 'genus_probs' and 'family_probs'.
+        min_prob: escalate images whose top-1 probability is below this.
+        min_margin: escalate images whose top-1 minus top-2 probability is below this.
+        use_cache, cache_dir, profile: see `PlantIdentifier`.
+    """
+    def __init__(self, model_path, min_prob=0.5, min_margin=0.0, use_cache=True, cache_dir=None, profile=None):
+        self.model_path = model_path
+        self.model = OnnxModel(model_path, cache_dir=get_cache_dir(cache_dir) if use_cache else None,
+                               profile=profile)
+        self.min_prob = min_prob
+        self.min_margin = min_margin
+        self.num_images = 0
+        self.num_escalated = 0
+        self._lock = threading.Lock()
+
+    def route(self, probs):
+        """Boolean mask of the rows of species `probs` of the small model
+        which need the full model, counted in the routing statistics.
+        """
+        mask = get_escalation_mask(probs, self.min_prob, self.min_margin)
+        num_escalated = int(np.count_nonzero(mask))
+        with self._lock:
+            self.num_images += len(mask)
+            self.num_escalated += num_escalated
+        CASCADE_IMAGES.inc('fast', amount=len(mask) - num_escalated)
+        CASCADE_IMAGES.inc('full', amount=num_escalated)
+        return mask
+
+    def get_stats(self):
+        with self._lock:
+            num_images, num_escalated = self.num_images, self.num_escalated
+        return {
+            'min_prob': self.min_prob,
+            'min_margin': self.min_margin,
+            'images': num_images,
+            'escalated': num_escalated,
+            'escalation_rate': num_escalated / num_images if num_images > 0 else 0.0,
+        }
@@ -0,0 +1,77 @@
+import itertools
+
+import numpy as np
+
+from .filecache import get_cache_dir
+from .identifier import EMBEDDING_OUTPUT, OnnxModel, PlantIdentifier, check_image_dtype_and_shape
+from .preprocess import Preprocessor
+from .vector_index import normalize_rows
+
+
+__all__ = ['EmbeddingExtractor']
+
+
+class EmbeddingExtractor(OnnxModel):
+    """Penultimate-layer embeddings of the plant model, for nearest-neighbour
+    search with `VectorIndex`.
+
+    The model needs the `embedding` output added by
+    tools/export_embedding_model.py; only that output is fetched. Images
+    are preprocessed like `PlantIdentifier`, embeddings are L2-normalized
+    float32 rows, so that dot products are cosine similarities.
+
+    Args:
+        model_path: path of the exported ONNX model.
+        use_cache, cache_dir, profile: see `PlantIdentifier`.
+    """
+    def __init__(self, model_path, use_cache=True, cache_dir=None, profile=None):
+        cache_dir = get_cache_dir(cache_dir) if use_cache else None
+        super(EmbeddingExtractor, self).__init__(model_path, cache_dir=cache_dir, profile=profile,
+                                                 output_names=[EMBEDDING_OUTPUT])
+        if EMBEDDING_OUTPUT not in [item.name for item in self.sess.get_outputs()]:
+            raise ValueError(f'{model_path} has no {EMBEDDING_OUTPUT} output, '
+                             'export it with tools/export_embedding_model.py!')
+        self.preprocessor = Preprocessor(PlantIdentifier.INPUT_SIZE)
+
+    def extract_tensor(self, inputs):
+        """Embeddings of a preprocessed NCHW float32 batch, shape (N, D)."""
+        embeddings = self.forward(inputs)
+        return normalize_rows(embeddings.reshape(len(inputs), -1))
+
+    def extract(self, image):
+        """Embedding of one BGR image, shape (D,)."""
+        check_image_dtype_and_shape(image)
+        return self.extract_tensor(self.preprocessor(image))[0]
+
+    def extract_batch(self, images, batch_size=32):
+        """Embeddings of a list (or an iterator) of images, one forward pass
+        per chunk of `batch_size` images.
+
+        Returns:
+            (embeddings, valid): float32 array of shape (num_images, D) and a
+            boolean array, False (and a zero row) where preprocessing failed.
+        """
+        embeddings, valid = [], []
+        images = iter(images)
+        while True:
+            chunk = list(itertools.islice(images, batch_size))
+            if len(chunk) == 0:
+                break
+            inputs, num_valid = self.preprocessor.get_buffer(len(chunk)), 0
+            for image in chunk:
+                try:
+                    check_image_dtype_and_shape(image)
+                    self.preprocessor(image, out=inputs[num_valid])
+                except Exception:
+                    valid.append(False)
+                    continue
+                valid.append(True)
+                num_valid += 1
+            if num_valid > 0:
+                embeddings.append(self.extract_tensor(inputs[:num_valid]))
+        valid = np.asarray(valid, dtype=bool)
+        dim = embeddings[0].shape[1] if embeddings else 0
+        results = np.zeros((len(valid), dim), dtype=np.float32)
+        if embeddings:
+            results[valid] = np.concatenate(embeddings)
+        return results, valid
@@ -0,0 +1,57 @@
+import os
+import re
+import glob
+import hashlib
+
+
+def get_cache_dir(cache_dir=None):
+    """Directory for derived artifacts (optimized ONNX graphs, label indices).
+
+    Defaults to `$PLANTID_CACHE_DIR`, then `~/.cache/plantid`.
+    """
+    if cache_dir is None:
+        cache_dir = os.getenv('PLANTID_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'plantid')
+    return cache_dir
+
+
+def get_cache_filename(cache_dir, src_path, suffix, *extra_keys):
+    """Cache filename derived from the path, size and mtime of `src_path`
+    and any `extra_keys`, so that a changed source never hits a stale entry.
+
+    The name is `<stem>.<path digest>.<key digest><suffix>`, so the entries
+    of one source under other keys can be found, see `remove_stale_cache_files`.
+    """
+    src_path = os.path.abspath(src_path)
+    stat = os.stat(src_path)
+    path_digest = hashlib.sha1(src_path.encode('utf-8')).hexdigest()[:8]
+    key = '|'.join([str(stat.st_size), str(stat.st_mtime_ns)] + list(extra_keys))
+    key_digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(src_path))[0]
+    return os.path.join(cache_dir, f'{stem}.{path_digest}.{key_digest}{suffix}')
+
+
+def remove_stale_cache_files(cache_filename):
+    """Remove the entries cached for the same source and suffix as
+    `cache_filename` under other keys, e.g. for an older version of the
+    source file; call after writing `cache_filename`.
+    """
+    dirname, basename = os.path.split(cache_filename)
+    match = re.match(r'^(.*\.[0-9a-f]{8}\.)[0-9a-f]{16}(.*)$', basename)
+    if match is None:
+        return
+    pattern = glob.escape(match.group(1)) + '[0-9a-f]' * 16 + glob.escape(match.group(2))
+    for filename in glob.glob(os.path.join(glob.escape(dirname), pattern)):
+        if os.path.basename(filename) == basename:
+            continue
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+
+def get_temp_filename(filename):
+    """Per-process temporary name for `filename`; finish with `os.replace`
+    so that concurrent workers never read a partially written file.
+    """
+    stem, ext = os.path.splitext(filename)
+    return f'{stem}.{os.getpid()}.tmp{ext}'
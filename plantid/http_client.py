@@ -0,0 +1,270 @@
+import os
+import time
+import random
+import asyncio
+import importlib.util
+from typing import Any, Dict, Optional
+
+import httpx
+
+from .metrics import EXTERNAL_API_SECONDS
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the upstream while the circuit breaker is open"""
+
+
+class DeadlineExceededError(Exception):
+    """Raised when a request cannot finish within its deadline"""
+
+
+class TokenBucket:
+    """
+    Async token bucket rate limiter
+
+    Args:
+        rate: tokens added per second, <= 0 for no limit
+        burst: bucket capacity
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self, deadline: Optional[float] = None):
+        """Wait for a token; raise DeadlineExceededError if it comes after deadline (time.monotonic())"""
+        if self.rate <= 0:
+            return
+        # the lock queues waiters, so tokens are handed out in FIFO order
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                wait_time = (1 - self._tokens) / self.rate
+                if deadline is not None and time.monotonic() + wait_time > deadline:
+                    raise DeadlineExceededError('rate limited beyond the request deadline')
+                await asyncio.sleep(wait_time)
+                self._refill()
+            self._tokens -= 1
+
+
+class CircuitBreaker:
+    """
+    Fail fast while the upstream is unhealthy
+
+    After failure_threshold consecutive failures the circuit opens and calls
+    are rejected for recovery_time seconds; then a single trial call is let
+    through (half-open), which closes the circuit on success or opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, recovery_time: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_time:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._trial_running = False
+
+    def release(self):
+        """End a call which neither succeeded nor failed, e.g. cancelled before reaching the upstream"""
+        self._trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_running = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+
+class ResilientClient:
+    """
+    httpx.AsyncClient with pool limits, rate limiting, retries and a circuit breaker
+
+    Every request gets a total budget of `timeout` seconds, shared by rate
+    limiting, all attempts and the backoff sleeps between them, so a slow
+    upstream cannot hold a caller longer than that.
+
+    Responses with RETRY_STATUS_CODES are retried and count as failures of
+    the circuit breaker, like other client errors (e.g. 401, 403), which are
+    returned without retries since every request would get them. 400 and
+    404 only concern the request; they neither count as failures nor reset
+    the failure count.
+
+    Args:
+        timeout: total seconds per request, including retries
+        attempt_timeout: max seconds per attempt
+        max_connections: connection pool size
+        max_keepalive_connections: idle connections kept open
+        keepalive_expiry: seconds to keep an idle connection
+        http2: use HTTP/2 if the h2 package is installed
+        rate: requests per second, <= 0 for no limit
+        burst: requests allowed at once above the rate
+        max_retries: retries after the first attempt
+        backoff_base: seconds of the first backoff, doubled per retry
+        backoff_max: cap of a single backoff
+        failure_threshold: consecutive failures which open the circuit
+        recovery_time: seconds before a trial call after the circuit opened
+    """
+
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+    NEUTRAL_STATUS_CODES = (400, 404)
+
+    def __init__(self, timeout: float = 30.0, attempt_timeout: float = 10.0,
+                 max_connections: int = 20, max_keepalive_connections: int = 10,
+                 keepalive_expiry: float = 60.0, http2: bool = True,
+                 rate: float = 0.0, burst: int = 10, max_retries: int = 2,
+                 backoff_base: float = 0.5, backoff_max: float = 8.0,
+                 failure_threshold: int = 5, recovery_time: float = 30.0):
+        self.timeout = timeout
+        self.attempt_timeout = attempt_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.http2 = http2 and importlib.util.find_spec('h2') is not None
+        limits = httpx.Limits(max_connections=max_connections,
+                              max_keepalive_connections=max_keepalive_connections,
+                              keepalive_expiry=keepalive_expiry)
+        self.client = httpx.AsyncClient(limits=limits, http2=self.http2, timeout=attempt_timeout)
+        self.rate_limiter = TokenBucket(rate, burst)
+        self.circuit_breaker = CircuitBreaker(failure_threshold, recovery_time)
+        self.num_requests = 0
+        self.num_retries = 0
+        self.num_failures = 0
+        self.num_rejected = 0
+
+    @classmethod
+    def from_env(cls, prefix: str = 'PLANTID_HTTP_') -> "ResilientClient":
+        """Build from environment variables named prefix + the upper-cased argument, e.g. PLANTID_HTTP_RATE"""
+        def get(name, default, type_=float):
+            return type_(os.getenv(prefix + name.upper(), str(default)))
+        return cls(
+            timeout=get('timeout', 30.0),
+            attempt_timeout=get('attempt_timeout', 10.0),
+            max_connections=get('max_connections', 20, int),
+            max_keepalive_connections=get('max_keepalive_connections', 10, int),
+            keepalive_expiry=get('keepalive_expiry', 60.0),
+            http2=get('http2', 1, int) == 1,
+            rate=get('rate', 0.0),
+            burst=get('burst', 10, int),
+            max_retries=get('max_retries', 2, int),
+            backoff_base=get('backoff_base', 0.5),
+            backoff_max=get('backoff_max', 8.0),
+            failure_threshold=get('failure_threshold', 5, int),
+            recovery_time=get('recovery_time', 30.0),
+        )
+
+    def get_backoff(self, attempt: int) -> float:
+        """Full jitter: uniform in [0, min(backoff_max, backoff_base * 2**attempt)]"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def post(self, url: str, timeout: Optional[float] = None, **kwargs) -> httpx.Response:
+        """
+        POST with retries; raises CircuitOpenError, DeadlineExceededError or
+        the last httpx error
+        """
+        start_time = time.perf_counter()
+        outcome = 'error'
+        try:
+            response = await self._post(url, timeout, **kwargs)
+            outcome = 'ok' if response.is_success else 'http_error'
+            return response
+        except CircuitOpenError:
+            outcome = 'rejected'
+            raise
+        except DeadlineExceededError:
+            outcome = 'deadline'
+            raise
+        finally:
+            EXTERNAL_API_SECONDS.observe(time.perf_counter() - start_time, outcome)
+
+    async def _post(self, url: str, timeout: Optional[float], **kwargs) -> httpx.Response:
+        self.num_requests += 1
+        deadline = time.monotonic() + (timeout or self.timeout)
+        attempt = 0
+        while True:
+            if not self.circuit_breaker.allow():
+                self.num_rejected += 1
+                raise CircuitOpenError('upstream circuit is open')
+            try:
+                await self.rate_limiter.acquire(deadline)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise DeadlineExceededError('request deadline exceeded')
+                response = await self.client.post(url, timeout=min(self.attempt_timeout, remaining), **kwargs)
+                if response.status_code in self.RETRY_STATUS_CODES:
+                    response.raise_for_status()
+            except (DeadlineExceededError, asyncio.CancelledError):
+                # not an upstream failure, release the trial call if any
+                self.circuit_breaker.release()
+                raise
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                self.circuit_breaker.record_failure()
+                self.num_failures += 1
+                backoff = self.get_backoff(attempt)
+                retry_after = getattr(getattr(e, 'response', None), 'headers', {}).get('Retry-After')
+                if retry_after is not None and retry_after.isdigit():
+                    backoff = max(backoff, float(retry_after))
+                if isinstance(e, httpx.TimeoutException) and time.monotonic() >= deadline:
+                    raise DeadlineExceededError('request deadline exceeded') from e
+                if attempt >= self.max_retries or time.monotonic() + backoff >= deadline:
+                    raise
+                attempt += 1
+                self.num_retries += 1
+                await asyncio.sleep(backoff)
+                continue
+            except Exception as e:
+                # not retried; a half-open trial must still end, or the circuit never closes
+                if isinstance(e, httpx.HTTPError):
+                    # e.g. DecodingError, TooManyRedirects
+                    self.circuit_breaker.record_failure()
+                    self.num_failures += 1
+                else:
+                    # e.g. InvalidURL, not the upstream's fault
+                    self.circuit_breaker.release()
+                raise
+            if response.status_code in self.NEUTRAL_STATUS_CODES:
+                self.circuit_breaker.release()
+            elif response.is_client_error:
+                self.circuit_breaker.record_failure()
+                self.num_failures += 1
+            else:
+                self.circuit_breaker.record_success()
+            return response
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'http2': self.http2,
+            'circuit_state': self.circuit_breaker.state,
+            'requests': self.num_requests,
+            'retries': self.num_retries,
+            'failures': self.num_failures,
+            'rejected': self.num_rejected,
+        }
+
+    async def aclose(self):
+        await self.client.aclose()
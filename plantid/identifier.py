@@ -1,25 +1,97 @@
 import os
-from collections import OrderedDict
+import time
+import platform
+import itertools
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import cv2
 import khandy
 import numpy as np
 import onnxruntime
 
+from .filecache import get_cache_dir, get_cache_filename, get_temp_filename, remove_stale_cache_files
+from .image_io import decode_image
+from .metrics import PREDICT_STATUS, STAGE_SECONDS, TTA_PREDICTIONS
+from .ort_profile import ExecutionProfile
+from .preprocess import Preprocessor
+from .taxonomy import TaxonomyIndex
+
+
+# extra output added by tools/export_embedding_model.py, see EmbeddingExtractor
+EMBEDDING_OUTPUT = 'embedding'
+
 
 class OnnxModel(object):
-    def __init__(self, model_path):
-        sess_options = onnxruntime.SessionOptions()
-        # # Set graph optimization level to ORT_ENABLE_EXTENDED to enable bert optimization.
-        # sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
-        # # Use OpenMP optimizations. Only useful for CPU, has little impact for GPUs.
-        # sess_options.intra_op_num_threads = multiprocessing.cpu_count()
-        onnx_gpu = (onnxruntime.get_device() == 'GPU')
-        providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if onnx_gpu else ['CPUExecutionProvider']
-        self.sess = onnxruntime.InferenceSession(model_path, sess_options, providers=providers)
+    """ONNX Runtime session wrapper.
+
+    Args:
+        model_path: path of the ONNX model.
+        cache_dir: if not None, the graph optimized by ONNX Runtime is saved
+            to this directory and loaded on later runs, which skips
+            re-optimizing the graph at every start. Only the portable levels
+            up to 'extended' are saved; the 'all' level adds its layout
+            optimizations, which depend on the CPU, when the cached graph is loaded.
+        profile: `ExecutionProfile`, name of one of its presets, or None to
+            read it from the `PLANTID_ORT_*` environment variables.
+        output_names: outputs fetched by `forward`, defaults to all but
+            the `EMBEDDING_OUTPUT` of tools/export_embedding_model.py.
+    """
+    def __init__(self, model_path, cache_dir=None, profile=None, output_names=None):
+        if profile is None:
+            profile = ExecutionProfile.from_env()
+        elif isinstance(profile, str):
+            profile = ExecutionProfile.preset(profile)
+        self.profile = profile
+        providers = profile.get_providers()
+        if cache_dir is None:
+            self.sess = onnxruntime.InferenceSession(model_path, profile.get_session_options(), providers=providers)
+        else:
+            self.sess = self._create_cached_session(model_path, cache_dir, providers)
         self._input_names = [item.name for item in self.sess.get_inputs()]
-        self._output_names = [item.name for item in self.sess.get_outputs()]
-        
+        if output_names is None:
+            output_names = [item.name for item in self.sess.get_outputs() if item.name != EMBEDDING_OUTPUT]
+        self._output_names = list(output_names)
+
+    def _create_cached_session(self, model_path, cache_dir, providers):
+        level = self.profile.graph_optimization_level
+        # ORT_ENABLE_ALL adds layouts for the CPU features of the machine, which another
+        # machine sharing the cache may lack, so the cache stops at ORT_ENABLE_EXTENDED
+        cached_level = 'extended' if level == 'all' else level
+        optimized_model_path = get_cache_filename(
+            cache_dir, model_path, '.optimized.onnx', onnxruntime.__version__, platform.machine(),
+            cached_level, *providers)
+        if os.path.exists(optimized_model_path):
+            try:
+                return self._create_optimized_session(optimized_model_path, providers)
+            except Exception as e:
+                pass
+
+        sess_options = self.profile.get_session_options()
+        if level != cached_level:
+            sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+        temp_path = get_temp_filename(optimized_model_path)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            sess_options.optimized_model_filepath = temp_path
+        except OSError:
+            temp_path = None
+        sess = onnxruntime.InferenceSession(model_path, sess_options, providers=providers)
+        if temp_path is not None and os.path.exists(temp_path):
+            os.replace(temp_path, optimized_model_path)
+            remove_stale_cache_files(optimized_model_path)
+            if level != cached_level:
+                return self._create_optimized_session(optimized_model_path, providers)
+        elif level != cached_level:
+            return onnxruntime.InferenceSession(model_path, self.profile.get_session_options(), providers=providers)
+        return sess
+
+    def _create_optimized_session(self, optimized_model_path, providers):
+        sess_options = self.profile.get_session_options()
+        if self.profile.graph_optimization_level != 'all':
+            sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+        return onnxruntime.InferenceSession(optimized_model_path, sess_options, providers=providers)
+
     @property
     def input_names(self):
         return self._input_names
@@ -41,6 +113,22 @@ class OnnxModel(object):
             return outputs
             
 
+def has_fused_rollup(model):
+    """Whether `model` outputs the genus and family probabilities itself,
+    like models exported by tools/fuse_taxon_rollup.py.
+    """
+    return {'probs', 'family_probs', 'genus_probs'}.issubset(model.output_names)
+
+
+def get_num_classes(model):
+    """Number of species of `model`, None if its output shape is dynamic."""
+    outputs = [item for item in model.sess.get_outputs() if item.name in model.output_names]
+    if has_fused_rollup(model):
+        outputs = [item for item in outputs if item.name == 'probs']
+    num_classes = outputs[0].shape[-1]
+    return num_classes if isinstance(num_classes, int) else None
+
+
 def check_image_dtype_and_shape(image):
     if not isinstance(image, np.ndarray):
         raise Exception(f'image is not np.ndarray!')
@@ -55,106 +143,528 @@ def check_image_dtype_and_shape(image):
             raise Exception(f'Unsupported image channel number, only support 1, 3 and 4, got {num_channels}!')
 
 
+def top_k(x, k):
+    """The k largest values along the last axis and their indices, sorted
+    in descending order; batched over any leading axes.
+
+    `k` is clipped to the axis size. Only the k winners are sorted: argmax
+    for k == 1, argpartition followed by a sort of k values otherwise, and a
+    single argsort when all values are requested.
+    """
+    num_classes = x.shape[-1]
+    k = min(k, num_classes)
+    if k == 1:
+        indices = np.argmax(x, axis=-1)[..., None]
+    elif k == num_classes:
+        indices = np.argsort(-x, axis=-1)
+    else:
+        indices = np.argpartition(x, num_classes - k, axis=-1)[..., num_classes - k:]
+        order = np.argsort(-np.take_along_axis(x, indices, axis=-1), axis=-1)
+        indices = np.take_along_axis(indices, order, axis=-1)
+    return np.take_along_axis(x, indices, axis=-1), indices
+
+
+class TaxonRollup(object):
+    """Sum species probabilities into superclass (genus or family) probabilities.
+
+    Species are permuted once so that every superclass covers a contiguous
+    range, which turns the roll-up of a whole batch into a single
+    `np.add.reduceat` call instead of a Python loop over superclasses.
+    """
+    def __init__(self, class_indices_list):
+        lengths = [len(class_indices) for class_indices in class_indices_list]
+        if min(lengths) == 0:
+            raise ValueError('Every superclass must contain at least one class!')
+        self.permutation = np.concatenate(class_indices_list).astype(np.intp)
+        self.offsets = np.concatenate([[0], np.cumsum(lengths[:-1])]).astype(np.intp)
+        self.lengths = np.asarray(lengths, dtype=np.intp)
+
+    @classmethod
+    def from_superclass_ids(cls, superclass_ids, num_superclasses=None):
+        """Build from the superclass id of every class."""
+        superclass_ids = np.asarray(superclass_ids)
+        lengths = np.bincount(superclass_ids, minlength=num_superclasses or 0)
+        order = np.argsort(superclass_ids, kind='stable')
+        return cls(np.split(order, np.cumsum(lengths)[:-1]))
+
+    @property
+    def num_superclasses(self):
+        return len(self.offsets)
+
+    def __call__(self, probs):
+        return np.add.reduceat(probs[..., self.permutation], self.offsets, axis=-1)
+
+    def to_matrix(self, num_classes, dtype=np.float32):
+        """Dense 0/1 matrix of shape (num_classes, num_superclasses), so that
+        `probs @ matrix` gives the superclass probabilities.
+        """
+        matrix = np.zeros((num_classes, self.num_superclasses), dtype=dtype)
+        superclass_indices = np.repeat(np.arange(self.num_superclasses), self.lengths)
+        matrix[self.permutation, superclass_indices] = 1
+        return matrix
+
+
+def load_taxonomy(model_dir, cache_dir=None):
+    """Load the label map of `model_dir` as a `TaxonomyIndex`.
+
+    Prefers the binary index built by tools/build_label_index.py, unless
+    it was built from another version of the JSON label map next to it.
+    Otherwise the JSON label map is parsed once and, if `cache_dir` is not
+    None, compiled into a binary index there which later runs memory-map.
+    """
+    label_index_path = os.path.join(model_dir, 'quarrying_plantid_label_index.bin')
+    label_map_path = os.path.join(model_dir, 'quarrying_plantid_label_map.json')
+    if os.path.exists(label_index_path):
+        try:
+            taxonomy = TaxonomyIndex.load(label_index_path)
+        except ValueError:
+            # written by an older TaxonomyIndex.VERSION, rebuild from the JSON if possible
+            if not os.path.exists(label_map_path):
+                raise
+            taxonomy = None
+        if taxonomy is not None and (not os.path.exists(label_map_path) or taxonomy.is_built_from(label_map_path)):
+            return taxonomy
+    if cache_dir is None:
+        return TaxonomyIndex.load_json(label_map_path)
+
+    cached_index_path = get_cache_filename(cache_dir, label_map_path, '.bin', str(TaxonomyIndex.VERSION))
+    if os.path.exists(cached_index_path):
+        try:
+            return TaxonomyIndex.load(cached_index_path)
+        except Exception as e:
+            pass
+    taxonomy = TaxonomyIndex.load_json(label_map_path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_path = get_temp_filename(cached_index_path)
+        taxonomy.save(temp_path)
+        os.replace(temp_path, cached_index_path)
+        remove_stale_cache_files(cached_index_path)
+    except OSError:
+        pass
+    return taxonomy
+
+
+def _make_results(probs, topk, names, latin_names):
+    topk_probs, topk_indices = top_k(probs[0], topk)
+    # convert all values at once, rather than one .item() or string lookup per value
+    return [{'chinese_name': name, 'latin_name': latin_name, 'probability': prob}
+            for name, latin_name, prob in zip(names.take(topk_indices), latin_names.take(topk_indices),
+                                              topk_probs.tolist())]
+
+
+def get_topk_results(taxonomy, outputs, topk=5):
+    """Convert `predict` outputs of a single image into top-k taxon results,
+    using the names of a `TaxonomyIndex`; see `PlantIdentifier.get_topk_results`.
+    """
+    assert isinstance(topk, int)
+    if topk <= 0:
+        topk = max(taxonomy.num_species, taxonomy.num_genera, taxonomy.num_families)
+
+    results, family_results, genus_results = [], [], []
+    status = outputs['status']
+    message = outputs['message']
+    if outputs['status'] != 0:
+        return {"status": status, "message": message, 
+                "results": results, "family_results": family_results,
+                "genus_results": genus_results}
+
+    results = _make_results(
+        outputs['results']['probs'], topk, taxonomy.species_chinese_names, taxonomy.species_latin_names)
+    family_results = _make_results(
+        outputs['results']['family_probs'], topk, taxonomy.family_chinese_names, taxonomy.family_latin_names)
+    genus_results = _make_results(
+        outputs['results']['genus_probs'], topk, taxonomy.genus_chinese_names, taxonomy.genus_latin_names)
+    return {"status": status, "message": message, 
+            "results": results, "family_results": family_results,
+            "genus_results": genus_results}
+
+
+_preprocessor = Preprocessor(224)
+_END_OF_ITEMS = object()
+
+
 class PlantIdentifier(OnnxModel):
-    def __init__(self, model_dir=None):
+    """
+    Args:
+        model_dir: directory of the model and the label map, defaults to
+            the `models` directory of this package.
+        use_cache: whether to cache the optimized ONNX graph and the
+            compiled label index, which makes later starts faster.
+        cache_dir: cache directory, see `get_cache_dir`.
+        profile: ONNX Runtime execution profile, see `OnnxModel`.
+        precision: model variant, one of `MODEL_FILENAMES`. Quantized
+            variants are produced by tools/quantize_model.py.
+        cascade: optional `ModelCascade`, whose small model answers
+            confident images without running the full model.
+    """
+    INPUT_SIZE = 224
+    MODEL_FILENAMES = {
+        'fp32': 'quarrying_plantid_model.onnx',
+        'fp16': 'quarrying_plantid_model_fp16.onnx',
+        'int8_dynamic': 'quarrying_plantid_model_int8_dynamic.onnx',
+        'int8_static': 'quarrying_plantid_model_int8_static.onnx',
+    }
+
+    def __init__(self, model_dir=None, use_cache=True, cache_dir=None, profile=None, precision='fp32',
+                 cascade=None):
+        model_dir = self.get_model_dir(model_dir)
+        self.model_dir = model_dir
+        cache_dir = get_cache_dir(cache_dir) if use_cache else None
+        self.precision = precision
+        model_path = self.get_model_paths(model_dir, precision)[0]
+        super(PlantIdentifier, self).__init__(model_path, cache_dir=cache_dir, profile=profile)
+        
+        self.taxonomy = load_taxonomy(model_dir, cache_dir)
+        self.names = self.taxonomy.species_chinese_names
+        self.family_names = self.taxonomy.family_chinese_names
+        self.genus_names = self.taxonomy.genus_chinese_names
+        self.family_rollup = TaxonRollup.from_superclass_ids(
+            self.taxonomy.species_family_ids, self.taxonomy.num_families)
+        self.genus_rollup = TaxonRollup.from_superclass_ids(
+            self.taxonomy.species_genus_ids, self.taxonomy.num_genera)
+        # models exported by tools/fuse_taxon_rollup.py compute the roll-ups in the graph
+        self.fused_rollup = has_fused_rollup(self)
+        self.cascade = cascade
+        if cascade is not None:
+            num_classes = get_num_classes(cascade.model)
+            if num_classes not in (None, self.taxonomy.num_species):
+                raise ValueError(f'Cascade model has {num_classes} classes, expected {self.taxonomy.num_species}!')
+
+    @staticmethod
+    def get_model_dir(model_dir=None):
         if model_dir is None:
             current_dir = os.path.dirname(os.path.abspath(__file__))
             model_dir = os.path.join(current_dir, 'models')
-        model_path = os.path.join(model_dir, 'quarrying_plantid_model.onnx')
-        super(PlantIdentifier, self).__init__(model_path)
-        
-        label_map_path = os.path.join(model_dir, 'quarrying_plantid_label_map.json')
-        self.label_map = khandy.load_json(label_map_path)
-        self.names = [value['chinese_name'] for value in self.label_map['species_taxons'].values()]
-        self.family_names = list(self.label_map['family_taxons'].keys())
-        self.genus_names = list(self.label_map['genus_taxons'].keys())
-        self.family_class_indices = [value['class_indices'] for value in self.label_map['family_taxons'].values()]
-        self.genus_class_indices = [value['class_indices'] for value in self.label_map['genus_taxons'].values()]
+        return model_dir
+
+    @classmethod
+    def get_model_paths(cls, model_dir=None, precision='fp32'):
+        """Paths of the model and of the label map (binary index and JSON)
+        loaded from `model_dir`; the model comes first.
+        """
+        if precision not in cls.MODEL_FILENAMES:
+            raise ValueError(f'Unsupported precision, only support {list(cls.MODEL_FILENAMES)}, got {precision}!')
+        model_dir = cls.get_model_dir(model_dir)
+        return [os.path.join(model_dir, cls.MODEL_FILENAMES[precision]),
+                os.path.join(model_dir, 'quarrying_plantid_label_index.bin'),
+                os.path.join(model_dir, 'quarrying_plantid_label_map.json')]
 
     @staticmethod
-    def _preprocess(image):
+    def _preprocess(image, tta=None):
         check_image_dtype_and_shape(image)
+        if tta is None:
+            return _preprocessor(image)
+        num_views = _preprocessor.get_num_views(tta)
+        inputs = np.empty((num_views, 3, _preprocessor.input_size, _preprocessor.input_size), dtype=np.float32)
+        return _preprocessor.augment(image, tta, inputs)
 
-        # image size normalization
-        image = khandy.resize_image_short(image, 224)
-        image = khandy.center_crop(image, 224, 224)
-        # image channel normalization
-        image = khandy.normalize_image_channel(image, swap_rb=True)
-        # image dtype and value range normalization
-        mean, stddev = [0.485, 0.456, 0.406], [0.229, 0.224, 0.225]
-        image = khandy.normalize_image_value(image, mean, stddev, 'auto')
-        # to tensor
-        image = np.transpose(image, (2,0,1))
-        image = np.expand_dims(image, axis=0)
-        return image
+    @staticmethod
+    def get_decode_size(tta=None):
+        """`min_size` to decode images with for test-time augmentation mode `tta`,
+        see `decode_image`.
+        """
+        return _preprocessor.get_min_size(tta)
+
+    @staticmethod
+    def is_low_confidence(outputs, threshold):
+        """Whether successful `predict` outputs have a top-1 species probability below `threshold`."""
+        return outputs['status'] == 0 and float(outputs['results']['probs'][0].max()) < threshold
         
+    def warmup(self, batch_sizes=(1,)):
+        """Run dummy batches through the session, so that the first real
+        requests do not pay for memory allocation and kernel selection.
+        """
+        for batch_size in batch_sizes:
+            inputs = np.zeros((batch_size, 3, self.INPUT_SIZE, self.INPUT_SIZE), dtype=np.float32)
+            self._postprocess(self.forward(inputs))
+            if self.cascade is not None:
+                self._postprocess(self.cascade.model.forward(inputs), self.cascade.model)
+
     def get_plant_names(self):
         return self.names, self.family_names, self.genus_names
         
-    def predict(self, image):
+    def _postprocess(self, outputs, model=None):
+        """Species, family and genus probabilities of the raw outputs of
+        `model`, this model by default.
+        """
+        model = self if model is None else model
+        if has_fused_rollup(model):
+            outputs = dict(zip(model.output_names, outputs))
+            return {'probs': outputs['probs'], 
+                    'family_probs': outputs['family_probs'], 
+                    'genus_probs': outputs['genus_probs'],}
+        probs = khandy.softmax(outputs)
+        family_probs = self.family_rollup(probs)
+        genus_probs = self.genus_rollup(probs)
+        return {'probs': probs, 'family_probs': family_probs, 'genus_probs': genus_probs,}
+
+    def predict(self, image, tta=None, tta_threshold=None):
+        """
+        Args:
+            tta: test-time augmentation mode, None, 'flip' or 'multicrop5',
+                see `Preprocessor.augment`. All views of the image are run as
+                one batch and their logits are averaged before the roll-ups.
+            tta_threshold: if given, predict without augmentation first and
+                run again with `tta` only when the top-1 species probability
+                is below this threshold.
+        """
+        if tta is not None and tta_threshold is not None:
+            outputs = self.predict(image)
+            if not self.is_low_confidence(outputs, tta_threshold):
+                return outputs
+
+        start_time = time.perf_counter()
         try:
-            inputs = self._preprocess(image)
+            inputs = self._preprocess(image, tta)
         except Exception as e:
+            PREDICT_STATUS.inc(-1)
             return {"status": -1, "message": "Inference preprocess error.", "results": {}}
+        STAGE_SECONDS.observe(time.perf_counter() - start_time, 'preprocess')
+        if tta is not None:
+            TTA_PREDICTIONS.inc(tta)
+        return self.predict_tensor(inputs, len(inputs))[0]
         
+    def predict_batch(self, images, batch_size=32, tta=None):
+        """Predict a list (or an iterator) of images.
+
+        Images are preprocessed into one contiguous tensor and run through
+        a single forward pass per chunk of `batch_size` images. With `tta`,
+        see `predict`, a chunk holds all views of its images.
+
+        Returns:
+            list of `predict` outputs, one per image and in input order, each
+            with its own status. Result arrays keep a leading batch axis of 1.
+        """
+        assert isinstance(batch_size, int) and batch_size >= 1
+        num_views = _preprocessor.get_num_views(tta)
+        outputs = []
+        images = iter(images)
+        while True:
+            chunk = list(itertools.islice(images, batch_size))
+            if len(chunk) == 0:
+                break
+            outputs.extend(self._predict_chunk(chunk, tta, num_views))
+        return outputs
+
+    def _predict_chunk(self, images, tta=None, num_views=1):
+        outputs = [None] * len(images)
+        # preprocess straight into the reusable batch buffer of this thread
+        inputs, valid_indices = _preprocessor.get_buffer(len(images) * num_views), []
+        for k, image in enumerate(images):
+            start_time = time.perf_counter()
+            start = len(valid_indices) * num_views
+            try:
+                check_image_dtype_and_shape(image)
+                if tta is None:
+                    _preprocessor(image, out=inputs[start])
+                else:
+                    _preprocessor.augment(image, tta, out=inputs[start: start + num_views])
+            except Exception as e:
+                PREDICT_STATUS.inc(-1)
+                outputs[k] = {"status": -1, "message": "Inference preprocess error.", "results": {}}
+                continue
+            STAGE_SECONDS.observe(time.perf_counter() - start_time, 'preprocess')
+            valid_indices.append(k)
+        if len(valid_indices) == 0:
+            return outputs
+        if tta is not None:
+            TTA_PREDICTIONS.inc(tta, amount=len(valid_indices))
+
+        inputs = inputs[:len(valid_indices) * num_views]
+        for k, one_outputs in zip(valid_indices, self.predict_tensor(inputs, num_views)):
+            outputs[k] = one_outputs
+        return outputs
+
+    def predict_tensor(self, inputs, num_views=1):
+        """Predict an already preprocessed NCHW float32 batch, e.g. filled
+        with `Preprocessor.normalize` by a pipeline which decodes elsewhere.
+
+        Args:
+            num_views: number of consecutive rows which are views of one
+                image, see `Preprocessor.augment`. Their logits are averaged,
+                or their probabilities for models with fused roll-ups.
+
+        Returns:
+            list of `predict` outputs, one per image, i.e. per `num_views` rows.
+        """
+        num_images = len(inputs) // num_views
+        failed = set()
         try:
-            logits = self.forward(inputs)
-            probs = khandy.softmax(logits)
+            if self.cascade is None:
+                results = self._infer(self, inputs, num_views)
+            else:
+                results, failed_indices = self._infer_cascade(inputs, num_views)
+                failed = set(failed_indices.tolist())
         except Exception as e:
-            return {"status": -2, "message": "Inference error.", "results": {}}
-            
-        family_probs = khandy.sum_by_indices_list(probs, self.family_class_indices, axis=-1)
-        genus_probs = khandy.sum_by_indices_list(probs, self.genus_class_indices, axis=-1)
-        results = {'probs': probs, 'family_probs': family_probs, 'genus_probs': genus_probs,}
-        return {"status": 0, "message": "OK", "results": results}
-        
-    def identify(self, image, topk=5):
-        assert isinstance(topk, int)
-        if topk <= 0:
-            topk = max(len(self.names), len(self.family_names), len(self.genus_names))
-
-        results, family_results, genus_results = [], [], []
-        outputs = self.predict(image)
-        status = outputs['status']
-        message = outputs['message']
-        if outputs['status'] != 0:
-            return {"status": status, "message": message, 
-                    "results": results, "family_results": family_results,
-                    "genus_results": genus_results}
-                    
-        probs = outputs['results']['probs']
-        family_probs = outputs['results']['family_probs']
-        genus_probs = outputs['results']['genus_probs']
-
-        taxon_topk = min(probs.shape[-1], topk)
-        topk_probs, topk_indices = khandy.top_k(probs, taxon_topk)
-        for ind, prob in zip(topk_indices[0], topk_probs[0]):
-            label_info = self.label_map['species_taxons'][str(ind)]
-            one_result = OrderedDict()
-            one_result['chinese_name'] = label_info['chinese_name']
-            one_result['latin_name'] = label_info['latin_name']
-            one_result['probability'] = prob.item()
-            results.append(one_result)
-
-        family_topk = min(family_probs.shape[-1], topk)
-        family_topk_probs, family_topk_indices = khandy.top_k(family_probs, family_topk)
-        for ind, prob in zip(family_topk_indices[0], family_topk_probs[0]):
-            one_result = OrderedDict()
-            one_result['chinese_name'] = self.family_names[ind]
-            one_result['latin_name'] = self.label_map['family_taxons'][self.family_names[ind]]['latin_name']
-            one_result['probability'] = prob.item()
-            family_results.append(one_result)
-            
-        genus_topk = min(genus_probs.shape[-1], topk)
-        genus_topk_probs, genus_topk_indices = khandy.top_k(genus_probs, genus_topk)
-        for ind, prob in zip(genus_topk_indices[0], genus_topk_probs[0]):
-            one_result = OrderedDict()
-            one_result['chinese_name'] = self.genus_names[ind]
-            one_result['latin_name'] = self.label_map['genus_taxons'][self.genus_names[ind]]['latin_name']
-            one_result['probability'] = prob.item()
-            genus_results.append(one_result)
-            
-        return {"status": status, "message": message, 
-                "results": results, "family_results": family_results,
-                "genus_results": genus_results}
-                
+            PREDICT_STATUS.inc(-2, amount=num_images)
+            return [{"status": -2, "message": "Inference error.", "results": {}} for _ in range(num_images)]
+        PREDICT_STATUS.inc(0, amount=num_images - len(failed))
+        if failed:
+            PREDICT_STATUS.inc(-2, amount=len(failed))
+
+        outputs = []
+        for row in range(num_images):
+            if row in failed:
+                outputs.append({"status": -2, "message": "Inference error.", "results": {}})
+                continue
+            one_results = {key: value[row:row+1] for key, value in results.items()}
+            outputs.append({"status": 0, "message": "OK", "results": one_results})
+        return outputs
+
+    def _infer(self, model, inputs, num_views, stage=''):
+        """Probabilities per image of `model` for `inputs` holding `num_views` rows per image."""
+        num_images = len(inputs) // num_views
+        fused_rollup = has_fused_rollup(model)
+        start_time = time.perf_counter()
+        raw_outputs = model.forward(inputs)
+        forward_time = time.perf_counter()
+        if num_views > 1 and not fused_rollup:
+            raw_outputs = raw_outputs.reshape(num_images, num_views, -1).mean(axis=1)
+        results = self._postprocess(raw_outputs, model)
+        if num_views > 1 and fused_rollup:
+            results = {key: value.reshape(num_images, num_views, -1).mean(axis=1)
+                       for key, value in results.items()}
+        STAGE_SECONDS.observe(forward_time - start_time, stage + 'forward')
+        STAGE_SECONDS.observe(time.perf_counter() - forward_time, stage + 'postprocess')
+        return results
+
+    def _infer_cascade(self, inputs, num_views):
+        """Like `_infer`, plus the indices of the images without a result."""
+        try:
+            results = self._infer(self.cascade.model, inputs, num_views, 'cascade_')
+        except Exception as e:
+            # the full model answers everything when the small one fails
+            return self._infer(self, inputs, num_views), np.empty(0, dtype=np.int64)
+        indices = np.flatnonzero(self.cascade.route(results['probs']))
+        if len(indices) == 0:
+            return results, indices
+        if num_views > 1:
+            rows = (indices[:, None] * num_views + np.arange(num_views)).ravel()
+        else:
+            rows = indices
+        try:
+            full_results = self._infer(self, inputs[rows], num_views)
+        except Exception as e:
+            # the confident answers of the small model stand, only the escalated images fail
+            return results, indices
+        for key, value in full_results.items():
+            results[key][indices] = value
+        return results, indices[:0]
+
+    def identify(self, image, topk=5, tta=None, tta_threshold=None):
+        """See `predict` for `tta` and `tta_threshold`."""
+        return self.get_topk_results(self.predict(image, tta, tta_threshold), topk)
+
+    def predict_stream(self, items, ordered=True, prefetch=64, batch_size=32, num_workers=4, return_images=False):
+        """Predict a (possibly endless) iterable of images or image paths lazily.
+
+        Up to `prefetch` items are read, decoded and cropped ahead by
+        `num_workers` threads. Whatever is ready is run as one batch of at
+        most `batch_size` images, so the first result comes back after the
+        first image, and memory does not grow with the number of items.
+
+        Args:
+            items: iterable of BGR uint8 images or image paths, e.g.
+                `iter_image_files(dirname)`.
+            ordered: yield in input order, otherwise as soon as ready.
+            return_images: also yield the decoded image of every item, e.g.
+                to display it without decoding it again. Paths are then
+                decoded at full resolution; see `decode_image` for the
+                layout of the arrays.
+
+        Yields:
+            (item, outputs) pairs, outputs as returned by `predict`, or
+            (item, image, outputs) triples with `return_images`, image None
+            when decoding failed.
+        """
+        assert prefetch >= 1 and batch_size >= 1
+        items = iter(items)
+        executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='plantid-stream')
+        futures, pending = {}, deque() if ordered else set()
+        try:
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < prefetch:
+                    item = next(items, _END_OF_ITEMS)
+                    if item is _END_OF_ITEMS:
+                        exhausted = True
+                        break
+                    future = executor.submit(self._load_for_stream, item, return_images)
+                    futures[future] = item
+                    if ordered:
+                        pending.append(future)
+                    else:
+                        pending.add(future)
+                if len(pending) == 0:
+                    break
+
+                if ordered:
+                    wait([pending[0]])
+                    batch = [pending.popleft()]
+                    while pending and pending[0].done() and len(batch) < batch_size:
+                        batch.append(pending.popleft())
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    batch = list(itertools.islice(done, batch_size))
+                    pending.difference_update(batch)
+                yield from self._predict_loaded([(futures.pop(future), future) for future in batch], return_images)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def identify_stream(self, items, topk=5, ordered=True, prefetch=64, batch_size=32, num_workers=4,
+                        return_images=False):
+        """Identify a (possibly endless) iterable of images or image paths
+        lazily, see `predict_stream`.
+
+        Yields:
+            (item, outputs) pairs, or (item, image, outputs) triples with
+            `return_images`, outputs as returned by `identify`.
+        """
+        for result in self.predict_stream(items, ordered, prefetch, batch_size, num_workers, return_images):
+            yield result[:-1] + (self.get_topk_results(result[-1], topk),)
+
+    @staticmethod
+    def _load_for_stream(item, return_image=False):
+        """The model crop of an image or image path, and the decoded image if `return_image`."""
+        if isinstance(item, (str, os.PathLike)):
+            with open(item, 'rb') as f:
+                item = decode_image(f.read(), min_size=None if return_image else _preprocessor.input_size)
+        check_image_dtype_and_shape(item)
+        return _preprocessor.crop_and_resize(item), item if return_image else None
+
+    def _predict_loaded(self, batch, return_images=False):
+        outputs = [None] * len(batch)
+        images = [None] * len(batch)
+        inputs, valid_indices = _preprocessor.get_buffer(len(batch)), []
+        for k, (_, future) in enumerate(batch):
+            try:
+                crop, images[k] = future.result()
+                _preprocessor.normalize(crop, out=inputs[len(valid_indices)])
+            except Exception as e:
+                PREDICT_STATUS.inc(-1)
+                outputs[k] = {"status": -1, "message": "Inference preprocess error.", "results": {}}
+                continue
+            valid_indices.append(k)
+        if len(valid_indices) > 0:
+            for k, one_outputs in zip(valid_indices, self.predict_tensor(inputs[:len(valid_indices)])):
+                outputs[k] = one_outputs
+        for (item, _), image, one_outputs in zip(batch, images, outputs):
+            if return_images:
+                yield item, image, one_outputs
+            else:
+                yield item, one_outputs
+
+    def identify_batch(self, images, topk=5, batch_size=32, tta=None):
+        """Identify a list (or an iterator) of images, see `predict_batch`.
+
+        Returns:
+            list of `identify` outputs, one per image and in input order.
+        """
+        return [self.get_topk_results(outputs, topk)
+                for outputs in self.predict_batch(images, batch_size, tta)]
+
+    def get_topk_results(self, outputs, topk=5):
+        """Convert `predict` outputs of a single image into top-k taxon results.
+        """
+        return get_topk_results(self.taxonomy, outputs, topk)
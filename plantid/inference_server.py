@@ -0,0 +1,450 @@
+import os
+import time
+import queue
+import socket
+import asyncio
+import itertools
+import threading
+from concurrent.futures import Future
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Client, Listener
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from .batching import BatchScheduler
+from .filecache import get_cache_dir
+from .identifier import check_image_dtype_and_shape, get_topk_results, load_taxonomy
+from .metrics import PREDICT_STATUS, STAGE_SECONDS
+from .preprocess import Preprocessor
+
+
+__all__ = ['InferenceServer', 'InferenceClient', 'parse_address']
+
+
+_OUTPUT_NAMES = ('probs', 'genus_probs', 'family_probs')
+
+
+MIN_AUTHKEY_LENGTH = 16
+
+
+def check_authkey(authkey):
+    """Reject missing or short keys: `multiprocessing.connection` unpickles
+    what it receives, so whoever knows the key can run code in the process.
+    """
+    if not isinstance(authkey, bytes) or len(authkey) < MIN_AUTHKEY_LENGTH:
+        raise ValueError(f'authkey must be a secret of at least {MIN_AUTHKEY_LENGTH} bytes, e.g. '
+                         'set PLANTID_INFERENCE_AUTHKEY to the output of '
+                         '`python -c "import secrets; print(secrets.token_hex(16))"`!')
+    return authkey
+
+
+def parse_address(address):
+    """'host:port' for TCP, anything else is a Unix socket path."""
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        return (host or '127.0.0.1', int(port))
+    return address
+
+
+class _SlotArrays(object):
+    """Numpy views of the shared memory block, one row of float32 per slot:
+    the input tensor followed by the species, genus and family probabilities.
+    """
+    def __init__(self, buffer, num_slots, input_size, output_sizes):
+        input_length = 3 * input_size * input_size
+        slot_length = input_length + sum(output_sizes)
+        rows = np.ndarray((num_slots, slot_length), dtype=np.float32, buffer=buffer)
+        self.inputs = rows[:, :input_length].reshape(num_slots, 3, input_size, input_size)
+        self.outputs, start = {}, input_length
+        for name, size in zip(_OUTPUT_NAMES, output_sizes):
+            self.outputs[name] = rows[:, start: start + size]
+            start += size
+
+    @staticmethod
+    def get_nbytes(num_slots, input_size, output_sizes):
+        return num_slots * (3 * input_size * input_size + sum(output_sizes)) * 4
+
+
+class _SlotScheduler(BatchScheduler):
+    """`BatchScheduler` whose requests are slots already holding a preprocessed
+    tensor; outputs are written back into the slots.
+    """
+    def __init__(self, identifier, slots, max_batch_size, max_wait_ms):
+        self.slots = slots
+        self._buffer = np.empty((max_batch_size,) + slots.inputs.shape[1:], dtype=np.float32)
+        super(_SlotScheduler, self).__init__(identifier, max_batch_size, max_wait_ms)
+
+    def _run_batch(self, batch):
+        self._observe_batch(batch)
+        slot_indices = [request.image for request in batch]
+        inputs = np.take(self.slots.inputs, slot_indices, axis=0, out=self._buffer[:len(batch)])
+        for request, slot, outputs in zip(batch, slot_indices, self.identifier.predict_tensor(inputs)):
+            if outputs['status'] == 0:
+                for name in _OUTPUT_NAMES:
+                    self.slots.outputs[name][slot] = outputs['results'][name][0]
+            request.future.set_result((outputs['status'], outputs['message']))
+
+
+class InferenceServer(object):
+    """Serve one `PlantIdentifier` to the HTTP workers of this host.
+
+    Workers connect with `InferenceClient`. Every connection gets its own
+    range of slots in one shared memory block; a worker preprocesses an
+    image straight into one of its slots and sends only the slot index, the
+    server runs the slots of all workers through one `BatchScheduler` and
+    writes the probabilities back into the slots. So there is a single ORT
+    session per host, and requests of different workers share batches.
+
+    Args:
+        identifier: PlantIdentifier instance.
+        address: 'host:port' or Unix socket path, see `parse_address`.
+        authkey: secret bytes shared with the clients, at least
+            `MIN_AUTHKEY_LENGTH` long, see `check_authkey`. Unix sockets are
+            also made accessible to the owner only.
+        num_slots: slots in total; each connection takes `slots_per_client`.
+        max_batch_size, max_wait_ms: see `BatchScheduler`.
+    """
+    def __init__(self, identifier, address, authkey, num_slots=256, slots_per_client=32,
+                 max_batch_size=32, max_wait_ms=5.0):
+        self.identifier = identifier
+        self.address = parse_address(address)
+        self.authkey = check_authkey(authkey)
+        self.num_slots = num_slots
+        self.slots_per_client = slots_per_client
+        taxonomy = identifier.taxonomy
+        self.output_sizes = [taxonomy.num_species, taxonomy.num_genera, taxonomy.num_families]
+        self.input_size = identifier.INPUT_SIZE
+        nbytes = _SlotArrays.get_nbytes(num_slots, self.input_size, self.output_sizes)
+        self.shm = SharedMemory(create=True, size=nbytes)
+        self.slots = _SlotArrays(self.shm.buf, num_slots, self.input_size, self.output_sizes)
+        self.scheduler = _SlotScheduler(identifier, self.slots, max_batch_size, max_wait_ms)
+        self._free_slots = list(range(num_slots))
+        self._lock = threading.Lock()
+        self._closed = False
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+        self.listener = Listener(self.address, authkey=authkey)
+        if isinstance(self.address, str):
+            os.chmod(self.address, 0o600)
+
+    def serve_forever(self):
+        try:
+            while True:
+                try:
+                    conn = self.listener.accept()
+                except OSError:
+                    break
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            self.close()
+
+    def _handle(self, conn):
+        with self._lock:
+            slot_indices = self._free_slots[:self.slots_per_client]
+            del self._free_slots[:len(slot_indices)]
+        send_lock = threading.Lock()
+        # slots go back to the pool only when no request of this connection is in flight
+        state = {'pending': 0, 'closed': False}
+
+        def release():
+            if state['closed'] and state['pending'] == 0:
+                self._free_slots.extend(slot_indices)
+
+        def reply(request_id, future):
+            try:
+                status, message = future.result()
+            except Exception as e:
+                status, message = -2, 'Inference error.'
+            try:
+                with send_lock:
+                    conn.send((request_id, status, message))
+            except OSError:
+                pass
+            with self._lock:
+                state['pending'] -= 1
+                release()
+
+        try:
+            if len(slot_indices) == 0:
+                conn.send({'error': 'No free slots, increase num_slots.'})
+                return
+            conn.send({'shm_name': self.shm.name, 'num_slots': self.num_slots,
+                       'input_size': self.input_size, 'output_sizes': self.output_sizes,
+                       'slot_indices': slot_indices})
+            allowed_slots = set(slot_indices)
+            while True:
+                request_id, slot = conn.recv()
+                if slot not in allowed_slots:
+                    with send_lock:
+                        conn.send((request_id, -2, 'Invalid slot.'))
+                    continue
+                with self._lock:
+                    state['pending'] += 1
+                future = self.scheduler.submit(slot)
+                future.add_done_callback(lambda f, request_id=request_id: reply(request_id, f))
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+            with self._lock:
+                state['closed'] = True
+                release()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.listener.close()
+        self.scheduler.close()
+        # release the numpy views before the mapping
+        self.slots = self.scheduler.slots = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _attach_shared_memory(name):
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 registers attached blocks too, and would unlink the
+        # server's block when this process exits
+        shm = SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class _Connection(object):
+    """One connection to an `InferenceServer` with the slots it was given;
+    replaced as a whole when the client reconnects.
+    """
+    def __init__(self, address, authkey, output_sizes, input_size=None):
+        self.conn = Client(address, authkey=authkey)
+        try:
+            info = self.conn.recv()
+            if 'error' in info:
+                raise RuntimeError(info['error'])
+            if info['output_sizes'] != output_sizes:
+                raise ValueError(f'Label map does not match the server, {output_sizes} vs {info["output_sizes"]}!')
+            if input_size is not None and info['input_size'] != input_size:
+                raise ValueError(f'Input size changed from {input_size} to {info["input_size"]}!')
+            self.shm = _attach_shared_memory(info['shm_name'])
+        except Exception:
+            self.conn.close()
+            raise
+        self.input_size = info['input_size']
+        self.slots = _SlotArrays(self.shm.buf, info['num_slots'], info['input_size'], info['output_sizes'])
+        self.free_slots = queue.Queue()
+        for slot in info['slot_indices']:
+            self.free_slots.put(slot)
+        self.futures = {}
+        self.send_lock = threading.Lock()
+        self.broken = False
+
+    def shutdown(self):
+        """Wake up the thread receiving on this connection; closing the
+        handle alone does not.
+        """
+        try:
+            with socket.socket(fileno=os.dup(self.conn.fileno())) as sock:
+                sock.shutdown(socket.SHUT_RDWR)
+        except (OSError, ValueError):
+            pass
+
+    def close(self):
+        self.conn.close()
+        # release the numpy views before the mapping
+        self.slots = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # a submit still writes into a slot, the mapping goes with the last view
+            pass
+
+
+class InferenceClient(object):
+    """Client of an `InferenceServer`, a drop-in for `BatchScheduler` in
+    HTTP workers: it needs neither an ORT session nor a parsed label map,
+    only the memory-mapped taxonomy index of `model_dir`.
+
+    When the connection breaks, e.g. because the server restarts, the
+    requests in flight fail with `ConnectionError` and the client
+    reconnects in the background, waiting `min_backoff` seconds before the
+    first attempt and doubling up to `max_backoff`. Meanwhile `submit`
+    waits at most `connect_timeout` seconds for the connection.
+
+    Args:
+        address, authkey: see `InferenceServer`.
+        model_dir: directory of the label map, defaults to the `models`
+            directory of this package.
+    """
+    def __init__(self, address, authkey, model_dir=None, cache_dir=None, connect_timeout=5.0,
+                 min_backoff=0.1, max_backoff=5.0):
+        check_authkey(authkey)
+        if model_dir is None:
+            model_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+        self.taxonomy = load_taxonomy(model_dir, get_cache_dir(cache_dir))
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.connect_timeout = connect_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.output_sizes = [self.taxonomy.num_species, self.taxonomy.num_genera, self.taxonomy.num_families]
+        # the first connection fails loudly, later ones are retried
+        self._state = _Connection(self.address, authkey, self.output_sizes)
+        self.preprocessor = Preprocessor(self._state.input_size)
+        self.num_reconnects = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._connected = threading.Event()
+        self._connected.set()
+        self._closed = threading.Event()
+        self._request_ids = itertools.count()
+        self._thread = threading.Thread(target=self._run, name='plantid-inference-client', daemon=True)
+        self._thread.start()
+
+    @property
+    def connected(self):
+        return self._connected.is_set()
+
+    def submit(self, image):
+        """Preprocess `image` into a free slot and send it to the server;
+        blocks while all slots of this client are in use.
+
+        Returns:
+            `concurrent.futures.Future` of the `PlantIdentifier.predict`
+            outputs, or of a `ConnectionError` if the server is unreachable.
+        """
+        if self._closed.is_set():
+            raise RuntimeError('InferenceClient is closed!')
+        future = Future()
+        try:
+            check_image_dtype_and_shape(image)
+        except Exception as e:
+            PREDICT_STATUS.inc(-1)
+            future.set_result({"status": -1, "message": "Inference preprocess error.", "results": {}})
+            return future
+        if not self._connected.wait(self.connect_timeout):
+            future.set_exception(ConnectionError(f'Not connected to the inference server: {self.last_error}'))
+            return future
+        state = self._state
+        slot = state.free_slots.get()
+        start_time = time.perf_counter()
+        try:
+            self.preprocessor(image, out=state.slots.inputs[slot])
+        except Exception as e:
+            state.free_slots.put(slot)
+            if state.broken:
+                future.set_exception(ConnectionError('Inference server connection closed!'))
+                return future
+            PREDICT_STATUS.inc(-1)
+            future.set_result({"status": -1, "message": "Inference preprocess error.", "results": {}})
+            return future
+        STAGE_SECONDS.observe(time.perf_counter() - start_time, 'preprocess')
+        request_id = next(self._request_ids)
+        with self._lock:
+            # a broken connection has already failed its futures, this one would never resolve
+            registered = not state.broken
+            if registered:
+                state.futures[request_id] = (future, slot)
+        if not registered:
+            state.free_slots.put(slot)
+            future.set_exception(ConnectionError('Inference server connection closed!'))
+            return future
+        try:
+            with state.send_lock:
+                state.conn.send((request_id, slot))
+        except (OSError, ValueError):
+            with self._lock:
+                entry = state.futures.pop(request_id, None)
+            if entry is not None:
+                state.free_slots.put(slot)
+                future.set_exception(ConnectionError('Inference server connection closed!'))
+            state.shutdown()
+        return future
+
+    def _run(self):
+        state = self._state
+        while state is not None:
+            self._receive(state)
+            self._teardown(state)
+            state = self._reconnect()
+
+    def _receive(self, state):
+        while True:
+            try:
+                request_id, status, message = state.conn.recv()
+            except (EOFError, OSError):
+                return
+            with self._lock:
+                entry = state.futures.pop(request_id, None)
+            if entry is None:
+                continue
+            future, slot = entry
+            PREDICT_STATUS.inc(status)
+            if status == 0:
+                results = {name: state.slots.outputs[name][slot][None].copy() for name in _OUTPUT_NAMES}
+                outputs = {"status": 0, "message": message, "results": results}
+            else:
+                outputs = {"status": status, "message": message, "results": {}}
+            state.free_slots.put(slot)
+            future.set_result(outputs)
+
+    def _teardown(self, state):
+        with self._lock:
+            self._connected.clear()
+            state.broken = True
+            pending = list(state.futures.values())
+            state.futures.clear()
+        for future, slot in pending:
+            # wakes up submits waiting for a slot, they see the broken connection
+            state.free_slots.put(slot)
+            future.set_exception(ConnectionError('Inference server connection closed!'))
+        state.close()
+
+    def _reconnect(self):
+        """New connection, retried with exponential backoff; None once closed."""
+        delay = self.min_backoff
+        while not self._closed.wait(delay):
+            try:
+                state = _Connection(self.address, self.authkey, self.output_sizes, self.preprocessor.input_size)
+            except Exception as e:
+                self.last_error = f'{type(e).__name__}: {e}'
+                delay = min(delay * 2, self.max_backoff)
+                continue
+            with self._lock:
+                self._state = state
+                self.num_reconnects += 1
+                self.last_error = None
+                self._connected.set()
+            if self._closed.is_set():
+                state.shutdown()
+            return state
+        return None
+
+    def get_topk_results(self, outputs, topk=5):
+        return get_topk_results(self.taxonomy, outputs, topk)
+
+    def predict(self, image):
+        return self.submit(image).result()
+
+    def identify(self, image, topk=5):
+        return self.get_topk_results(self.predict(image), topk)
+
+    async def predict_async(self, image):
+        # preprocessing and waiting for a free slot must stay off the event loop
+        loop = asyncio.get_running_loop()
+        future = await loop.run_in_executor(None, self.submit, image)
+        return await asyncio.wrap_future(future)
+
+    async def identify_async(self, image, topk=5):
+        return self.get_topk_results(await self.predict_async(image), topk)
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        with self._lock:
+            state = self._state
+        state.shutdown()
+        self._thread.join()
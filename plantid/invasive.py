@@ -1,9 +1,12 @@
 import json
-import httpx
 import os
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from dotenv import load_dotenv
 
+from .http_client import CircuitOpenError, ResilientClient
+from .invasive_cache import InvasiveCache, make_cache_key
+from .invasive_kb import InvasiveKnowledgeBase
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -16,12 +19,32 @@ MODEL_NAME = "gemini-2.0-flash"
 API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{MODEL_NAME}:generateContent?key={API_KEY}"
 
 class InvasiveChecker:
-    def __init__(self):
-        self.client = httpx.AsyncClient(timeout=30.0)
+    """
+    Args:
+        cache: result cache, defaults to InvasiveCache.from_env(); pass False to disable
+        api_url: Gemini generateContent endpoint, e.g. a local stand-in server for testing
+        knowledge_base: offline knowledge base answered before the cache and the API,
+            defaults to InvasiveKnowledgeBase.from_env(); pass False to disable
+        http_client: client used for the API, defaults to ResilientClient.from_env()
+    """
+    def __init__(self, cache: Optional[InvasiveCache] = None, api_url: Optional[str] = None,
+                 knowledge_base: Optional[InvasiveKnowledgeBase] = None,
+                 http_client: Optional[ResilientClient] = None):
+        self.client = http_client or ResilientClient.from_env()
+        if cache is None:
+            cache = InvasiveCache.from_env()
+        self.cache = cache if cache is not False else None
+        self.api_url = api_url or API_URL
+        if knowledge_base is None:
+            knowledge_base = InvasiveKnowledgeBase.from_env()
+        self.knowledge_base = knowledge_base if knowledge_base is not False else None
 
     async def check_invasive(self, plant_name: str, location: str) -> Dict[str, Any]:
         """
         Check if a plant is invasive in a specific location using Gemini REST API.
+
+        The offline knowledge base is consulted first, the API only on a miss.
+        API results are cached by normalized (plant_name, location).
         """
         if not location:
             return {
@@ -29,7 +52,32 @@ class InvasiveChecker:
                 "severity": "Unknown",
                 "reason": "No location provided."
             }
+        result = self._lookup_knowledge_base(plant_name, location)
+        if result is not None:
+            return result
+        if self.cache is None:
+            return await self._fetch_invasive(plant_name, location)
+        key = make_cache_key(plant_name, location)
+        return await self.cache.get_or_fetch(key, lambda: self._fetch_invasive(plant_name, location))
 
+    async def get_cached(self, plant_name: str, location: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the known or cached result, or None without calling the API.
+        """
+        if not location:
+            return None
+        result = self._lookup_knowledge_base(plant_name, location)
+        if result is not None or self.cache is None:
+            return result
+        return await self.cache.get(make_cache_key(plant_name, location))
+
+    def _lookup_knowledge_base(self, plant_name: str, location: str) -> Optional[Dict[str, Any]]:
+        if self.knowledge_base is None:
+            return None
+        result = self.knowledge_base.lookup(plant_name, location)
+        return dict(result) if result is not None else None
+
+    async def _fetch_invasive(self, plant_name: str, location: str) -> Dict[str, Any]:
         prompt = (
             f"Is the plant '{plant_name}' considered an invasive species in '{location}'? "
             "Please provide the answer strictly in JSON format with the following keys: "
@@ -45,7 +93,7 @@ class InvasiveChecker:
         }
 
         try:
-            response = await self.client.post(API_URL, json=payload)
+            response = await self.client.post(self.api_url, json=payload)
             response.raise_for_status()
             
             data = response.json()
@@ -71,6 +119,12 @@ class InvasiveChecker:
             
             result = json.loads(text.strip())
             return result
+        except CircuitOpenError:
+            return {
+                "is_invasive": False,
+                "severity": "Error",
+                "reason": "AI service temporarily unavailable."
+            }
         except Exception as e:
             print(f"Error checking invasive species: {e}")
             return {
@@ -81,3 +135,7 @@ class InvasiveChecker:
 
     async def close(self):
         await self.client.aclose()
+        if self.cache is not None:
+            self.cache.close()
+        if self.knowledge_base is not None:
+            self.knowledge_base.close()
@@ -0,0 +1,218 @@
+import os
+import re
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .filecache import get_cache_dir
+
+
+def normalize_text(text: str) -> str:
+    """Normalize a free-form string for use in a cache key.
+
+    Unicode NFKC, case folding, whitespace collapsing, and separators and
+    trailing punctuation unified, so that e.g. "  Madrid,Spain. " and
+    "madrid, spain" map to the same key.
+    """
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = re.sub(r'\s*[,;，、]\s*', ', ', text)
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip(' .。!?')
+
+
+def make_cache_key(plant_name: str, location: str) -> str:
+    return f'{normalize_text(plant_name)}|{normalize_text(location)}'
+
+
+class TTLCache:
+    """In-process LRU cache whose entries expire after a per-entry TTL."""
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expire_at, value = item
+        if expire_at <= time.time():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float, expire_at: Optional[float] = None):
+        if expire_at is None:
+            expire_at = time.time() + ttl
+        self._data[key] = (expire_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SqliteCache:
+    """On-disk JSON value cache with expiry, shared by all worker processes."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expire_at REAL NOT NULL)')
+            self._conn.commit()
+
+    def get(self, key: str):
+        """Return (value, expire_at), or None if absent or expired."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, expire_at FROM cache WHERE key = ? AND expire_at > ?',
+                (key, time.time())).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, value: Any, ttl: float):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO cache (key, value, expire_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value, ensure_ascii=False), time.time() + ttl))
+            self._conn.commit()
+
+    def purge_expired(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM cache WHERE expire_at <= ?', (time.time(),))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class InvasiveCache:
+    """
+    Two-level cache for invasive species lookups
+
+    Level one is an in-process LRU, level two an optional SQLite file shared
+    across uvicorn workers. Concurrent misses for the same key are coalesced
+    into a single fetch.
+
+    Args:
+        disk_path: SQLite file, None for memory only
+        maxsize: max entries of the in-process LRU
+        ttl: seconds to keep results which report an invasive species
+        negative_ttl: seconds to keep results which report a non-invasive species
+        error_ttl: seconds to keep error results (severity "Error")
+    """
+
+    def __init__(self, disk_path: Optional[str] = None, maxsize: int = 4096,
+                 ttl: float = 30 * 86400, negative_ttl: float = 86400, error_ttl: float = 60):
+        self.memory = TTLCache(maxsize)
+        self.disk = SqliteCache(disk_path) if disk_path else None
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.error_ttl = error_ttl
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @classmethod
+    def from_env(cls) -> "InvasiveCache":
+        """
+        Build from PLANTID_INVASIVE_CACHE_* environment variables
+
+        PLANTID_INVASIVE_CACHE_PATH defaults to a file in the plantid cache
+        directory; set it to an empty string to keep the cache in memory only.
+        """
+        disk_path = os.getenv('PLANTID_INVASIVE_CACHE_PATH')
+        if disk_path is None:
+            disk_path = os.path.join(get_cache_dir(), 'invasive_cache.sqlite3')
+        return cls(
+            disk_path=disk_path or None,
+            maxsize=int(os.getenv('PLANTID_INVASIVE_CACHE_SIZE', '4096')),
+            ttl=float(os.getenv('PLANTID_INVASIVE_CACHE_TTL', str(30 * 86400))),
+            negative_ttl=float(os.getenv('PLANTID_INVASIVE_CACHE_NEGATIVE_TTL', '86400')),
+            error_ttl=float(os.getenv('PLANTID_INVASIVE_CACHE_ERROR_TTL', '60')),
+        )
+
+    def get_ttl(self, result: Dict[str, Any]) -> float:
+        if result.get('severity') == 'Error':
+            return self.error_ttl
+        if not result.get('is_invasive'):
+            return self.negative_ttl
+        return self.ttl
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        result = self.memory.get(key)
+        if result is None and self.disk is not None:
+            result = await self._get_from_disk(key)
+        return result
+
+    async def _get_from_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        item = await asyncio.to_thread(self.disk.get, key)
+        if item is None:
+            return None
+        result, expire_at = item
+        self.memory.set(key, result, 0, expire_at=expire_at)
+        return result
+
+    async def set(self, key: str, result: Dict[str, Any]):
+        ttl = self.get_ttl(result)
+        self.memory.set(key, result, ttl)
+        # errors are worker-local, other workers may still reach the upstream
+        if self.disk is not None and result.get('severity') != 'Error':
+            await asyncio.to_thread(self.disk.set, key, result, ttl)
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        result = self.memory.get(key)
+        if result is not None:
+            self.hits += 1
+            return result
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            # register before the first await, so that concurrent misses wait on this lookup
+            task = asyncio.ensure_future(self._lookup(key, fetch))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._finish_lookup(key))
+        # the lookup runs as its own task, so a cancelled caller, even the
+        # one which started it, does not cancel it for the others
+        return await asyncio.shield(task)
+
+    async def _lookup(self, key: str, fetch: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        result = None
+        if self.disk is not None:
+            result = await self._get_from_disk(key)
+        if result is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            result = await fetch()
+            await self.set(key, result)
+        return result
+
+    def _finish_lookup(self, key: str):
+        task = self._inflight.pop(key)
+        if not task.cancelled():
+            # retrieve it, otherwise asyncio logs an error when every caller was cancelled
+            task.exception()
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
@@ -0,0 +1,142 @@
+import os
+import csv
+import json
+import time
+import sqlite3
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .invasive_cache import normalize_text
+
+
+def get_region_candidates(location: str) -> List[str]:
+    """Normalized region keys to try for a location, most specific first.
+
+    "Madrid, Spain" yields ["madrid, spain", "spain"].
+    """
+    region = normalize_text(location)
+    parts = [part for part in region.split(', ') if part]
+    candidates = [region]
+    for k in range(1, len(parts)):
+        candidates.append(', '.join(parts[k:]))
+    return candidates
+
+
+class InvasiveKnowledgeBase:
+    """
+    Local knowledge base of invasive status per (species, region)
+
+    Entries are stored in SQLite keyed by the species id of
+    quarrying_plantid_label_map.json and the normalized region, and loaded
+    into dicts at startup, so lookups do not touch the disk or the network.
+    Populate it with tools/build_invasive_kb.py.
+
+    Args:
+        path: SQLite file, created if missing
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        dirname = os.path.dirname(os.path.abspath(path))
+        os.makedirs(dirname, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS invasive_status ('
+            'species_id INTEGER NOT NULL, latin_name TEXT NOT NULL, region TEXT NOT NULL, '
+            'is_invasive INTEGER NOT NULL, severity TEXT NOT NULL, reason TEXT NOT NULL, '
+            'source TEXT NOT NULL, updated_at REAL NOT NULL, '
+            'PRIMARY KEY (species_id, region))')
+        self._conn.commit()
+        self._by_species: Dict[Tuple[int, str], Dict[str, Any]] = {}
+        self._by_latin_name: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.reload()
+
+    @classmethod
+    def from_env(cls) -> Optional["InvasiveKnowledgeBase"]:
+        """Open PLANTID_INVASIVE_KB_PATH, or the file in plantid/models if it exists"""
+        path = os.getenv('PLANTID_INVASIVE_KB_PATH')
+        if path is None:
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models', 'invasive_kb.sqlite3')
+            if not os.path.exists(path):
+                return None
+        return cls(path) if path else None
+
+    def reload(self):
+        self._by_species.clear()
+        self._by_latin_name.clear()
+        rows = self._conn.execute(
+            'SELECT species_id, latin_name, region, is_invasive, severity, reason FROM invasive_status')
+        for row in rows:
+            self._add(*row)
+
+    def _add(self, species_id, latin_name, region, is_invasive, severity, reason):
+        result = {"is_invasive": bool(is_invasive), "severity": severity, "reason": reason}
+        self._by_species[(species_id, region)] = result
+        if latin_name:
+            self._by_latin_name[(normalize_text(latin_name), region)] = result
+
+    def __len__(self):
+        return len(self._by_species)
+
+    def lookup(self, latin_name: str, location: str) -> Optional[Dict[str, Any]]:
+        latin_key = normalize_text(latin_name)
+        for region in get_region_candidates(location):
+            result = self._by_latin_name.get((latin_key, region))
+            if result is not None:
+                return result
+        return None
+
+    def lookup_species(self, species_id: int, location: str) -> Optional[Dict[str, Any]]:
+        for region in get_region_candidates(location):
+            result = self._by_species.get((species_id, region))
+            if result is not None:
+                return result
+        return None
+
+    def contains(self, species_id: int, region: str) -> bool:
+        return (species_id, normalize_text(region)) in self._by_species
+
+    def upsert_many(self, records: Iterable[Dict[str, Any]], source: str):
+        """
+        Insert or replace records with the keys species_id, latin_name,
+        region, is_invasive, severity and reason
+        """
+        now = time.time()
+        rows = [(int(item['species_id']), item.get('latin_name', ''), normalize_text(item['region']),
+                 int(bool(item['is_invasive'])), item.get('severity') or 'None', item.get('reason') or '',
+                 source, now) for item in records]
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO invasive_status '
+            '(species_id, latin_name, region, is_invasive, severity, reason, source, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self._conn.commit()
+        for row in rows:
+            self._add(*row[:6])
+        return len(rows)
+
+    def import_file(self, filename: str, latin_name_to_species_id: Dict[str, int]) -> int:
+        """
+        Import a CSV file or a JSON list of records; records may give
+        latin_name instead of species_id
+        """
+        if filename.lower().endswith('.json'):
+            with open(filename, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        else:
+            with open(filename, 'r', encoding='utf-8', newline='') as f:
+                records = list(csv.DictReader(f))
+
+        resolved = []
+        for item in records:
+            item = dict(item)
+            if item.get('species_id') in (None, ''):
+                species_id = latin_name_to_species_id.get(normalize_text(item.get('latin_name', '')))
+                if species_id is None:
+                    continue
+                item['species_id'] = species_id
+            if isinstance(item['is_invasive'], str):
+                item['is_invasive'] = item['is_invasive'].strip().lower() in ('1', 'true', 'yes')
+            resolved.append(item)
+        return self.upsert_many(resolved, source=os.path.basename(filename))
+
+    def close(self):
+        self._conn.close()
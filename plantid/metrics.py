@@ -0,0 +1,174 @@
+import bisect
+import threading
+
+
+__all__ = ['Counter', 'Histogram', 'CallbackMetric', 'MetricsRegistry', 'REGISTRY',
+           'STAGE_SECONDS', 'PREDICT_STATUS', 'BATCH_SIZE', 'EXTERNAL_API_SECONDS', 'TTA_PREDICTIONS',
+           'CASCADE_IMAGES', 'MODEL_RELOADS']
+
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labelnames, label_values, extra=''):
+    items = ['{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+             for name, value in zip(labelnames, label_values)]
+    if extra:
+        items.append(extra)
+    return '{' + ','.join(items) + '}' if items else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    """Monotonic counter, optionally per label values.
+
+    Args:
+        name, documentation: Prometheus metric name and help text.
+        labelnames: names of the labels passed to `inc` in this order.
+    """
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def collect(self):
+        with self._lock:
+            values = list(self._values.items())
+        return ['{}{} {}'.format(self.name, _format_labels(self.labelnames, label_values), _format_value(value))
+                for label_values, value in values]
+
+
+class Histogram(object):
+    """Bucketed distribution of observed values, optionally per label values.
+
+    `observe` is a bisect and three additions under a lock, cheap enough for
+    every request; buckets are made cumulative only when rendered.
+
+    Args:
+        name, documentation, labelnames: see `Counter`.
+        buckets: increasing upper bounds, +Inf is implied.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def get_count(self, *label_values):
+        state = self._values.get(label_values)
+        return state[2] if state is not None else 0
+
+    def collect(self):
+        with self._lock:
+            values = [(label_values, list(counts), total, count)
+                      for label_values, (counts, total, count) in self._values.items()]
+        lines = []
+        for label_values, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, label_values, 'le="{}"'.format(_format_value(bound)))
+                lines.append('{}_bucket{} {}'.format(self.name, labels, cumulative))
+            labels = _format_labels(self.labelnames, label_values)
+            lines.append('{}_sum{} {}'.format(self.name, labels, _format_value(total)))
+            lines.append('{}_count{} {}'.format(self.name, labels, count))
+        return lines
+
+
+class CallbackMetric(object):
+    """Counter or gauge whose values are read from `callback` at render time,
+    for components which already keep their own statistics.
+
+    Args:
+        callback: returns {label values tuple: value}.
+        type: 'counter' or 'gauge'.
+    """
+    def __init__(self, name, documentation, callback, labelnames=(), type='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+        self.type = type
+
+    def collect(self):
+        return ['{}{} {}'.format(self.name, _format_labels(self.labelnames, label_values), _format_value(value))
+                for label_values, value in self.callback().items()]
+
+
+class MetricsRegistry(object):
+    """Collection of metrics rendered in the Prometheus text format."""
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'plantid_stage_seconds', 'Seconds spent per request in each pipeline stage.', ('stage',))
+PREDICT_STATUS = REGISTRY.counter(
+    'plantid_predict_status_total', 'Predictions by status: 0 ok, -1 preprocess error, -2 inference error.',
+    ('status',))
+BATCH_SIZE = REGISTRY.histogram(
+    'plantid_batch_size', 'Images per forward pass of the batch scheduler.', (),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+EXTERNAL_API_SECONDS = REGISTRY.histogram(
+    'plantid_external_api_seconds', 'Seconds per call to an external API, including retries.',
+    ('outcome',))
+TTA_PREDICTIONS = REGISTRY.counter(
+    'plantid_tta_predictions_total', 'Images predicted with test-time augmentation, by mode.', ('mode',))
+CASCADE_IMAGES = REGISTRY.counter(
+    'plantid_cascade_images_total', 'Images answered by each stage of the model cascade, fast or full.',
+    ('stage',))
+MODEL_RELOADS = REGISTRY.counter(
+    'plantid_model_reloads_total', 'Model reloads by result, success or failure.', ('result',))
@@ -0,0 +1,254 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from .metrics import MODEL_RELOADS
+
+
+__all__ = ['ModelManager', 'get_model_version']
+
+
+def get_file_signature(paths):
+    """(path, mtime, size) of every file, None for missing files; cheap
+    enough to poll.
+    """
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            signature.append((path, None))
+            continue
+        signature.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def get_model_version(paths, chunk_size=1 << 20):
+    """Short SHA-256 of the contents of the files a model is loaded from,
+    which is the same on every host serving the same files.
+    """
+    sha256 = hashlib.sha256()
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        sha256.update(os.path.basename(path).encode('utf-8'))
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                sha256.update(chunk)
+    return sha256.hexdigest()[:12]
+
+
+class _Generation(object):
+    __slots__ = ('model', 'version', 'loaded_at', 'leases', 'retired')
+
+    def __init__(self, model, version):
+        self.model = model
+        self.version = version
+        self.loaded_at = time.time()
+        self.leases = 0
+        self.retired = False
+
+
+class ModelManager(object):
+    """Hot-swappable model: reloads build a new model in the background
+    while the current one keeps serving.
+
+    Requests hold the model through `acquire`, which leases the current
+    generation for the whole request, so a request never mixes two models
+    (e.g. predicts with the old model and maps the indices with the new
+    label map). `reload` loads and warms a new model in a background
+    thread and swaps it in atomically once it is ready; the old model is
+    closed when the last request holding it releases it, however long
+    that takes. If loading fails, the current model stays in place.
+
+    With `poll_interval`, the files in `paths` are polled, and a reload
+    starts once they changed and then stayed unchanged for one more poll,
+    so that files being copied are not loaded halfway. Replace model files
+    by renaming complete files over them.
+
+    Args:
+        load: callable without arguments returning a new, warmed model.
+        close: callable closing a model, e.g. `BatchScheduler.close`.
+        paths: files the model is loaded from, for the version and for polling.
+        poll_interval: seconds between polls of `paths`, None to not watch.
+        on_swap: callable(model, version) run right after each swap.
+    """
+    def __init__(self, load, close=None, paths=(), poll_interval=None, on_swap=None):
+        self._load = load
+        self._close = close
+        self.paths = list(paths)
+        self.poll_interval = poll_interval
+        self.on_swap = on_swap
+        self.num_reloads = 0
+        self.num_failures = 0
+        self.last_error = None
+        self._draining = []
+        self._lock = threading.Lock()
+        self._reload_future = None
+        self._closed = threading.Event()
+
+        self._signature, version, model = self._load_snapshot()
+        self._current = _Generation(model, version)
+        self._watcher = None
+        if poll_interval is not None and poll_interval > 0:
+            self._watcher = threading.Thread(target=self._watch, name='plantid-model-watch', daemon=True)
+            self._watcher.start()
+
+    @property
+    def model(self):
+        """The current model, without a lease."""
+        return self._current.model
+
+    @property
+    def version(self):
+        return self._current.version
+
+    @contextmanager
+    def acquire(self):
+        """Lease the current model for the duration of the with block,
+        which gets the (model, version) pair.
+        """
+        with self._lock:
+            generation = self._current
+            generation.leases += 1
+        try:
+            yield generation.model, generation.version
+        finally:
+            with self._lock:
+                generation.leases -= 1
+                drained = generation.retired and generation.leases == 0
+            if drained:
+                self._start_retire(generation)
+
+    def reload(self):
+        """Start a reload unless one is running; returns a
+        `concurrent.futures.Future` of the reload, which resolves to the
+        status of the manager once the new model serves, or to the error
+        of the load.
+        """
+        with self._lock:
+            if self._closed.is_set():
+                raise RuntimeError('ModelManager is closed!')
+            if self._reload_future is not None:
+                return self._reload_future
+            future = self._reload_future = Future()
+        threading.Thread(target=self._reload, args=(future,), name='plantid-model-reload', daemon=True).start()
+        return future
+
+    def _load_snapshot(self, max_attempts=3):
+        """Load the model and hash its files, again if the files changed
+        meanwhile, so that the version is that of the files loaded.
+
+        Returns:
+            (signature, version, model)
+        """
+        for _ in range(max_attempts):
+            signature = get_file_signature(self.paths)
+            version = get_model_version(self.paths)
+            model = self._load()
+            if get_file_signature(self.paths) == signature:
+                return signature, version, model
+            if self._close is not None:
+                self._close(model)
+        raise RuntimeError(f'model files changed during each of {max_attempts} loads!')
+
+    def _reload(self, future):
+        try:
+            start_time = time.perf_counter()
+            signature, version, model = self._load_snapshot()
+            load_seconds = time.perf_counter() - start_time
+        except Exception as e:
+            with self._lock:
+                # the watcher retries once the files change again
+                self._signature = get_file_signature(self.paths)
+                self.num_failures += 1
+                self.last_error = f'{type(e).__name__}: {e}'
+                self._reload_future = None
+            MODEL_RELOADS.inc('failure')
+            future.set_exception(e)
+            return
+
+        new = _Generation(model, version)
+        with self._lock:
+            old, self._current = self._current, new
+            old.retired = True
+            drained = old.leases == 0
+            self._draining.append(old)
+            self._signature = signature
+            self.num_reloads += 1
+            self.last_error = None
+            self._reload_future = None
+        MODEL_RELOADS.inc('success')
+        if self.on_swap is not None:
+            self.on_swap(model, version)
+        status = self.get_status()
+        status['previous_version'] = old.version
+        status['load_seconds'] = load_seconds
+        future.set_result(status)
+        if drained:
+            self._retire(old)
+
+    def _start_retire(self, generation):
+        # closing may join threads, so not in the request releasing the model
+        threading.Thread(target=self._retire, args=(generation,), name='plantid-model-retire', daemon=True).start()
+
+    def _retire(self, generation):
+        try:
+            if self._close is not None:
+                self._close(generation.model)
+        finally:
+            with self._lock:
+                self._draining.remove(generation)
+
+    def _watch(self):
+        pending = None
+        while not self._closed.wait(self.poll_interval):
+            signature = get_file_signature(self.paths)
+            if signature == self._signature:
+                pending = None
+            elif signature != pending:
+                # changed since the last poll, maybe still being written
+                pending = signature
+            else:
+                pending = None
+                try:
+                    self.reload().result()
+                except Exception:
+                    # recorded in get_status
+                    pass
+
+    def get_status(self):
+        with self._lock:
+            current = self._current
+            return {
+                'version': current.version,
+                'loaded_at': current.loaded_at,
+                'active_requests': current.leases,
+                'reloading': self._reload_future is not None,
+                'draining': [{'version': item.version, 'active_requests': item.leases}
+                             for item in self._draining],
+                'reloads': self.num_reloads,
+                'failures': self.num_failures,
+                'last_error': self.last_error,
+                'watching': self._watcher is not None,
+            }
+
+    def close(self):
+        """Stop watching and close the current model; a running reload
+        finishes first, replaced models still close on their last release.
+        """
+        self._closed.set()
+        with self._lock:
+            future = self._reload_future
+        if future is not None:
+            try:
+                future.result()
+            except Exception:
+                pass
+        if self._watcher is not None:
+            self._watcher.join()
+        if self._close is not None:
+            self._close(self._current.model)
@@ -0,0 +1,142 @@
+import os
+import dataclasses
+from dataclasses import dataclass
+from typing import List, Optional
+
+import onnxruntime
+
+
+__all__ = ['ExecutionProfile', 'PRESETS']
+
+
+_EXECUTION_MODES = {
+    'sequential': onnxruntime.ExecutionMode.ORT_SEQUENTIAL,
+    'parallel': onnxruntime.ExecutionMode.ORT_PARALLEL,
+}
+
+_GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+
+def _parse_bool(value):
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+@dataclass
+class ExecutionProfile:
+    """ONNX Runtime session settings used by `OnnxModel`.
+
+    Thread counts of 0 keep the ONNX Runtime default, which is one
+    intra-op thread per physical core. When several workers share one box,
+    lower `intra_op_num_threads` so that their thread pools do not
+    oversubscribe the cores.
+
+    Attributes:
+        intra_op_num_threads: threads used to parallelize one operator.
+        inter_op_num_threads: threads used to run operators in parallel,
+            only used when `execution_mode` is 'parallel'.
+        execution_mode: 'sequential' or 'parallel'.
+        graph_optimization_level: 'disable', 'basic', 'extended' or 'all'.
+        enable_cpu_mem_arena: whether to use the CPU memory arena.
+        enable_mem_pattern: whether to pre-plan memory from the first run.
+        allow_spinning: whether idle intra-op threads busy-wait for work,
+            which lowers latency but burns CPU that other workers could use.
+        providers: execution providers in order of preference. None selects
+            CUDA when available, then CPU. Unavailable providers are skipped.
+    """
+    intra_op_num_threads: int = 0
+    inter_op_num_threads: int = 0
+    execution_mode: str = 'sequential'
+    graph_optimization_level: str = 'all'
+    enable_cpu_mem_arena: bool = True
+    enable_mem_pattern: bool = True
+    allow_spinning: bool = True
+    providers: Optional[List[str]] = None
+
+    def __post_init__(self):
+        if self.execution_mode not in _EXECUTION_MODES:
+            raise ValueError(f'Unsupported execution_mode, only support {list(_EXECUTION_MODES)}, got {self.execution_mode}!')
+        if self.graph_optimization_level not in _GRAPH_OPTIMIZATION_LEVELS:
+            raise ValueError(f'Unsupported graph_optimization_level, only support {list(_GRAPH_OPTIMIZATION_LEVELS)}, '
+                             f'got {self.graph_optimization_level}!')
+
+    @classmethod
+    def preset(cls, name):
+        if name not in PRESETS:
+            raise ValueError(f'Unknown execution profile preset, only support {list(PRESETS)}, got {name}!')
+        return dataclasses.replace(PRESETS[name])
+
+    @classmethod
+    def from_env(cls, base=None):
+        """Build a profile from `PLANTID_ORT_*` environment variables.
+
+        `PLANTID_ORT_PRESET` selects the starting preset (or `base` if given),
+        the other variables override single fields:
+        `PLANTID_ORT_INTRA_OP_THREADS`, `PLANTID_ORT_INTER_OP_THREADS`,
+        `PLANTID_ORT_EXECUTION_MODE`, `PLANTID_ORT_GRAPH_OPTIMIZATION_LEVEL`,
+        `PLANTID_ORT_MEM_ARENA`, `PLANTID_ORT_MEM_PATTERN`,
+        `PLANTID_ORT_ALLOW_SPINNING` and `PLANTID_ORT_PROVIDERS` (comma separated).
+        """
+        if base is None:
+            preset_name = os.getenv('PLANTID_ORT_PRESET')
+            base = cls.preset(preset_name) if preset_name else cls()
+        overrides = {}
+        env_fields = [
+            ('PLANTID_ORT_INTRA_OP_THREADS', 'intra_op_num_threads', int),
+            ('PLANTID_ORT_INTER_OP_THREADS', 'inter_op_num_threads', int),
+            ('PLANTID_ORT_EXECUTION_MODE', 'execution_mode', str),
+            ('PLANTID_ORT_GRAPH_OPTIMIZATION_LEVEL', 'graph_optimization_level', str),
+            ('PLANTID_ORT_MEM_ARENA', 'enable_cpu_mem_arena', _parse_bool),
+            ('PLANTID_ORT_MEM_PATTERN', 'enable_mem_pattern', _parse_bool),
+            ('PLANTID_ORT_ALLOW_SPINNING', 'allow_spinning', _parse_bool),
+            ('PLANTID_ORT_PROVIDERS', 'providers', lambda value: [item.strip() for item in value.split(',') if item.strip()]),
+        ]
+        for env_name, field_name, parse in env_fields:
+            value = os.getenv(env_name)
+            if value:
+                overrides[field_name] = parse(value)
+        return dataclasses.replace(base, **overrides)
+
+    def get_session_options(self):
+        sess_options = onnxruntime.SessionOptions()
+        sess_options.intra_op_num_threads = self.intra_op_num_threads
+        sess_options.inter_op_num_threads = self.inter_op_num_threads
+        sess_options.execution_mode = _EXECUTION_MODES[self.execution_mode]
+        sess_options.graph_optimization_level = _GRAPH_OPTIMIZATION_LEVELS[self.graph_optimization_level]
+        sess_options.enable_cpu_mem_arena = self.enable_cpu_mem_arena
+        sess_options.enable_mem_pattern = self.enable_mem_pattern
+        if not self.allow_spinning:
+            sess_options.add_session_config_entry('session.intra_op.allow_spinning', '0')
+            sess_options.add_session_config_entry('session.inter_op.allow_spinning', '0')
+        return sess_options
+
+    def get_providers(self):
+        available_providers = onnxruntime.get_available_providers()
+        if self.providers is None:
+            onnx_gpu = (onnxruntime.get_device() == 'GPU')
+            providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if onnx_gpu else ['CPUExecutionProvider']
+        else:
+            providers = self.providers
+        providers = [item for item in providers if item in available_providers]
+        return providers or ['CPUExecutionProvider']
+
+
+PRESETS = {
+    # Many small requests served by several workers on one box: one
+    # non-spinning intra-op thread per session, so that N workers use N cores.
+    'latency': ExecutionProfile(
+        intra_op_num_threads=1,
+        inter_op_num_threads=1,
+        execution_mode='sequential',
+        allow_spinning=False),
+    # Large batches in a single process: every core works on each operator.
+    'throughput': ExecutionProfile(
+        intra_op_num_threads=os.cpu_count() or 0,
+        inter_op_num_threads=1,
+        execution_mode='sequential',
+        allow_spinning=True),
+}
@@ -0,0 +1,179 @@
+import threading
+
+import cv2
+import numpy as np
+
+
+__all__ = ['Preprocessor', 'TTA_MODES']
+
+
+# views per image of each test-time augmentation mode, see `Preprocessor.augment`
+TTA_MODES = {'flip': 2, 'multicrop5': 5}
+
+
+class Preprocessor(object):
+    """Resize-short, center-crop and normalize images into NCHW tensors.
+
+    Compared with running each step on a full-size copy of the image:
+    - the center crop is taken in source coordinates first, so only the
+      region of interest is resized, straight to the output size;
+    - RB swap, mean/std normalization and HWC -> CHW happen in one
+      multiply-add over a transposed view, written into the output;
+    - `get_buffer` hands out a reusable, per-thread batch buffer.
+
+    The crop box is rounded to whole source pixels, so results can differ
+    from resizing the whole image and cropping afterwards by a fraction of
+    an output pixel.
+
+    Args:
+        input_size: side length of the square output.
+        mean, stddev: RGB normalization, in units of the dtype's max value.
+        multicrop_size: short side the image is resized to before the five
+            crops of the 'multicrop5' augmentation, defaults to input_size / 0.875.
+    """
+    def __init__(self, input_size=224, mean=(0.485, 0.456, 0.406), stddev=(0.229, 0.224, 0.225),
+                 multicrop_size=None):
+        self.input_size = input_size
+        self.multicrop_size = multicrop_size or int(round(input_size / 0.875))
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.stddev = np.asarray(stddev, dtype=np.float32)
+        self._scales = {}
+        self._local = threading.local()
+
+    def get_buffer(self, batch_size):
+        """Float32 buffer of shape (batch_size, 3, input_size, input_size),
+        reused by later calls from the same thread.
+        """
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None or len(buffer) < batch_size:
+            buffer = np.empty((batch_size, 3, self.input_size, self.input_size), dtype=np.float32)
+            self._local.buffer = buffer
+        return buffer[:batch_size]
+
+    def get_crop_box(self, width, height):
+        """Source box (x_min, y_min, x_max, y_max) which covers the center
+        crop of the image resized to `input_size` on its short side.
+        """
+        # same rounding as khandy.resize_image_short
+        if width < height:
+            scale = self.input_size / width
+            resized_width, resized_height = self.input_size, round(height * scale)
+        else:
+            scale = self.input_size / height
+            resized_width, resized_height = round(width * scale), self.input_size
+        crop_left = (resized_width - self.input_size) // 2
+        crop_top = (resized_height - self.input_size) // 2
+        x_min = min(max(int(round(crop_left / scale)), 0), width - 1)
+        y_min = min(max(int(round(crop_top / scale)), 0), height - 1)
+        x_max = min(max(int(round((crop_left + self.input_size) / scale)), x_min + 1), width)
+        y_max = min(max(int(round((crop_top + self.input_size) / scale)), y_min + 1), height)
+        return x_min, y_min, x_max, y_max
+
+    def crop_and_resize(self, image):
+        """Center crop region of `image` resized to input_size x input_size."""
+        height, width = image.shape[:2]
+        x_min, y_min, x_max, y_max = self.get_crop_box(width, height)
+        roi = image[y_min: y_max, x_min: x_max]
+        if roi.shape[0] == self.input_size and roi.shape[1] == self.input_size:
+            return roi
+        # same interpolation choice as khandy.resize_image
+        if roi.shape[0] > self.input_size and roi.shape[1] > self.input_size:
+            interpolation = cv2.INTER_AREA
+        else:
+            interpolation = cv2.INTER_LINEAR
+        return cv2.resize(roi, (self.input_size, self.input_size), interpolation=interpolation)
+
+    @staticmethod
+    def get_num_views(tta=None):
+        """Tensors per image for test-time augmentation mode `tta`, 1 for None."""
+        if tta is None:
+            return 1
+        if tta not in TTA_MODES:
+            raise ValueError(f'Unsupported tta mode, only support {list(TTA_MODES)}, got {tta}!')
+        return TTA_MODES[tta]
+
+    def get_min_size(self, tta=None):
+        """Smallest short side of a source image which the views of `tta`
+        use without upscaling, e.g. the `min_size` to decode images with.
+        """
+        return self.multicrop_size if tta == 'multicrop5' else self.input_size
+
+    def augment(self, image, tta, out):
+        """Write the test-time augmentation views of one image into `out`,
+        of shape (get_num_views(tta), 3, H, W).
+
+        'flip': the center crop and its mirror image; the mirror is a
+        reversed copy of the normalized tensor, not a second crop.
+        'multicrop5': the center and the four corner crops of the image
+        resized once to `multicrop_size` on its short side, which together
+        cover the edges the single center crop drops.
+        """
+        num_views = self.get_num_views(tta)
+        if len(out) != num_views:
+            raise ValueError(f'tta mode {tta} needs {num_views} output tensors, got {len(out)}!')
+        if tta == 'flip':
+            self(image, out=out[0])
+            np.copyto(out[1], out[0][:, :, ::-1])
+            return out
+
+        size = self.input_size
+        resized = self.resize_short(image, self.multicrop_size)
+        height, width = resized.shape[:2]
+        corners = [((width - size) // 2, (height - size) // 2),
+                   (0, 0), (width - size, 0), (0, height - size), (width - size, height - size)]
+        for k, (x_min, y_min) in enumerate(corners):
+            self.normalize(resized[y_min: y_min + size, x_min: x_min + size], out[k])
+        return out
+
+    @staticmethod
+    def resize_short(image, short_size):
+        """Resize `image` to `short_size` on its short side, keeping the aspect ratio."""
+        height, width = image.shape[:2]
+        if width < height:
+            resized_width, resized_height = short_size, round(height * short_size / width)
+        else:
+            resized_width, resized_height = round(width * short_size / height), short_size
+        if resized_width == width and resized_height == height:
+            return image
+        if resized_width < width and resized_height < height:
+            interpolation = cv2.INTER_AREA
+        else:
+            interpolation = cv2.INTER_LINEAR
+        return cv2.resize(image, (resized_width, resized_height), interpolation=interpolation)
+
+    def _get_scale_and_bias(self, dtype):
+        if dtype not in self._scales:
+            max_value = np.iinfo(dtype).max
+            scale = (1.0 / (self.stddev * max_value)).astype(np.float32)
+            bias = (-self.mean / self.stddev).astype(np.float32)
+            self._scales[dtype] = (scale[:, None, None], bias[:, None, None])
+        return self._scales[dtype]
+
+    def normalize(self, image, out):
+        """Write the normalized CHW RGB tensor of a BGR(A) or gray image into `out`."""
+        if not np.issubdtype(image.dtype, np.unsignedinteger):
+            raise TypeError(f'Only support uint dtype image, got {image.dtype}')
+        scale, bias = self._get_scale_and_bias(image.dtype)
+        if image.ndim == 2:
+            chw = image[None, :, :]
+        elif image.shape[-1] == 1:
+            chw = image.transpose(2, 0, 1)
+        else:
+            # BGR(A) HWC -> RGB CHW as a view, alpha is dropped
+            chw = image.transpose(2, 0, 1)[2::-1]
+        np.multiply(chw, scale, out=out)
+        out += bias
+        return out
+
+    def __call__(self, image, out=None):
+        """Preprocess one image.
+
+        Returns:
+            `out` filled in place when given (shape (3, H, W)), otherwise a
+            new tensor of shape (1, 3, H, W).
+        """
+        if out is None:
+            tensor = np.empty((1, 3, self.input_size, self.input_size), dtype=np.float32)
+            self.normalize(self.crop_and_resize(image), tensor[0])
+            return tensor
+        return self.normalize(self.crop_and_resize(image), out)
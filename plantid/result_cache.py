@@ -0,0 +1,154 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+__all__ = ['ResultCache', 'hash_bytes', 'perceptual_hash']
+
+
+def hash_bytes(data):
+    """SHA-256 hex digest of the raw upload bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def perceptual_hash(image, input_size=224, hash_size=8, min_std=4.0):
+    """Difference hash (64 bits by default) of the center crop the model sees.
+
+    The image is cropped to the central square (what `Preprocessor` keeps
+    after resizing the short side to `input_size`), reduced to a
+    (hash_size, hash_size + 1) grayscale thumbnail, and every bit tells
+    whether a pixel is brighter than its right neighbour. Re-encoded or
+    resized copies of a photo usually get the same hash.
+
+    Returns None if the thumbnail's standard deviation is below `min_std`
+    gray levels: the bits of flat, dark or blurry images are only noise
+    (all zeros for a uniform image), so different such photos would share
+    a hash.
+    """
+    height, width = image.shape[:2]
+    side = min(height, width)
+    y0, x0 = (height - side) // 2, (width - side) // 2
+    crop = image[y0: y0 + side, x0: x0 + side]
+    if side > input_size:
+        crop = cv2.resize(crop, (input_size, input_size), interpolation=cv2.INTER_AREA)
+    if crop.ndim == 3:
+        crop = cv2.cvtColor(crop[..., :3], cv2.COLOR_BGR2GRAY)
+    thumbnail = cv2.resize(crop, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    if np.std(thumbnail) < min_std:
+        return None
+    bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class ResultCache(object):
+    """Size-bounded LRU cache of `PlantIdentifier.predict` outputs.
+
+    Entries are keyed by the hash of the raw upload bytes, see `hash_bytes`,
+    and optionally also by the `perceptual_hash` of the decoded image, which
+    catches re-encoded copies of the same photo. The full probability
+    vectors are kept, so a hit can be served for any `topk` through
+    `PlantIdentifier.get_topk_results`. Safe to use from several threads.
+
+    Args:
+        max_bytes: upper bound of the memory held by cached arrays.
+        use_perceptual_hash: whether `get_by_image`/`put` use perceptual hashes.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024, use_perceptual_hash=False):
+        self.max_bytes = max_bytes
+        self.use_perceptual_hash = use_perceptual_hash
+        self._entries = OrderedDict()
+        self._perceptual_keys = {}
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.perceptual_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Cached outputs for a `hash_bytes` key, or None. Counts a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def get_by_image(self, image, namespace=None):
+        """Cached outputs of a perceptually identical image, and its hash.
+
+        Call it after `get` missed; a hit here turns that miss into a hit.
+        With `namespace` (e.g. the model version, also part of the keys),
+        the hash is the pair (namespace, perceptual hash), so outputs of
+        other namespaces are never returned.
+        Returns (None, None) if perceptual hashing is disabled or the image
+        is too flat to hash, see `perceptual_hash`.
+        """
+        if not self.use_perceptual_hash:
+            return None, None
+        phash = perceptual_hash(image)
+        if phash is None:
+            return None, None
+        if namespace is not None:
+            phash = (namespace, phash)
+        with self._lock:
+            key = self._perceptual_keys.get(phash)
+            entry = self._entries.get(key) if key is not None else None
+            if entry is None:
+                return None, phash
+            self._entries.move_to_end(key)
+            self.misses -= 1
+            self.hits += 1
+            self.perceptual_hits += 1
+            return entry[0], phash
+
+    def put(self, key, outputs, phash=None):
+        """Cache successful `predict` outputs, other statuses are ignored."""
+        if outputs['status'] != 0:
+            return
+        results = {name: np.array(value, copy=True) for name, value in outputs['results'].items()}
+        for value in results.values():
+            value.flags.writeable = False
+        outputs = {"status": 0, "message": outputs['message'], "results": results}
+        nbytes = sum(value.nbytes for value in results.values())
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (outputs, nbytes, phash)
+            self._nbytes += nbytes
+            if phash is not None:
+                self._perceptual_keys[phash] = key
+            while self._nbytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        _, nbytes, phash = entry
+        self._nbytes -= nbytes
+        if phash is not None and self._perceptual_keys.get(phash) == key:
+            del self._perceptual_keys[phash]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._perceptual_keys.clear()
+            self._nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._entries), 'bytes': self._nbytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'perceptual_hits': self.perceptual_hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'hit_rate': self.hits / lookups if lookups else 0.0}
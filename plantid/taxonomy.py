@@ -0,0 +1,168 @@
+import json
+import hashlib
+
+import numpy as np
+
+from .array_file import load_array_file, save_array_file
+
+
+__all__ = ['StringTable', 'TaxonomyIndex']
+
+
+class StringTable(object):
+    """Read-only, list-like table of strings.
+
+    All strings are stored as one UTF-8 byte buffer plus an offsets array,
+    so the table costs two numpy arrays instead of one Python object per
+    string, and can be backed by a memory-mapped file.
+    """
+    __slots__ = ('data', 'offsets')
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_list(cls, strings):
+        encoded = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(item) for item in encoded], out=offsets[1:])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(data, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[k] for k in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('StringTable index out of range')
+        return self.data[self.offsets[index]: self.offsets[index + 1]].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+    def take(self, indices):
+        """Strings at a sequence of indices, cheaper than indexing one by one."""
+        indices = np.asarray(indices, dtype=np.int64)
+        starts = self.offsets[indices].tolist()
+        ends = self.offsets[indices + 1].tolist()
+        data = memoryview(self.data)
+        return [str(data[start: end], 'utf-8') for start, end in zip(starts, ends)]
+
+    def index(self, value):
+        for k, item in enumerate(self):
+            if item == value:
+                return k
+        raise ValueError(f'{value!r} is not in StringTable')
+
+    def tolist(self):
+        return list(self)
+
+
+class TaxonomyIndex(object):
+    """Integer-indexed, struct-of-arrays view of the plant label map.
+
+    Species, genera and families are addressed by their integer ids: the
+    species id is the model class index, genus and family ids follow the
+    order of `genus_taxons` and `family_taxons` in the JSON label map.
+
+    The index can be saved to a binary file which `load` memory-maps, so
+    that several worker processes share one copy of the label data. The
+    file records the SHA-256 of the JSON label map it was built from
+    (`source_sha256`), see `is_built_from`.
+    """
+    MAGIC = b'PLANTIDX'
+    VERSION = 2
+    _STRING_FIELDS = ('species_chinese_names', 'species_latin_names',
+                      'genus_chinese_names', 'genus_latin_names',
+                      'family_chinese_names', 'family_latin_names')
+    _ARRAY_FIELDS = ('species_genus_ids', 'species_family_ids')
+
+    __slots__ = _STRING_FIELDS + _ARRAY_FIELDS + ('source_sha256',)
+
+    def __init__(self, source_sha256=None, **fields):
+        for name in self._STRING_FIELDS + self._ARRAY_FIELDS:
+            setattr(self, name, fields[name])
+        self.source_sha256 = source_sha256
+
+    @property
+    def num_species(self):
+        return len(self.species_chinese_names)
+
+    @property
+    def num_genera(self):
+        return len(self.genus_chinese_names)
+
+    @property
+    def num_families(self):
+        return len(self.family_chinese_names)
+
+    @classmethod
+    def from_label_map(cls, label_map):
+        """Build the index from the nested dicts of `quarrying_plantid_label_map.json`."""
+        species_taxons = label_map['species_taxons']
+        num_species = len(species_taxons)
+        species = [species_taxons[str(k)] for k in range(num_species)]
+
+        fields = {
+            'species_chinese_names': StringTable.from_list([item['chinese_name'] for item in species]),
+            'species_latin_names': StringTable.from_list([item['latin_name'] for item in species]),
+        }
+        for level in ('genus', 'family'):
+            taxons = label_map[f'{level}_taxons']
+            superclass_ids = np.full(num_species, -1, dtype=np.int32)
+            for superclass_id, value in enumerate(taxons.values()):
+                superclass_ids[value['class_indices']] = superclass_id
+            if np.any(superclass_ids < 0):
+                raise ValueError(f'Some species do not belong to any {level}!')
+            fields[f'species_{level}_ids'] = superclass_ids
+            fields[f'{level}_chinese_names'] = StringTable.from_list(list(taxons.keys()))
+            fields[f'{level}_latin_names'] = StringTable.from_list(
+                [value['latin_name'] for value in taxons.values()])
+        return cls(**fields)
+
+    @classmethod
+    def load_json(cls, filename):
+        with open(filename, 'rb') as f:
+            content = f.read()
+        taxonomy = cls.from_label_map(json.loads(content))
+        taxonomy.source_sha256 = hashlib.sha256(content).hexdigest()
+        return taxonomy
+
+    def is_built_from(self, label_map_path):
+        """Whether the index was built from the current contents of the JSON label map."""
+        if self.source_sha256 is None:
+            return False
+        with open(label_map_path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest() == self.source_sha256
+
+    def _named_arrays(self):
+        arrays = {}
+        for name in self._STRING_FIELDS:
+            table = getattr(self, name)
+            arrays[f'{name}.data'] = table.data
+            arrays[f'{name}.offsets'] = table.offsets
+        for name in self._ARRAY_FIELDS:
+            arrays[name] = getattr(self, name)
+        return arrays
+
+    def save(self, filename):
+        """Save the index to a binary file, see `save_array_file`."""
+        save_array_file(filename, self.MAGIC, self.VERSION, self._named_arrays(),
+                        {'source_sha256': self.source_sha256})
+
+    @classmethod
+    def load(cls, filename, mmap=True):
+        """Load an index saved by `save`, memory-mapped read-only by default."""
+        arrays, metadata = load_array_file(filename, cls.MAGIC, cls.VERSION, 'plant taxonomy index', mmap)
+        fields = {'source_sha256': metadata['source_sha256']}
+        for name in cls._STRING_FIELDS:
+            fields[name] = StringTable(arrays[f'{name}.data'], arrays[f'{name}.offsets'])
+        for name in cls._ARRAY_FIELDS:
+            fields[name] = arrays[name]
+        return cls(**fields)
@@ -0,0 +1,301 @@
+import numpy as np
+
+from .array_file import load_array_file, save_array_file
+from .identifier import top_k
+from .taxonomy import StringTable
+
+
+__all__ = ['VectorIndex', 'normalize_rows']
+
+
+def normalize_rows(x):
+    """Float32 copy of `x` with every row scaled to unit L2 norm."""
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+def _merge_topk(scores, indices, k):
+    """Best k of every row of (scores, indices), in descending order."""
+    scores, order = top_k(scores, k)
+    return scores, np.take_along_axis(indices, order, axis=-1)
+
+
+def _assign(x, centroids, chunk_rows=65536):
+    """Index of the centroid nearest to every row of `x`, in Euclidean distance."""
+    half_norms = 0.5 * np.einsum('ij,ij->i', centroids, centroids)
+    assignments = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), chunk_rows):
+        block = np.asarray(x[start: start + chunk_rows], dtype=np.float32)
+        assignments[start: start + len(block)] = np.argmax(block @ centroids.T - half_norms, axis=-1)
+    return assignments
+
+
+def kmeans(x, num_clusters, num_iters=20, seed=0):
+    """Lloyd's k-means of the float32 rows of `x`; empty clusters are
+    restarted at random rows.
+
+    Returns:
+        float32 centroids of shape (num_clusters, D).
+    """
+    rng = np.random.default_rng(seed)
+    x = np.asarray(x, dtype=np.float32)
+    num_clusters = min(num_clusters, len(x))
+    centroids = x[rng.choice(len(x), num_clusters, replace=False)].copy()
+    for _ in range(num_iters):
+        assignments = _assign(x, centroids)
+        counts = np.bincount(assignments, minlength=num_clusters)
+        order = np.argsort(assignments, kind='stable')
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        nonempty = counts > 0
+        sums = np.add.reduceat(x[order], starts[nonempty], axis=0)
+        centroids[nonempty] = sums / counts[nonempty, None]
+        num_empty = int(np.count_nonzero(~nonempty))
+        if num_empty > 0:
+            centroids[~nonempty] = x[rng.choice(len(x), num_empty, replace=False)]
+    return centroids
+
+
+class VectorIndex(object):
+    """Nearest-neighbour index over L2-normalized embeddings, e.g. of
+    `EmbeddingExtractor`; scores are cosine similarities.
+
+    Vectors are stored as one float16 matrix which `load` memory-maps, and
+    searched by brute force: blocks are converted to float32 and scored
+    with one matrix product (BLAS) per block, keeping a running top-k. So
+    memory stays bounded and several processes share the page cache.
+
+    Two optional structures make search sublinear for millions of vectors:
+    - IVF: vectors are clustered into `num_lists` lists, stored list by
+      list; a query scans only the `nprobe` lists whose centroids are the
+      nearest to it.
+    - PQ: every vector also gets a code of `num_subspaces` bytes (product
+      quantization, 256 centroids per subspace); the scanned vectors are
+      scored from their codes with a lookup table, and only the best
+      `rerank` candidates are rescored exactly with the float16 vectors.
+
+    Every vector has a label id, whose name is in `label_names`, and a path.
+    """
+    MAGIC = b'PLANTVEC'
+    VERSION = 2
+    _FIELDS = ('vectors', 'labels', 'label_names', 'paths',
+               'centroids', 'list_offsets', 'codebooks', 'codes')
+    _STRING_FIELDS = ('label_names', 'paths')
+
+    __slots__ = _FIELDS
+
+    def __init__(self, vectors, labels, label_names, paths, centroids=None, list_offsets=None,
+                 codebooks=None, codes=None):
+        self.vectors = vectors
+        self.labels = labels
+        self.label_names = label_names
+        self.paths = paths
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.codebooks = codebooks
+        self.codes = codes
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    @property
+    def num_lists(self):
+        return 0 if self.centroids is None else len(self.centroids)
+
+    @property
+    def num_subspaces(self):
+        return 0 if self.codebooks is None else len(self.codebooks)
+
+    @classmethod
+    def build(cls, vectors, labels, label_names, paths, num_lists=0, num_subspaces=0,
+              num_iters=20, max_train_size=262144, seed=0, chunk_rows=65536):
+        """Build an index.
+
+        Args:
+            vectors: (N, D) embeddings, normalized here.
+            labels: (N,) label ids, indices into `label_names`.
+            label_names, paths: lists of strings, paths has N items.
+            num_lists: IVF lists, 0 for none; about sqrt(N) is a good start.
+            num_subspaces: PQ code bytes per vector, 0 for none; must divide D.
+            max_train_size: vectors sampled to train IVF and PQ.
+        """
+        num_vectors = len(vectors)
+        if len(labels) != num_vectors or len(paths) != num_vectors:
+            raise ValueError('vectors, labels and paths must have the same length!')
+        if num_vectors == 0:
+            raise ValueError('Cannot build an index without vectors!')
+        dim = vectors.shape[1]
+        if num_subspaces > 0 and dim % num_subspaces != 0:
+            raise ValueError(f'num_subspaces must divide the dimension {dim}, got {num_subspaces}!')
+
+        normalized = np.empty((num_vectors, dim), dtype=np.float16)
+        for start in range(0, num_vectors, chunk_rows):
+            normalized[start: start + chunk_rows] = normalize_rows(vectors[start: start + chunk_rows])
+        labels = np.asarray(labels, dtype=np.int32)
+        rng = np.random.default_rng(seed)
+        train_indices = np.sort(rng.choice(num_vectors, min(num_vectors, max_train_size), replace=False))
+        train = normalized[train_indices].astype(np.float32)
+
+        centroids = list_offsets = None
+        order = np.arange(num_vectors)
+        if num_lists > 0:
+            centroids = normalize_rows(kmeans(train, num_lists, num_iters, seed))
+            # for unit vectors the nearest centroid in Euclidean distance has the highest dot product
+            assignments = _assign(normalized, centroids, chunk_rows)
+            order = np.argsort(assignments, kind='stable')
+            list_offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(assignments, minlength=len(centroids)), out=list_offsets[1:])
+            normalized = normalized[order]
+            labels = labels[order]
+            # with IVF, PQ encodes the residuals to the list centroids, which are much finer
+            train -= centroids[_assign(train, centroids, chunk_rows)]
+
+        codebooks = codes = None
+        if num_subspaces > 0:
+            sub_dim = dim // num_subspaces
+            codebooks = np.zeros((num_subspaces, 256, sub_dim), dtype=np.float32)
+            for m in range(num_subspaces):
+                sub_centroids = kmeans(train[:, m * sub_dim: (m + 1) * sub_dim], 256, num_iters, seed + m)
+                codebooks[m, :len(sub_centroids)] = sub_centroids
+            codes = np.empty((num_vectors, num_subspaces), dtype=np.uint8)
+            list_ids = None if centroids is None else np.repeat(np.arange(len(centroids)), np.diff(list_offsets))
+            for start in range(0, num_vectors, chunk_rows):
+                block = normalized[start: start + chunk_rows].astype(np.float32)
+                if list_ids is not None:
+                    block -= centroids[list_ids[start: start + len(block)]]
+                for m in range(num_subspaces):
+                    codes[start: start + len(block), m] = _assign(
+                        block[:, m * sub_dim: (m + 1) * sub_dim], codebooks[m], chunk_rows)
+
+        return cls(normalized, labels, StringTable.from_list(list(label_names)),
+                   StringTable.from_list([paths[k] for k in order.tolist()]),
+                   centroids, list_offsets, codebooks, codes)
+
+    def search(self, queries, k=10, nprobe=8, rerank=None, chunk_rows=16384):
+        """The k nearest vectors of every query.
+
+        Args:
+            queries: (D,) or (Q, D) embeddings, normalized here.
+            nprobe: IVF lists scanned per query; ignored without IVF, all
+                lists if None.
+            rerank: PQ candidates rescored exactly, defaults to 16 * k;
+                ignored without PQ.
+
+        Returns:
+            (scores, indices), both of shape (Q, k), best first. Rows with
+            fewer than k candidates are padded with -inf and -1.
+        """
+        queries = normalize_rows(np.atleast_2d(queries))
+        all_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        all_indices = np.full((len(queries), k), -1, dtype=np.int64)
+        if self.centroids is None and self.codes is None:
+            # brute force: score all queries at once, block by block
+            for start in range(0, len(self), chunk_rows):
+                block = self.vectors[start: start + chunk_rows].astype(np.float32)
+                block_indices = np.broadcast_to(np.arange(start, start + len(block)), (len(queries), len(block)))
+                all_scores, all_indices = _merge_topk(
+                    np.concatenate([all_scores, queries @ block.T], axis=1),
+                    np.concatenate([all_indices, block_indices], axis=1), k)
+            return self._pad(all_scores, all_indices)
+
+        if self.centroids is None:
+            list_indices = np.zeros((len(queries), 1), dtype=np.int64)
+            list_offsets = np.array([0, len(self)], dtype=np.int64)
+        else:
+            nprobe = self.num_lists if nprobe is None else nprobe
+            list_scores = queries @ self.centroids.T
+            _, list_indices = top_k(list_scores, nprobe)
+            list_offsets = self.list_offsets
+        rerank = max(rerank or 16 * k, k)
+        for q, (query, lists) in enumerate(zip(queries, list_indices)):
+            # scan the lists in storage order, so the memory map is read sequentially
+            lists = np.sort(lists)
+            sizes = list_offsets[lists + 1] - list_offsets[lists]
+            candidates = np.concatenate([np.arange(list_offsets[item], list_offsets[item + 1]) for item in lists])
+            if len(candidates) == 0:
+                continue
+            if self.codes is not None and len(candidates) > rerank:
+                base_scores = 0 if self.centroids is None else np.repeat(list_scores[q, lists], sizes)
+                candidates = self._pq_candidates(query, candidates, base_scores, rerank, chunk_rows)
+            scores, indices = self._exact_topk(query[None], candidates, k, chunk_rows)
+            all_scores[q, :scores.shape[1]] = scores[0]
+            all_indices[q, :indices.shape[1]] = indices[0]
+        return self._pad(all_scores, all_indices)
+
+    @staticmethod
+    def _pad(scores, indices):
+        scores[indices < 0] = -np.inf
+        return scores, indices
+
+    def _exact_topk(self, queries, candidates, k, chunk_rows):
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_indices = np.full((len(queries), 0), -1, dtype=np.int64)
+        for start in range(0, len(candidates), chunk_rows):
+            indices = candidates[start: start + chunk_rows]
+            # ranges are sorted, so this reads the memory map sequentially
+            block = self.vectors[indices].astype(np.float32)
+            best_scores, best_indices = _merge_topk(
+                np.concatenate([best_scores, queries @ block.T], axis=1),
+                np.concatenate([best_indices, np.broadcast_to(indices, (len(queries), len(indices)))], axis=1), k)
+        return best_scores, best_indices
+
+    def _pq_candidates(self, query, candidates, base_scores, rerank, chunk_rows):
+        """The `rerank` candidates with the best PQ scores, in storage order.
+
+        The approximate score of a vector is `base_scores` (the query dot
+        its list centroid with IVF) plus the table entries of its code.
+        """
+        num_subspaces, _, sub_dim = self.codebooks.shape
+        # lookup table of the dot products of every query part with every subspace centroid
+        table = np.einsum('md,mcd->mc', query.reshape(num_subspaces, sub_dim), self.codebooks)
+        subspaces = np.arange(num_subspaces)
+        scores = np.empty(len(candidates), dtype=np.float32)
+        for start in range(0, len(candidates), chunk_rows):
+            codes = self.codes[candidates[start: start + chunk_rows]]
+            scores[start: start + len(codes)] = table[subspaces, codes].sum(axis=-1)
+        scores += base_scores
+        _, best = top_k(scores, rerank)
+        return candidates[np.sort(best)]
+
+    def get_results(self, scores, indices):
+        """Search results of one query as dicts with path, label and score."""
+        results = []
+        for score, index in zip(scores.tolist(), indices.tolist()):
+            if index < 0:
+                continue
+            results.append({'path': self.paths[index], 'label': self.label_names[int(self.labels[index])],
+                            'score': score})
+        return results
+
+    def _named_arrays(self):
+        arrays = {}
+        for name in self._FIELDS:
+            value = getattr(self, name)
+            if value is None:
+                continue
+            if name in self._STRING_FIELDS:
+                arrays[f'{name}.data'] = value.data
+                arrays[f'{name}.offsets'] = value.offsets
+            else:
+                arrays[name] = value
+        return arrays
+
+    def save(self, filename):
+        """Save the index to a binary file, see `save_array_file`."""
+        save_array_file(filename, self.MAGIC, self.VERSION, self._named_arrays())
+
+    @classmethod
+    def load(cls, filename, mmap=True):
+        """Load an index saved by `save`, memory-mapped read-only by default."""
+        arrays, _ = load_array_file(filename, cls.MAGIC, cls.VERSION, 'plant vector index', mmap)
+        fields = {}
+        for name in cls._FIELDS:
+            if name in cls._STRING_FIELDS:
+                fields[name] = StringTable(arrays[f'{name}.data'], arrays[f'{name}.offsets'])
+            else:
+                fields[name] = arrays.get(name)
+        return cls(**fields)
@@ -0,0 +1,79 @@
+"""Tests of tools/bulk_identify.py on a synthetic model.
+
+    python -m pytest -q test_bulk_identify.py
+"""
+import csv
+import json
+
+import pytest
+
+import plantid
+from benchmarks.common import encode_jpeg, make_image
+from bulk_identify import BulkIdentifier, CsvWriter, JsonlWriter, get_columns
+
+
+def write_images(src_dir, num_images):
+    """A broken file first, then `num_images` valid JPEGs."""
+    filenames = [str(src_dir / '0_broken.jpg')]
+    (src_dir / '0_broken.jpg').write_bytes(b'not an image')
+    for k in range(num_images):
+        filename = src_dir / '{}_image.jpg'.format(k + 1)
+        filename.write_bytes(encode_jpeg(make_image(320, 240, seed=k)))
+        filenames.append(str(filename))
+    return filenames
+
+
+def run_bulk(model_dir, writer, filenames, topk=3, action=None):
+    identifier = plantid.PlantIdentifier(model_dir, use_cache=False)
+    label = identifier.get_plant_names()[0][0]
+    bulk_identifier = BulkIdentifier(identifier, writer, set(), topk=topk, batch_size=2, num_workers=1,
+                                     queue_size=4, action=action, label=label)
+    try:
+        bulk_identifier.run(iter(filenames))
+    finally:
+        writer.close()
+
+
+@pytest.mark.parametrize('action', [None, 'rename'])
+def test_csv_first_image_fails(synthetic_model_dir, tmp_path, action):
+    src_dir = tmp_path / 'src'
+    src_dir.mkdir()
+    filenames = write_images(src_dir, 3)
+    output = str(tmp_path / 'results.csv')
+    run_bulk(synthetic_model_dir, CsvWriter(output, get_columns(3)), filenames, action=action)
+
+    with open(output, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.DictReader(f)
+        rows = list(reader)
+    assert reader.fieldnames == get_columns(3)
+    assert [row['path'] for row in rows] == filenames
+    assert rows[0]['status'] == '-1' and rows[0]['label_probability'] == '' and rows[0]['dst_path'] == ''
+    assert all(row['status'] == '0' for row in rows[1:])
+    if action == 'rename':
+        assert all(float(row['label_probability']) >= 0 and row['dst_path'] for row in rows[1:])
+
+
+def test_jsonl_rows_share_columns(synthetic_model_dir, tmp_path):
+    src_dir = tmp_path / 'src'
+    src_dir.mkdir()
+    filenames = write_images(src_dir, 2)
+    output = str(tmp_path / 'results.jsonl')
+    run_bulk(synthetic_model_dir, JsonlWriter(output, get_columns(3)), filenames)
+
+    with open(output, 'r', encoding='utf-8') as f:
+        rows = [json.loads(line) for line in f]
+    assert [list(row.keys()) for row in rows] == [get_columns(3)] * len(filenames)
+    assert rows[0]['label_probability'] is None
+
+
+@pytest.mark.parametrize('writer_class, suffix', [(CsvWriter, '.csv'), (JsonlWriter, '.jsonl')])
+def test_resume_checks_columns(synthetic_model_dir, tmp_path, writer_class, suffix):
+    src_dir = tmp_path / 'src'
+    src_dir.mkdir()
+    filenames = write_images(src_dir, 1)
+    output = str(tmp_path / ('results' + suffix))
+    run_bulk(synthetic_model_dir, writer_class(output, get_columns(3)), filenames)
+
+    writer_class(output, get_columns(3)).close()
+    with pytest.raises(ValueError):
+        writer_class(output, get_columns(5))
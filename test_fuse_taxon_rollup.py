@@ -0,0 +1,39 @@
+"""Tests of tools/fuse_taxon_rollup.py on a synthetic model.
+
+    python -m pytest -q test_fuse_taxon_rollup.py
+"""
+import os
+import shutil
+
+import numpy as np
+
+import plantid
+from fuse_taxon_rollup import fuse_taxon_rollup, get_segment_indices
+
+
+def test_segment_indices_cover_every_class_once(synthetic_model_dir):
+    plant_identifier = plantid.PlantIdentifier(synthetic_model_dir)
+    num_classes = len(plant_identifier.names)
+    for rollup in (plant_identifier.family_rollup, plant_identifier.genus_rollup):
+        indices = get_segment_indices(rollup, num_classes)
+        assert indices.shape == (rollup.num_superclasses, rollup.lengths.max())
+        assert np.array_equal(np.sort(indices[indices < num_classes]), np.arange(num_classes))
+        assert np.array_equal((indices < num_classes).sum(axis=1), rollup.lengths)
+
+
+def test_fused_model_matches_numpy_rollup(synthetic_model_dir, tmp_path):
+    fused_dir = tmp_path / 'fused'
+    fused_dir.mkdir()
+    shutil.copy(os.path.join(synthetic_model_dir, 'quarrying_plantid_label_map.json'), fused_dir)
+    # fuse_taxon_rollup itself checks non-negative outputs within a tight atol
+    fuse_taxon_rollup(synthetic_model_dir, str(fused_dir / 'quarrying_plantid_model.onnx'))
+
+    fused_identifier = plantid.PlantIdentifier(str(fused_dir))
+    assert fused_identifier.fused_rollup
+    plant_identifier = plantid.PlantIdentifier(synthetic_model_dir)
+    image = np.random.default_rng(1).integers(0, 256, (300, 400, 3), dtype=np.uint8)
+    expected = plant_identifier.predict(image)['results']
+    actual = fused_identifier.predict(image)['results']
+    for name in ('probs', 'family_probs', 'genus_probs'):
+        assert actual[name].min() >= 0
+        np.testing.assert_allclose(actual[name], expected[name], rtol=0, atol=1e-6)
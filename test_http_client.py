@@ -0,0 +1,242 @@
+"""Tests of ResilientClient and its CircuitBreaker against tools/mock_gemini_server.py.
+
+    python -m pytest -q test_http_client.py
+"""
+import time
+import asyncio
+
+import httpx
+import pytest
+
+import mock_gemini_server
+from plantid.http_client import CircuitBreaker, CircuitOpenError, DeadlineExceededError, ResilientClient
+from plantid.invasive import InvasiveChecker
+
+
+def make_client(**kwargs):
+    options = dict(timeout=5.0, attempt_timeout=2.0, max_retries=2, backoff_base=0.01,
+                   backoff_max=0.05, failure_threshold=100, recovery_time=30.0, http2=False)
+    options.update(kwargs)
+    return ResilientClient(**options)
+
+
+def post(client, url, timeout=None):
+    return client.post(url, timeout=timeout, json={'contents': [{'parts': [{'text': 'plant'}]}]})
+
+
+def get_num_calls():
+    return mock_gemini_server.MockGeminiHandler.num_calls
+
+
+def test_retries_until_success(mock_gemini):
+    mock_gemini_server.MockGeminiHandler.fail_first = 2
+
+    async def run():
+        client = make_client(max_retries=2)
+        try:
+            response = await post(client, mock_gemini)
+        finally:
+            await client.aclose()
+        return client, response
+
+    client, response = asyncio.run(run())
+    assert response.status_code == 200
+    assert get_num_calls() == 3
+    assert client.num_retries == 2
+    assert client.num_failures == 2
+    assert client.circuit_breaker.state == CircuitBreaker.CLOSED
+
+
+def test_retries_give_up_after_max_retries(mock_gemini):
+    mock_gemini_server.MockGeminiHandler.error_rate = 1.0
+
+    async def run():
+        client = make_client(max_retries=2)
+        try:
+            with pytest.raises(httpx.HTTPStatusError):
+                await post(client, mock_gemini)
+        finally:
+            await client.aclose()
+
+    asyncio.run(run())
+    assert get_num_calls() == 3
+
+
+def test_deadline_bounds_slow_upstream(mock_gemini):
+    mock_gemini_server.MockGeminiHandler.latency = 2.0
+
+    async def run():
+        client = make_client(attempt_timeout=5.0)
+        try:
+            start_time = time.monotonic()
+            with pytest.raises(DeadlineExceededError):
+                await post(client, mock_gemini, timeout=0.3)
+            return time.monotonic() - start_time
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(run()) < 1.0
+
+
+def test_deadline_stops_retries(mock_gemini):
+    mock_gemini_server.MockGeminiHandler.error_rate = 1.0
+
+    async def run():
+        client = make_client(max_retries=100, backoff_base=0.2, backoff_max=0.2)
+        try:
+            start_time = time.monotonic()
+            with pytest.raises((httpx.HTTPStatusError, DeadlineExceededError)):
+                await post(client, mock_gemini, timeout=0.5)
+            return time.monotonic() - start_time
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(run()) < 1.0
+    assert get_num_calls() < 100
+
+
+@pytest.mark.parametrize('status', [401, 403])
+def test_rejected_requests_count_as_failures_without_retries(mock_gemini, status):
+    handler = mock_gemini_server.MockGeminiHandler
+    handler.error_rate = 1.0
+    handler.error_status = status
+
+    async def run():
+        client = make_client(max_retries=2, failure_threshold=2)
+        try:
+            for _ in range(2):
+                assert (await post(client, mock_gemini)).status_code == status
+            with pytest.raises(CircuitOpenError):
+                await post(client, mock_gemini)
+        finally:
+            await client.aclose()
+        return client
+
+    client = asyncio.run(run())
+    assert get_num_calls() == 2
+    assert client.num_retries == 0
+    assert client.num_failures == 2
+    assert client.circuit_breaker.state == CircuitBreaker.OPEN
+
+
+def test_rate_limited_requests_count_as_failures(mock_gemini):
+    handler = mock_gemini_server.MockGeminiHandler
+    handler.error_rate = 1.0
+    handler.error_status = 429
+
+    async def run():
+        client = make_client(max_retries=1, failure_threshold=2)
+        try:
+            with pytest.raises(httpx.HTTPStatusError):
+                await post(client, mock_gemini)
+        finally:
+            await client.aclose()
+        return client
+
+    client = asyncio.run(run())
+    assert get_num_calls() == 2
+    assert client.num_failures == 2
+    assert client.circuit_breaker.state == CircuitBreaker.OPEN
+
+
+@pytest.mark.parametrize('status', [400, 404])
+def test_bad_requests_neither_fail_nor_reset_the_circuit(mock_gemini, status):
+    handler = mock_gemini_server.MockGeminiHandler
+    handler.fail_first = 1
+
+    async def run():
+        client = make_client(max_retries=0, failure_threshold=3)
+        try:
+            with pytest.raises(httpx.HTTPStatusError):
+                await post(client, mock_gemini)
+            handler.error_rate = 1.0
+            handler.error_status = status
+            for _ in range(5):
+                assert (await post(client, mock_gemini)).status_code == status
+        finally:
+            await client.aclose()
+        return client
+
+    client = asyncio.run(run())
+    assert client.num_failures == 1
+    assert client.circuit_breaker.failures == 1
+    assert client.circuit_breaker.state == CircuitBreaker.CLOSED
+
+
+def test_circuit_opens_half_opens_and_closes(mock_gemini):
+    handler = mock_gemini_server.MockGeminiHandler
+    handler.error_rate = 1.0
+
+    async def run():
+        client = make_client(max_retries=0, failure_threshold=2, recovery_time=0.2)
+        breaker = client.circuit_breaker
+        try:
+            for _ in range(2):
+                with pytest.raises(httpx.HTTPStatusError):
+                    await post(client, mock_gemini)
+            assert breaker.state == CircuitBreaker.OPEN
+
+            # open: rejected without calling the upstream
+            num_calls = get_num_calls()
+            with pytest.raises(CircuitOpenError):
+                await post(client, mock_gemini)
+            assert get_num_calls() == num_calls
+            assert client.num_rejected == 1
+
+            # a failed trial call opens the circuit again
+            await asyncio.sleep(0.25)
+            with pytest.raises(httpx.HTTPStatusError):
+                await post(client, mock_gemini)
+            assert breaker.state == CircuitBreaker.OPEN
+
+            # half-open: a single trial call, the others are rejected meanwhile
+            await asyncio.sleep(0.25)
+            handler.error_rate = 0.0
+            handler.latency = 0.3
+            trial = asyncio.ensure_future(post(client, mock_gemini))
+            await asyncio.sleep(0.1)
+            assert breaker.state == CircuitBreaker.HALF_OPEN
+            with pytest.raises(CircuitOpenError):
+                await post(client, mock_gemini)
+            assert (await trial).status_code == 200
+            assert breaker.state == CircuitBreaker.CLOSED
+
+            handler.latency = 0.0
+            assert (await post(client, mock_gemini)).status_code == 200
+        finally:
+            await client.aclose()
+
+    asyncio.run(run())
+
+
+def test_check_invasive_answers_from_mock(mock_gemini):
+    async def run():
+        checker = InvasiveChecker(cache=False, api_url=mock_gemini, knowledge_base=False,
+                                  http_client=make_client())
+        try:
+            return await checker.check_invasive('Eichhornia crassipes', 'Spain')
+        finally:
+            await checker.close()
+
+    result = asyncio.run(run())
+    assert result['severity'] in ('Medium', 'None')
+    assert result['reason'] == 'Mock answer.'
+
+
+def test_check_invasive_while_circuit_open(mock_gemini):
+    mock_gemini_server.MockGeminiHandler.error_rate = 1.0
+
+    async def run():
+        checker = InvasiveChecker(cache=False, api_url=mock_gemini, knowledge_base=False,
+                                  http_client=make_client(max_retries=0, failure_threshold=1))
+        try:
+            first = await checker.check_invasive('Eichhornia crassipes', 'Spain')
+            second = await checker.check_invasive('Eichhornia crassipes', 'Spain')
+        finally:
+            await checker.close()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first['severity'] == 'Error'
+    assert second['reason'] == 'AI service temporarily unavailable.'
+    assert get_num_calls() == 1
@@ -1,4 +1,5 @@
 import asyncio
+import time
 from plantid.invasive import InvasiveChecker
 
 async def main():
@@ -14,5 +15,13 @@ async def main():
     result2 = await checker.check_invasive("凤眼蓝", "China")
     print(f"Result: {result2}")
 
+    # Test case 3: Same query as case 1 with different formatting (Should be served from cache)
+    print("\nTesting: Water Hyacinth (凤眼蓝) in '  spain. ' again")
+    start_time = time.time()
+    result3 = await checker.check_invasive("凤眼蓝", "  spain. ")
+    print(f"Result: {result3} ({time.time() - start_time:.4f}s)")
+
+    await checker.close()
+
 if __name__ == "__main__":
     asyncio.run(main())
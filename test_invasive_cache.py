@@ -0,0 +1,166 @@
+"""Tests of InvasiveCache, alone and behind InvasiveChecker with tools/mock_gemini_server.py.
+
+    python -m pytest -q test_invasive_cache.py
+"""
+import time
+import asyncio
+
+import mock_gemini_server
+from plantid.http_client import ResilientClient
+from plantid.invasive import InvasiveChecker
+from plantid.invasive_cache import InvasiveCache, TTLCache, make_cache_key
+
+
+def make_checker(api_url, cache, **client_kwargs):
+    options = dict(timeout=5.0, attempt_timeout=2.0, max_retries=0, http2=False)
+    options.update(client_kwargs)
+    return InvasiveChecker(cache=cache, api_url=api_url, knowledge_base=False,
+                           http_client=ResilientClient(**options))
+
+
+def get_num_calls():
+    return mock_gemini_server.MockGeminiHandler.num_calls
+
+
+async def close_checker(checker):
+    # keep the cache open, some tests look at it afterwards
+    await checker.client.aclose()
+
+
+def test_concurrent_misses_fetch_once(mock_gemini):
+    mock_gemini_server.MockGeminiHandler.latency = 0.2
+    cache = InvasiveCache()
+
+    async def run():
+        checker = make_checker(mock_gemini, cache)
+        try:
+            return await asyncio.gather(*[checker.check_invasive('Eichhornia crassipes', 'Spain')
+                                          for _ in range(10)])
+        finally:
+            await close_checker(checker)
+
+    results = asyncio.run(run())
+    assert get_num_calls() == 1
+    assert all(result == results[0] for result in results)
+    assert (cache.misses, cache.coalesced) == (1, 9)
+
+
+def test_cancelled_owner_does_not_cancel_waiters(mock_gemini):
+    mock_gemini_server.MockGeminiHandler.latency = 0.3
+    cache = InvasiveCache()
+
+    async def run():
+        checker = make_checker(mock_gemini, cache)
+        try:
+            owner = asyncio.ensure_future(checker.check_invasive('Eichhornia crassipes', 'Spain'))
+            await asyncio.sleep(0.05)
+            waiter = asyncio.ensure_future(checker.check_invasive('Eichhornia crassipes', 'Spain'))
+            await asyncio.sleep(0.05)
+            owner.cancel()
+            result = await waiter
+            return owner.cancelled(), result
+        finally:
+            await close_checker(checker)
+
+    owner_cancelled, result = asyncio.run(run())
+    assert owner_cancelled
+    assert result['severity'] != 'Error'
+    assert get_num_calls() == 1
+    assert (cache.misses, cache.coalesced) == (1, 1)
+
+
+def test_normalized_keys_share_an_entry(mock_gemini):
+    cache = InvasiveCache()
+
+    async def run():
+        checker = make_checker(mock_gemini, cache)
+        try:
+            first = await checker.check_invasive('Eichhornia crassipes', 'Madrid,Spain')
+            second = await checker.check_invasive('  EICHHORNIA  crassipes', '  madrid, spain. ')
+        finally:
+            await close_checker(checker)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == second
+    assert get_num_calls() == 1
+    assert make_cache_key('Ａbc  d', 'Madrid，Spain!') == make_cache_key('abc d', 'madrid, spain')
+
+
+def test_expired_entries_refetch(mock_gemini):
+    cache = InvasiveCache(ttl=0.2, negative_ttl=0.2)
+
+    async def run():
+        checker = make_checker(mock_gemini, cache)
+        try:
+            await checker.check_invasive('Eichhornia crassipes', 'Spain')
+            await checker.check_invasive('Eichhornia crassipes', 'Spain')
+            assert get_num_calls() == 1
+            await asyncio.sleep(0.3)
+            await checker.check_invasive('Eichhornia crassipes', 'Spain')
+        finally:
+            await close_checker(checker)
+
+    asyncio.run(run())
+    assert get_num_calls() == 2
+
+
+def test_ttl_by_result_kind():
+    cache = InvasiveCache(ttl=100, negative_ttl=10, error_ttl=1)
+    assert cache.get_ttl({'is_invasive': True, 'severity': 'High'}) == 100
+    assert cache.get_ttl({'is_invasive': False, 'severity': 'None'}) == 10
+    assert cache.get_ttl({'is_invasive': False, 'severity': 'Error'}) == 1
+
+
+def test_errors_are_kept_briefly_and_in_memory_only(mock_gemini, tmp_path):
+    mock_gemini_server.MockGeminiHandler.error_rate = 1.0
+    cache = InvasiveCache(disk_path=str(tmp_path / 'cache.sqlite3'), error_ttl=0.2)
+
+    async def run():
+        checker = make_checker(mock_gemini, cache, failure_threshold=100)
+        try:
+            first = await checker.check_invasive('Eichhornia crassipes', 'Spain')
+            await checker.check_invasive('Eichhornia crassipes', 'Spain')
+            assert get_num_calls() == 1
+            await asyncio.sleep(0.3)
+            await checker.check_invasive('Eichhornia crassipes', 'Spain')
+        finally:
+            await close_checker(checker)
+        return first
+
+    assert asyncio.run(run())['severity'] == 'Error'
+    assert get_num_calls() == 2
+    assert cache.disk.get(make_cache_key('Eichhornia crassipes', 'Spain')) is None
+    cache.close()
+
+
+def test_sqlite_shared_across_instances(mock_gemini, tmp_path):
+    disk_path = str(tmp_path / 'cache.sqlite3')
+
+    async def check(cache):
+        checker = make_checker(mock_gemini, cache)
+        try:
+            return await checker.check_invasive('Eichhornia crassipes', 'Spain')
+        finally:
+            await close_checker(checker)
+            cache.close()
+
+    first = asyncio.run(check(InvasiveCache(disk_path=disk_path)))
+    second_cache = InvasiveCache(disk_path=disk_path)
+    second = asyncio.run(check(second_cache))
+    assert first == second
+    assert get_num_calls() == 1
+    assert (second_cache.hits, second_cache.misses) == (1, 0)
+
+
+def test_lru_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2)
+    cache.set('a', 1, ttl=60)
+    cache.set('b', 2, ttl=60)
+    assert cache.get('a') == 1
+    cache.set('c', 3, ttl=60)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
+
+    cache.set('d', 4, ttl=0.05)
+    time.sleep(0.1)
+    assert cache.get('d') is None
@@ -0,0 +1,86 @@
+"""Tests of plantid.ModelManager with a fake model read from a file.
+
+    python -m pytest -q test_model_manager.py
+"""
+import os
+import time
+
+import plantid
+from plantid.model_manager import get_model_version
+
+
+def replace_file(path, contents):
+    with open(path + '.tmp', 'w') as f:
+        f.write(contents)
+    os.replace(path + '.tmp', path)
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def make_manager(path, load=None):
+    closed = []
+
+    def default_load():
+        with open(path) as f:
+            return f.read()
+
+    def close(model):
+        closed.append(model)
+
+    manager = plantid.ModelManager(load or default_load, close=close, paths=[path])
+    return manager, closed
+
+
+def test_replaced_model_closes_on_last_release(tmp_path):
+    path = str(tmp_path / 'model.txt')
+    replace_file(path, 'v1')
+    manager, closed = make_manager(path)
+
+    with manager.acquire() as (model, _):
+        replace_file(path, 'v2')
+        manager.reload().result()
+        assert manager.model == 'v2'
+        assert manager.get_status()['draining'][0]['active_requests'] == 1
+        # however long the request takes, the model it holds stays open
+        time.sleep(0.2)
+        assert closed == []
+        assert model == 'v1'
+    assert wait_for(lambda: manager.get_status()['draining'] == [])
+    assert closed == ['v1']
+
+    replace_file(path, 'v3')
+    manager.reload().result()
+    assert wait_for(lambda: len(closed) == 2)
+    assert closed == ['v1', 'v2']
+    manager.close()
+
+
+def test_version_is_that_of_the_loaded_files(tmp_path):
+    path = str(tmp_path / 'model.txt')
+    replace_file(path, 'v1')
+    num_loads = [0]
+
+    def load():
+        with open(path) as f:
+            model = f.read()
+        num_loads[0] += 1
+        if num_loads[0] == 2:
+            # replaced after the version was hashed and the file was read
+            replace_file(path, 'v3')
+        return model
+
+    manager, closed = make_manager(path, load)
+    replace_file(path, 'v2')
+    status = manager.reload().result()
+    assert num_loads[0] == 3
+    # the inconsistent load, then the replaced model
+    assert wait_for(lambda: len(closed) == 2)
+    assert closed == ['v2', 'v1']
+    assert manager.model == 'v3'
+    assert status['version'] == get_model_version([path])
+    manager.close()
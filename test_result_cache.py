@@ -0,0 +1,52 @@
+"""Tests of ResultCache and its perceptual hash.
+
+    python -m pytest -q test_result_cache.py
+"""
+import cv2
+import numpy as np
+
+import plantid
+from benchmarks.common import make_image
+
+
+def make_outputs(seed):
+    probs = np.random.default_rng(seed).random((1, 10)).astype(np.float32)
+    return {'status': 0, 'message': 'OK', 'results': {'probs': probs}}
+
+
+def add(cache, image, outputs, data):
+    key = plantid.hash_bytes(data)
+    assert cache.get(key) is None
+    cached, phash = cache.get_by_image(image, 'v1')
+    if cached is None:
+        cache.put(key, outputs, phash)
+    return cached
+
+
+def test_flat_images_do_not_share_an_entry():
+    cache = plantid.ResultCache(use_perceptual_hash=True)
+    dark = np.full((480, 640, 3), 20, dtype=np.uint8)
+    gray = np.full((480, 640, 3), 128, dtype=np.uint8)
+    assert plantid.perceptual_hash(dark) is None
+    assert add(cache, dark, make_outputs(0), b'dark') is None
+    assert add(cache, gray, make_outputs(1), b'gray') is None
+    assert cache.perceptual_hits == 0
+
+    # a low-texture photo: faint noise around a constant
+    rng = np.random.default_rng(0)
+    faint = (np.full((480, 640, 3), 60) + rng.integers(0, 3, (480, 640, 3))).astype(np.uint8)
+    assert add(cache, faint, make_outputs(2), b'faint') is None
+    assert cache.perceptual_hits == 0
+    assert len(cache) == 3
+
+
+def test_reencoded_copy_hits():
+    cache = plantid.ResultCache(use_perceptual_hash=True)
+    image = make_image(640, 480, seed=0)
+    outputs = make_outputs(0)
+    assert add(cache, image, outputs, b'original') is None
+    copy = cv2.resize(image, (320, 240), interpolation=cv2.INTER_AREA)
+    cached = add(cache, copy, make_outputs(1), b'resized copy')
+    assert cached is not None
+    assert np.array_equal(cached['results']['probs'], outputs['results']['probs'])
+    assert cache.perceptual_hits == 1
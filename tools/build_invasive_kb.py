@@ -0,0 +1,117 @@
+"""Populate the offline invasive species knowledge base.
+
+Either import a dataset:
+
+    python build_invasive_kb.py --import_path invasive.csv
+
+with columns (species_id or latin_name), region, is_invasive, severity,
+reason; or ask Gemini about many species per call for each region:
+
+    python build_invasive_kb.py --regions Spain China "United States" --batch_size 50
+
+Species that are already in the knowledge base for a region are skipped,
+so an interrupted run can simply be restarted.
+"""
+import sys
+import json
+import time
+import argparse
+
+import httpx
+
+sys.path.insert(0, '..')
+from plantid.identifier import load_taxonomy
+from plantid.invasive_cache import normalize_text
+from plantid.invasive_kb import InvasiveKnowledgeBase
+
+
+def build_prompt(species, region):
+    lines = '\n'.join('{}: {}'.format(species_id, latin_name) for species_id, latin_name in species)
+    return (
+        f"For each plant below (format 'id: latin name'), is it considered an invasive species in '{region}'?\n"
+        f"{lines}\n"
+        "Answer strictly with a JSON array containing one object per plant with the keys "
+        "'id' (integer), 'is_invasive' (boolean), 'severity' (string: High, Medium, Low, or None) "
+        "and 'reason' (string, concise explanation in English). "
+        "Do not include any markdown formatting like ```json."
+    )
+
+
+def parse_answer(data):
+    text = data["candidates"][0]["content"]["parts"][0]["text"].strip()
+    if text.startswith("```json"):
+        text = text[7:]
+    if text.startswith("```"):
+        text = text[3:]
+    if text.endswith("```"):
+        text = text[:-3]
+    return json.loads(text.strip())
+
+
+def query_batch(client, api_url, species, region, max_retries=3):
+    payload = {"contents": [{"parts": [{"text": build_prompt(species, region)}]}]}
+    latin_names = dict(species)
+    for attempt in range(max_retries):
+        try:
+            response = client.post(api_url, json=payload)
+            response.raise_for_status()
+            records = []
+            for item in parse_answer(response.json()):
+                species_id = int(item['id'])
+                if species_id not in latin_names:
+                    continue
+                records.append({'species_id': species_id, 'latin_name': latin_names[species_id],
+                                'region': region, 'is_invasive': bool(item['is_invasive']),
+                                'severity': item.get('severity', 'None'), 'reason': item.get('reason', '')})
+            return records
+        except Exception as e:
+            print('  attempt {} failed: {}'.format(attempt + 1, e))
+            time.sleep(2 ** attempt)
+    return []
+
+
+def populate_from_api(knowledge_base, taxonomy, regions, batch_size, api_url):
+    latin_names = taxonomy.species_latin_names
+    with httpx.Client(timeout=120.0) as client:
+        for region in regions:
+            species = [(species_id, latin_names[species_id]) for species_id in range(taxonomy.num_species)
+                       if latin_names[species_id] and not knowledge_base.contains(species_id, region)]
+            print('{}: {} species to query'.format(region, len(species)))
+            for start in range(0, len(species), batch_size):
+                records = query_batch(client, api_url, species[start: start + batch_size], region)
+                knowledge_base.upsert_many(records, source='gemini')
+                print('  [{}/{}] {} records'.format(min(start + batch_size, len(species)), len(species), len(records)))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_dir', type=str, default='../plantid/models')
+    parser.add_argument('--kb_path', type=str, default='../plantid/models/invasive_kb.sqlite3')
+    parser.add_argument('--import_path', type=str, default=None, help='CSV or JSON dataset to import')
+    parser.add_argument('--regions', type=str, nargs='*', default=[])
+    parser.add_argument('--batch_size', type=int, default=50, help='species per API call')
+    parser.add_argument('--api_url', type=str, default=None, help='defaults to the Gemini API of plantid.invasive')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+    taxonomy = load_taxonomy(args.model_dir)
+    knowledge_base = InvasiveKnowledgeBase(args.kb_path)
+
+    if args.import_path is not None:
+        latin_name_to_species_id = {}
+        for species_id, latin_name in enumerate(taxonomy.species_latin_names):
+            if latin_name:
+                latin_name_to_species_id.setdefault(normalize_text(latin_name), species_id)
+        num_records = knowledge_base.import_file(args.import_path, latin_name_to_species_id)
+        print('Imported {} records from {}'.format(num_records, args.import_path))
+
+    if args.regions:
+        api_url = args.api_url
+        if api_url is None:
+            from plantid.invasive import API_URL as api_url
+        populate_from_api(knowledge_base, taxonomy, args.regions, args.batch_size, api_url)
+
+    print('{} entries in {}'.format(len(knowledge_base), args.kb_path))
+    knowledge_base.close()
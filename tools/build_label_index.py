@@ -0,0 +1,27 @@
+import os
+import sys
+import argparse
+
+sys.path.insert(0, '..')
+from plantid.taxonomy import TaxonomyIndex
+
+
+def build_label_index(label_map_path, dst_path):
+    taxonomy = TaxonomyIndex.load_json(label_map_path)
+    taxonomy.save(dst_path)
+    print('{} species, {} genera, {} families saved to {}'.format(
+        taxonomy.num_species, taxonomy.num_genera, taxonomy.num_families, dst_path))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--label_map_path', type=str, default='../plantid/models/quarrying_plantid_label_map.json')
+    parser.add_argument('--dst_path', type=str, default='../plantid/models/quarrying_plantid_label_index.bin')
+    return parser.parse_args(argv)
+    
+    
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+    if not os.path.exists(args.label_map_path):
+        raise ValueError('label_map_path does not exist!')
+    build_label_index(args.label_map_path, args.dst_path)
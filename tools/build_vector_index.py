@@ -0,0 +1,95 @@
+"""Build a plantid.VectorIndex of reference images.
+
+The reference images are labelled folders in the layout written by
+split_images.py (or bulk_identify.py --action split): every subdirectory
+of --src_dir is one label, named "<chinese name> <latin name>", with its
+images below it. A process pool decodes the images, the embedding model
+exported by export_embedding_model.py embeds them in batches, and the
+index is saved to --index_path; query it with query_vector_index.py.
+
+    python build_vector_index.py --src_dir /data/reference --index_path reference.vidx
+    python build_vector_index.py --src_dir /data/reference --index_path reference.vidx --num_lists 1024 --num_subspaces 64
+
+Use --num_lists (IVF) for more than about a million images, and
+--num_subspaces (PQ) when scanning the float16 vectors of the probed lists
+is still too slow.
+"""
+import os
+import sys
+import time
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, '..')
+import plantid
+from bulk_identify import load_image
+
+
+def get_labelled_filenames(src_dir):
+    label_names = sorted(entry.name for entry in os.scandir(src_dir) if entry.is_dir())
+    filenames, labels = [], []
+    for label, label_name in enumerate(label_names):
+        for filename in sorted(plantid.iter_image_files(os.path.join(src_dir, label_name))):
+            filenames.append(filename)
+            labels.append(label)
+    return filenames, np.asarray(labels, dtype=np.int32), label_names
+
+
+def extract_embeddings(extractor, filenames, batch_size=32, num_workers=4, chunk_size=1024):
+    """float16 embeddings of the images and a boolean mask of the decodable ones"""
+    embeddings, valid = [], []
+    start_time = time.time()
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        images = executor.map(load_image, filenames, chunksize=16)
+        for start in range(0, len(filenames), chunk_size):
+            chunk_embeddings, chunk_valid = extractor.extract_batch(
+                itertools.islice(images, chunk_size), batch_size=batch_size)
+            embeddings.append(chunk_embeddings.astype(np.float16))
+            valid.append(chunk_valid)
+            num_done = min(start + chunk_size, len(filenames))
+            print('[{}/{}] {:.1f} images/sec'.format(num_done, len(filenames), num_done / (time.time() - start_time)))
+    return np.concatenate(embeddings), np.concatenate(valid)
+
+
+def build_vector_index(src_dir, index_path, model_path, num_lists=0, num_subspaces=0,
+                       batch_size=32, num_workers=4):
+    filenames, labels, label_names = get_labelled_filenames(src_dir)
+    if len(filenames) == 0:
+        raise ValueError('no images found in src_dir!')
+    print('{} images of {} labels'.format(len(filenames), len(label_names)))
+
+    extractor = plantid.EmbeddingExtractor(model_path)
+    embeddings, valid = extract_embeddings(extractor, filenames, batch_size, num_workers)
+    if not np.all(valid):
+        print('Skipped {} undecodable images'.format(np.count_nonzero(~valid)))
+    paths = [os.path.relpath(filename, src_dir) for filename, flag in zip(filenames, valid) if flag]
+
+    start_time = time.time()
+    index = plantid.VectorIndex.build(embeddings[valid], labels[valid], label_names, paths,
+                                      num_lists=num_lists, num_subspaces=num_subspaces)
+    index.save(index_path)
+    print('Indexed {} vectors of dimension {} in {:.1f}s, saved to {}'.format(
+        len(index), index.dim, time.time() - start_time, index_path))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--src_dir', type=str, required=True, help='one subdirectory of images per label')
+    parser.add_argument('--index_path', type=str, required=True)
+    parser.add_argument('--model_path', type=str, default='../plantid/models/quarrying_plantid_model_embedding.onnx')
+    parser.add_argument('--num_lists', type=int, default=0, help='IVF lists, 0 for brute force')
+    parser.add_argument('--num_subspaces', type=int, default=0, help='PQ bytes per vector, 0 for none')
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count() or 1)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+    if not os.path.exists(args.src_dir):
+        raise ValueError('src_dir does not exist!')
+    build_vector_index(args.src_dir, args.index_path, args.model_path, args.num_lists, args.num_subspaces,
+                       args.batch_size, args.num_workers)
@@ -0,0 +1,485 @@
+"""Identify a whole directory tree with all cores.
+
+A process pool decodes and center-crops the images, one thread runs
+batched inference on PlantIdentifier and a writer thread records the
+results (JSONL, CSV or Parquet, chosen by the --output extension) and
+optionally moves or renames the files. The stages are connected by bounded
+queues, so memory stays flat whatever the number of files. Files already
+recorded in --output are skipped, so a crashed run is resumed by running
+the same command again.
+
+    python bulk_identify.py --src_dir /data/photos --output results.jsonl
+    python bulk_identify.py --src_dir /data/photos --output results.csv --action split --dst_dir /data/sorted
+    python bulk_identify.py --src_dir /data/photos/<label> --output rename.jsonl --action rename
+"""
+import os
+import csv
+import sys
+import glob
+import json
+import time
+import queue
+import shutil
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, '..')
+import plantid
+
+
+_preprocessor = plantid.Preprocessor(plantid.PlantIdentifier.INPUT_SIZE)
+
+
+def load_image(filename):
+    """Decode and center-crop one image in a pool worker; returns a uint8 crop or None"""
+    try:
+        with open(filename, 'rb') as f:
+            image = plantid.decode_image(f.read(), min_size=_preprocessor.input_size)
+        return _preprocessor.crop_and_resize(image).copy()
+    except Exception:
+        return None
+
+
+def get_taxon_name(result):
+    if result['latin_name'] == '':
+        return result['chinese_name']
+    return '{} {}'.format(result['chinese_name'], result['latin_name'])
+
+
+def get_columns(topk):
+    """Columns of every result row, in order. They are fixed up front, so
+    that rows of failed images and resumed runs share one header or schema
+    """
+    columns = ['path', 'label_probability', 'status', 'message']
+    for k in range(1, topk + 1):
+        columns += ['chinese_name_{}'.format(k), 'latin_name_{}'.format(k), 'probability_{}'.format(k)]
+    for level in ('genus', 'family'):
+        columns += ['{}_chinese_name'.format(level), '{}_latin_name'.format(level), '{}_probability'.format(level)]
+    columns.append('dst_path')
+    return columns
+
+
+def check_columns(filename, columns, existing_columns):
+    if existing_columns != columns:
+        raise ValueError('{} has the columns {}, expected {}; resume with the same --topk or use a new --output'.format(
+            filename, existing_columns, columns))
+
+
+def add_done(done, row):
+    """Add the source and the destination of a result row to the done set,
+    so that a rerun skips moved or renamed files as well
+    """
+    for name in ('path', 'dst_path'):
+        if row.get(name):
+            done.add(row[name])
+
+
+class JsonlWriter(object):
+    def __init__(self, filename, columns):
+        self.filename = filename
+        self.columns = columns
+        if os.path.exists(filename):
+            with open(filename, 'r', encoding='utf-8') as f:
+                first_line = f.readline()
+            try:
+                first_row = json.loads(first_line)
+            except ValueError:
+                # empty, or a line cut off by a crash
+                first_row = None
+            if first_row is not None:
+                check_columns(filename, columns, list(first_row.keys()))
+        self._file = open(filename, 'a', encoding='utf-8')
+
+    @staticmethod
+    def load_done(filename):
+        done = set()
+        if os.path.exists(filename):
+            with open(filename, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        # a line cut off by a crash
+                        continue
+                    add_done(done, row)
+        return done
+
+    def write(self, rows):
+        for row in rows:
+            row = {name: row.get(name) for name in self.columns}
+            self._file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class CsvWriter(object):
+    def __init__(self, filename, columns):
+        self.filename = filename
+        is_new = not os.path.exists(filename) or os.path.getsize(filename) == 0
+        if not is_new:
+            with open(filename, 'r', encoding='utf-8', newline='') as f:
+                check_columns(filename, columns, next(csv.reader(f), []))
+        self._file = open(filename, 'a', encoding='utf-8', newline='')
+        # missing values, e.g. label_probability of failed images, are written as ''
+        self._writer = csv.DictWriter(self._file, fieldnames=columns)
+        if is_new:
+            self._writer.writeheader()
+
+    @staticmethod
+    def load_done(filename):
+        done = set()
+        if os.path.exists(filename):
+            with open(filename, 'r', encoding='utf-8', newline='') as f:
+                for row in csv.DictReader(f):
+                    add_done(done, row)
+        return done
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter(object):
+    """
+    Writes a directory of part-NNNNN.parquet files, one per rows_per_part rows.
+    Rows not yet in a part are also appended to pending.jsonl there, so they
+    survive a crash and are taken over by the next run
+    """
+    JOURNAL_FILENAME = 'pending.jsonl'
+
+    def __init__(self, dirname, columns, rows_per_part=10000):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('Parquet output needs pyarrow, install it with `pip install pyarrow`')
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.dirname = dirname
+        self.rows_per_part = rows_per_part
+        self.schema = self.get_schema(pyarrow, columns)
+        os.makedirs(dirname, exist_ok=True)
+        part_filenames = sorted(glob.glob(os.path.join(dirname, 'part-*.parquet')))
+        if part_filenames:
+            check_columns(dirname, columns, self._pq.read_schema(part_filenames[0]).names)
+        self._part_index = len(part_filenames)
+        self._journal_path = os.path.join(dirname, self.JOURNAL_FILENAME)
+        # a crash between writing a part and truncating the journal leaves rows in both
+        in_parts = self._load_parts_done(dirname)
+        self._rows = [row for row in self._read_journal(self._journal_path) if row.get('path') not in in_parts]
+        self._journal = open(self._journal_path, 'w', encoding='utf-8')
+        self._write_journal(self._rows)
+
+    @staticmethod
+    def get_schema(pyarrow, columns):
+        """One schema for all parts, also for parts holding only failed images"""
+        fields = []
+        for name in columns:
+            if name == 'status':
+                type_ = pyarrow.int64()
+            elif name.endswith('probability') or name.startswith('probability_'):
+                type_ = pyarrow.float64()
+            else:
+                type_ = pyarrow.string()
+            fields.append(pyarrow.field(name, type_))
+        return pyarrow.schema(fields)
+
+    @staticmethod
+    def _load_parts_done(dirname):
+        done = set()
+        filenames = glob.glob(os.path.join(dirname, 'part-*.parquet'))
+        if filenames:
+            import pyarrow.parquet
+            for filename in filenames:
+                table = pyarrow.parquet.read_table(filename, columns=['path', 'dst_path'])
+                for row in table.to_pylist():
+                    add_done(done, row)
+        return done
+
+    @staticmethod
+    def _read_journal(filename):
+        rows = []
+        if os.path.exists(filename):
+            with open(filename, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        rows.append(json.loads(line))
+                    except ValueError:
+                        # a line cut off by a crash
+                        pass
+        return rows
+
+    @classmethod
+    def load_done(cls, dirname):
+        done = cls._load_parts_done(dirname)
+        for row in cls._read_journal(os.path.join(dirname, cls.JOURNAL_FILENAME)):
+            add_done(done, row)
+        return done
+
+    def _write_journal(self, rows):
+        for row in rows:
+            self._journal.write(json.dumps(row, ensure_ascii=False) + '\n')
+        self._journal.flush()
+
+    def write(self, rows):
+        self._rows.extend(rows)
+        self._write_journal(rows)
+        if len(self._rows) >= self.rows_per_part:
+            self._write_part()
+
+    def _write_part(self):
+        if not self._rows:
+            return
+        filename = os.path.join(self.dirname, 'part-{:05d}.parquet'.format(self._part_index))
+        temp_filename = filename + '.tmp'
+        self._pq.write_table(self._pa.Table.from_pylist(self._rows, schema=self.schema), temp_filename)
+        os.replace(temp_filename, filename)
+        self._part_index += 1
+        self._rows = []
+        self._journal.seek(0)
+        self._journal.truncate()
+
+    def close(self):
+        self._write_part()
+        self._journal.close()
+        os.remove(self._journal_path)
+
+
+def get_writer_class(output):
+    if output.endswith('.jsonl'):
+        return JsonlWriter
+    if output.endswith('.csv'):
+        return CsvWriter
+    if output.endswith('.parquet'):
+        return ParquetWriter
+    raise ValueError('Unsupported output format, use .jsonl, .csv or .parquet: {}'.format(output))
+
+
+class BulkIdentifier(object):
+    """
+    decode (process pool) -> infer (thread) -> write (thread)
+
+    Args:
+        identifier: PlantIdentifier
+        writer: JsonlWriter, CsvWriter or ParquetWriter
+        done: paths already processed, extended with renamed files
+        action: None, 'split' or 'rename'
+    """
+
+    def __init__(self, identifier, writer, done, topk=5, batch_size=32, num_workers=4,
+                 queue_size=256, action=None, dst_dir=None, min_confidence=0.1, label=None):
+        self.identifier = identifier
+        self.writer = writer
+        self.done = done
+        self.topk = topk
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.queue_size = queue_size
+        self.action = action
+        self.dst_dir = dst_dir
+        self.min_confidence = min_confidence
+        self.label_index = None
+        if action == 'rename':
+            self.label_index = identifier.get_plant_names()[0].index(label)
+        self._infer_queue = queue.Queue(maxsize=queue_size)
+        self._write_queue = queue.Queue(maxsize=max(1, queue_size // batch_size))
+        self.num_processed = 0
+        # first error of the infer or write thread, which then only drain their
+        # queue, so that the stages before them never block on a full queue
+        self._error = None
+
+    def run(self, filenames):
+        infer_thread = threading.Thread(target=self._infer_loop, name='bulk-infer')
+        write_thread = threading.Thread(target=self._write_loop, name='bulk-write')
+        infer_thread.start()
+        write_thread.start()
+        try:
+            with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+                # at most queue_size images are decoding at once, results are taken in input order
+                pending = deque()
+                for filename in filenames:
+                    if self._error is not None:
+                        break
+                    if filename in self.done:
+                        continue
+                    if len(pending) >= self.queue_size:
+                        self._put_decoded(pending)
+                    pending.append((filename, executor.submit(load_image, filename)))
+                while pending and self._error is None:
+                    self._put_decoded(pending)
+                for _, future in pending:
+                    future.cancel()
+        finally:
+            self._infer_queue.put(None)
+            infer_thread.join()
+            write_thread.join()
+        if self._error is not None:
+            raise RuntimeError('Bulk identify aborted: {}'.format(self._error)) from self._error
+
+    def _put_decoded(self, pending):
+        filename, future = pending.popleft()
+        self._infer_queue.put((filename, future.result()))
+
+    def _collect_batch(self):
+        item = self._infer_queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        while len(batch) < self.batch_size:
+            try:
+                item = self._infer_queue.get(timeout=0.05)
+            except queue.Empty:
+                break
+            if item is None:
+                self._infer_queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    @staticmethod
+    def _drain(items):
+        while items.get() is not None:
+            pass
+
+    def _infer_loop(self):
+        try:
+            while True:
+                batch = self._collect_batch()
+                if batch is None:
+                    break
+                if self._error is None:
+                    self._write_queue.put(self._infer_batch(batch))
+        except Exception as e:
+            self._error = self._error or e
+            self._drain(self._infer_queue)
+        finally:
+            self._write_queue.put(None)
+
+    def _infer_batch(self, batch):
+        outputs = [{"status": -1, "message": "Decode error.", "results": {}}] * len(batch)
+        valid_indices = [k for k, (_, crop) in enumerate(batch) if crop is not None]
+        if valid_indices:
+            inputs = _preprocessor.get_buffer(len(valid_indices))
+            for row, k in enumerate(valid_indices):
+                _preprocessor.normalize(batch[k][1], out=inputs[row])
+            for k, one_outputs in zip(valid_indices, self.identifier.predict_tensor(inputs)):
+                outputs[k] = one_outputs
+        return [(filename, one_outputs) for (filename, _), one_outputs in zip(batch, outputs)]
+
+    def _write_loop(self):
+        try:
+            self._write_rows()
+        except Exception as e:
+            self._error = self._error or e
+            self._drain(self._write_queue)
+
+    def _write_rows(self):
+        start_time = last_print_time = time.time()
+        while True:
+            items = self._write_queue.get()
+            if items is not None and self._error is None:
+                rows = [self._make_row(filename, outputs) for filename, outputs in items]
+                # record the destinations before moving, so a crash never loses a moved file
+                self.writer.write(rows)
+                for row in rows:
+                    self._apply_action(row['path'], row['dst_path'])
+                self.num_processed += len(rows)
+            now = time.time()
+            if items is None or now - last_print_time >= 2.0:
+                last_print_time = now
+                print('{} images, {:.1f} images/s'.format(
+                    self.num_processed, self.num_processed / max(now - start_time, 1e-6)))
+            if items is None:
+                break
+
+    def _make_row(self, filename, outputs):
+        row = {'path': filename, 'label_probability': None}
+        if self.label_index is not None and outputs['status'] == 0:
+            row['label_probability'] = float(outputs['results']['probs'][0, self.label_index])
+        results = self.identifier.get_topk_results(outputs, self.topk)
+        row['status'] = results['status']
+        row['message'] = results['message']
+        for k in range(self.topk):
+            item = results['results'][k] if k < len(results['results']) else None
+            row['chinese_name_{}'.format(k + 1)] = item['chinese_name'] if item else ''
+            row['latin_name_{}'.format(k + 1)] = item['latin_name'] if item else ''
+            row['probability_{}'.format(k + 1)] = item['probability'] if item else 0.0
+        for level in ('genus', 'family'):
+            item = results['{}_results'.format(level)][0] if results['status'] == 0 else None
+            row['{}_chinese_name'.format(level)] = item['chinese_name'] if item else ''
+            row['{}_latin_name'.format(level)] = item['latin_name'] if item else ''
+            row['{}_probability'.format(level)] = item['probability'] if item else 0.0
+        row['dst_path'] = self._get_dst_path(filename, results, row['label_probability'])
+        return row
+
+    def _get_dst_path(self, filename, results, label_probability):
+        """Where the action moves the file, '' if it stays"""
+        if self.action == 'split' and results['status'] == 0:
+            confidence = results['results'][0]['probability']
+            if confidence > self.min_confidence:
+                dst_subdir = os.path.join(self.dst_dir, get_taxon_name(results['results'][0]))
+                return os.path.join(dst_subdir, '{:.3f}_{}'.format(confidence, os.path.basename(filename)))
+        elif self.action == 'rename' and label_probability is not None:
+            return os.path.join(os.path.dirname(filename),
+                                '{:.3f}_{}'.format(label_probability, os.path.basename(filename)))
+        return ''
+
+    def _apply_action(self, filename, dst_filename):
+        if not dst_filename:
+            return
+        # the lazy walk may still come across the new name
+        self.done.add(dst_filename)
+        try:
+            os.makedirs(os.path.dirname(dst_filename), exist_ok=True)
+            shutil.move(filename, dst_filename)
+        except OSError as e:
+            print('Failed to {} {}: {}'.format(self.action, filename, e))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--src_dir', type=str, required=True)
+    parser.add_argument('--output', type=str, default='results.jsonl', help='.jsonl, .csv or .parquet (a directory of parts)')
+    parser.add_argument('--model_dir', type=str, default=None)
+    parser.add_argument('--precision', type=str, default='fp32')
+    parser.add_argument('--topk', type=int, default=5)
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--num_workers', type=int, default=max(1, (os.cpu_count() or 2) - 1), help='decode processes')
+    parser.add_argument('--queue_size', type=int, default=256, help='max images between two stages')
+    parser.add_argument('--action', type=str, default=None, choices=['split', 'rename'],
+                        help='split: move into dst_dir/<taxon>; rename: prefix the probability of --label')
+    parser.add_argument('--dst_dir', type=str, default=None)
+    parser.add_argument('--min_confidence', type=float, default=0.1, help='split only files above it')
+    parser.add_argument('--label', type=str, default=None, help='rename: species name, defaults to the basename of src_dir')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+    if not os.path.exists(args.src_dir):
+        raise ValueError('src_dir does not exist!')
+    if args.action == 'split' and args.dst_dir is None:
+        raise ValueError('--action split needs --dst_dir!')
+
+    writer_class = get_writer_class(args.output)
+    done = writer_class.load_done(args.output)
+    if done:
+        print('Resuming, {} files already processed'.format(len(done)))
+    writer = writer_class(args.output, get_columns(args.topk))
+    identifier = plantid.PlantIdentifier(args.model_dir, precision=args.precision)
+    label = args.label or os.path.basename(os.path.normpath(args.src_dir))
+    bulk_identifier = BulkIdentifier(
+        identifier, writer, done, topk=args.topk, batch_size=args.batch_size,
+        num_workers=args.num_workers, queue_size=args.queue_size, action=args.action,
+        dst_dir=args.dst_dir, min_confidence=args.min_confidence, label=label)
+    try:
+        bulk_identifier.run(plantid.iter_image_files(args.src_dir))
+    finally:
+        writer.close()
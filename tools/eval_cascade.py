@@ -0,0 +1,86 @@
+"""Pick thresholds for a model cascade, see plantid.ModelCascade.
+
+Runs the small and the full model over sample images once, then reports
+for every (min_prob, min_margin) pair the fraction of images escalated to
+the full model, the top-1 and top-5 agreement of the cascade answers with
+the full model, and the expected cost per image relative to the full
+model alone, from the measured speeds of both models.
+
+    python eval_cascade.py --cascade_model small.onnx --src_dirs /data/val --min_probs 0.3 0.5 0.7
+"""
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, '..')
+import plantid
+from plantid.cascade import get_escalation_mask
+from eval_quantized_model import load_tensors
+from quantize_model import sample_image_filenames
+
+
+def run_model(plant_identifier, model, inputs, batch_size):
+    probs_list = []
+    start_time = time.time()
+    for start in range(0, len(inputs), batch_size):
+        outputs = plant_identifier._postprocess(model.forward(inputs[start: start + batch_size]), model)
+        probs_list.append(outputs['probs'])
+    elapsed = time.time() - start_time
+    return np.concatenate(probs_list, axis=0), len(inputs) / elapsed
+
+
+def evaluate(model_dir, cascade_model, filenames, min_probs, min_margins, batch_size=16):
+    # the same session settings for both models, without the optimized graph cache
+    full = plantid.PlantIdentifier(model_dir, use_cache=False)
+    small = plantid.ModelCascade(cascade_model, use_cache=False)
+    full.warmup((batch_size,))
+    run_model(full, small.model, np.zeros((batch_size, 3, full.INPUT_SIZE, full.INPUT_SIZE), np.float32),
+              batch_size)
+
+    inputs = load_tensors(filenames)
+    full_probs, full_speed = run_model(full, full, inputs, batch_size)
+    small_probs, small_speed = run_model(full, small.model, inputs, batch_size)
+    full_top1 = np.argmax(full_probs, axis=-1)
+    _, small_top5 = plantid.top_k(small_probs, 5)
+
+    print('images:      {}'.format(len(inputs)))
+    print('full speed:  {:.1f} images/sec'.format(full_speed))
+    print('small speed: {:.1f} images/sec ({:.2f}x)'.format(small_speed, small_speed / full_speed))
+    print('{:>9} {:>11} {:>10} {:>10} {:>10} {:>10}'.format(
+        'min_prob', 'min_margin', 'escalated', 'top1 agr', 'top5 agr', 'rel cost'))
+    results = []
+    for min_prob in min_probs:
+        for min_margin in min_margins:
+            mask = get_escalation_mask(small_probs, min_prob, min_margin)
+            top1_hits = np.where(mask, True, small_top5[:, 0] == full_top1)
+            top5_hits = np.where(mask, True, np.any(small_top5 == full_top1[:, None], axis=-1))
+            escalation_rate = np.mean(mask)
+            relative_cost = (1 / small_speed + escalation_rate / full_speed) * full_speed
+            print('{:>9.4f} {:>11.4f} {:>10.3f} {:>10.4f} {:>10.4f} {:>10.3f}'.format(
+                min_prob, min_margin, escalation_rate, np.mean(top1_hits), np.mean(top5_hits), relative_cost))
+            results.append({'min_prob': min_prob, 'min_margin': min_margin, 'escalation_rate': escalation_rate,
+                            'top1_agreement': np.mean(top1_hits), 'top5_agreement': np.mean(top5_hits),
+                            'relative_cost': relative_cost})
+    return results
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_dir', type=str, default='../plantid/models')
+    parser.add_argument('--cascade_model', type=str, required=True, help='small ONNX model with the same classes')
+    parser.add_argument('--src_dirs', type=str, nargs='+', required=True)
+    parser.add_argument('--num', type=int, default=1000, help='max number of evaluation images')
+    parser.add_argument('--min_probs', type=float, nargs='+', default=[0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9])
+    parser.add_argument('--min_margins', type=float, nargs='+', default=[0.0])
+    parser.add_argument('--batch_size', type=int, default=16)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+    filenames = sample_image_filenames(args.src_dirs, args.num, seed=1)
+    if len(filenames) == 0:
+        raise ValueError('no images found in src_dirs!')
+    evaluate(args.model_dir, args.cascade_model, filenames, args.min_probs, args.min_margins, args.batch_size)
@@ -0,0 +1,83 @@
+"""Compare a reduced precision model variant with the FP32 model.
+
+Reports top-1 agreement (same top-1 species), top-5 agreement (FP32 top-1
+within the variant's top-5), mean absolute probability difference, and
+images/sec of both models on the current device.
+"""
+import os
+import sys
+import time
+import argparse
+
+import khandy
+import numpy as np
+
+sys.path.insert(0, '..')
+import plantid
+from quantize_model import sample_image_filenames
+
+
+def load_tensors(filenames):
+    tensors = []
+    for filename in filenames:
+        image = khandy.imread_cv(filename)
+        if image is None:
+            continue
+        tensors.append(plantid.PlantIdentifier._preprocess(image))
+    return np.concatenate(tensors, axis=0)
+
+
+def run_model(plant_identifier, inputs, batch_size):
+    probs_list = []
+    start_time = time.time()
+    for start in range(0, len(inputs), batch_size):
+        outputs = plant_identifier._postprocess(plant_identifier.forward(inputs[start: start + batch_size]))
+        probs_list.append(outputs['probs'])
+    elapsed = time.time() - start_time
+    return np.concatenate(probs_list, axis=0), len(inputs) / elapsed
+
+
+def evaluate(model_dir, precision, filenames, batch_size=16):
+    # the same session settings for both models, without the optimized graph cache
+    reference = plantid.PlantIdentifier(model_dir, use_cache=False, precision='fp32')
+    candidate = plantid.PlantIdentifier(model_dir, use_cache=False, precision=precision)
+    reference.warmup((batch_size,))
+    candidate.warmup((batch_size,))
+
+    inputs = load_tensors(filenames)
+    ref_probs, ref_speed = run_model(reference, inputs, batch_size)
+    cand_probs, cand_speed = run_model(candidate, inputs, batch_size)
+
+    ref_top1 = np.argmax(ref_probs, axis=-1)
+    _, cand_top5 = khandy.top_k(cand_probs, 5)
+    top1_agreement = np.mean(cand_top5[:, 0] == ref_top1)
+    top5_agreement = np.mean(np.any(cand_top5 == ref_top1[:, None], axis=-1))
+    mean_abs_diff = np.mean(np.abs(cand_probs - ref_probs))
+
+    print('images:          {}'.format(len(inputs)))
+    print('top1 agreement:  {:.4f}'.format(top1_agreement))
+    print('top5 agreement:  {:.4f}'.format(top5_agreement))
+    print('mean |dp|:       {:.6f}'.format(mean_abs_diff))
+    print('fp32 speed:      {:.1f} images/sec'.format(ref_speed))
+    print('{} speed: {:.1f} images/sec ({:.2f}x)'.format(precision, cand_speed, cand_speed / ref_speed))
+    return {'top1_agreement': top1_agreement, 'top5_agreement': top5_agreement,
+            'mean_abs_diff': mean_abs_diff, 'fp32_speed': ref_speed, 'speed': cand_speed}
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_dir', type=str, default='../plantid/models')
+    parser.add_argument('--precision', type=str, default='int8_static',
+                        choices=['int8_dynamic', 'int8_static', 'fp16'])
+    parser.add_argument('--src_dirs', type=str, nargs='+', required=True)
+    parser.add_argument('--num', type=int, default=1000, help='max number of evaluation images')
+    parser.add_argument('--batch_size', type=int, default=16)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+    filenames = sample_image_filenames(args.src_dirs, args.num, seed=1)
+    if len(filenames) == 0:
+        raise ValueError('no images found in src_dirs!')
+    evaluate(args.model_dir, args.precision, filenames, args.batch_size)
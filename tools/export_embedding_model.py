@@ -0,0 +1,80 @@
+"""Expose the penultimate-layer features of the ONNX model as an output.
+
+The exported model has the extra output `embedding`: the input of the
+final linear layer, found by walking back from the logits (or from
+`probs` of models exported by fuse_taxon_rollup.py) through Softmax, Add
+and Identity nodes to the Gemm or MatMul which produces them. Pass
+--tensor_name to pick another tensor. `PlantIdentifier` ignores the extra
+output, so the exported model can replace the original one, while
+`plantid.EmbeddingExtractor` reads only the embedding.
+
+Requires the `onnx` package.
+"""
+import os
+import sys
+import argparse
+
+import onnx
+from onnx import helper
+
+sys.path.insert(0, '..')
+import plantid
+
+
+def find_embedding_tensor(graph):
+    producers = {output: node for node in graph.node for output in node.output}
+    initializer_names = {item.name for item in graph.initializer}
+    output_names = [item.name for item in graph.output]
+    name = 'probs' if 'probs' in output_names else output_names[0]
+    while name in producers:
+        node = producers[name]
+        if node.op_type in ('Gemm', 'MatMul'):
+            return node.input[0]
+        if node.op_type not in ('Softmax', 'Add', 'Identity'):
+            break
+        # the data input, not the bias
+        inputs = [item for item in node.input if item not in initializer_names]
+        if len(inputs) != 1:
+            break
+        name = inputs[0]
+    raise ValueError(f'Cannot find the final linear layer, stopped at {name}; pass --tensor_name!')
+
+
+def get_tensor_shape(model, tensor_name):
+    inferred = onnx.shape_inference.infer_shapes(model)
+    for item in list(inferred.graph.value_info) + list(inferred.graph.output):
+        if item.name == tensor_name:
+            return [dim.dim_value if dim.HasField('dim_value') else (dim.dim_param or None)
+                    for dim in item.type.tensor_type.shape.dim]
+    return None
+
+
+def export_embedding_model(src_path, dst_path, tensor_name=None):
+    model = onnx.load(src_path)
+    graph = model.graph
+    if plantid.EMBEDDING_OUTPUT in [item.name for item in graph.output]:
+        raise ValueError(f'model already has an {plantid.EMBEDDING_OUTPUT} output!')
+    tensor_name = tensor_name or find_embedding_tensor(graph)
+    shape = get_tensor_shape(model, tensor_name)
+    graph.node.append(helper.make_node('Identity', [tensor_name], [plantid.EMBEDDING_OUTPUT]))
+    graph.output.append(helper.make_tensor_value_info(
+        plantid.EMBEDDING_OUTPUT, onnx.TensorProto.FLOAT, shape))
+    onnx.checker.check_model(model)
+    onnx.save(model, dst_path)
+    print('Embedding of tensor {}, shape {}'.format(tensor_name, shape))
+    print('Saved to {}'.format(dst_path))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--src_path', type=str, default='../plantid/models/quarrying_plantid_model.onnx')
+    parser.add_argument('--dst_path', type=str, default='../plantid/models/quarrying_plantid_model_embedding.onnx')
+    parser.add_argument('--tensor_name', type=str, default=None, help='defaults to the input of the final linear layer')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+    if not os.path.exists(args.src_path):
+        raise ValueError('src_path does not exist!')
+    export_embedding_model(args.src_path, args.dst_path, args.tensor_name)
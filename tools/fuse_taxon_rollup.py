@@ -0,0 +1,123 @@
+"""Append softmax and genus/family roll-ups to the ONNX graph.
+
+The exported model has the extra outputs `probs`, `family_probs` and
+`genus_probs`. `PlantIdentifier` detects them and skips the roll-up in numpy.
+Replace `quarrying_plantid_model.onnx` with the exported model to use it.
+The fused outputs are checked against the numpy roll-ups after export.
+
+Requires the `onnx` package.
+"""
+import os
+import sys
+import argparse
+
+import khandy
+import numpy as np
+import onnx
+from onnx import helper, numpy_helper
+
+sys.path.insert(0, '..')
+import plantid
+
+
+def get_segment_indices(rollup, num_classes):
+    """Class indices of every superclass, one row per superclass, padded
+    with `num_classes`, the index of the zero column appended to the probs.
+    """
+    max_length = int(rollup.lengths.max())
+    indices = np.full((rollup.num_superclasses, max_length), num_classes, dtype=np.int64)
+    columns = np.arange(len(rollup.permutation)) - np.repeat(rollup.offsets, rollup.lengths)
+    rows = np.repeat(np.arange(rollup.num_superclasses), rollup.lengths)
+    indices[rows, columns] = rollup.permutation
+    return indices
+
+
+def add_rollup_nodes(graph, padded_name, rollup, num_classes, prefix, opset_version):
+    """Segment sums as a ReduceSum over the gathered (num_superclasses, max_length)
+    block, so every sum only adds non-negative probs, like `TaxonRollup`.
+    """
+    graph.initializer.append(numpy_helper.from_array(
+        get_segment_indices(rollup, num_classes), f'{prefix}_indices'))
+    graph.node.append(helper.make_node(
+        'Gather', [padded_name, f'{prefix}_indices'], [f'{prefix}_segments'], axis=1))
+    # axes is an input since opset 13, an attribute before
+    if opset_version >= 13:
+        graph.initializer.append(numpy_helper.from_array(np.array([2], dtype=np.int64), f'{prefix}_axes'))
+        graph.node.append(helper.make_node(
+            'ReduceSum', [f'{prefix}_segments', f'{prefix}_axes'], [f'{prefix}_probs'], keepdims=0))
+    else:
+        graph.node.append(helper.make_node(
+            'ReduceSum', [f'{prefix}_segments'], [f'{prefix}_probs'], axes=[2], keepdims=0))
+    graph.output.append(helper.make_tensor_value_info(
+        f'{prefix}_probs', onnx.TensorProto.FLOAT, ['batch_size', rollup.num_superclasses]))
+
+
+def check_parity(model_path, plant_identifier, batch_size=8, atol=1e-6):
+    """Compare the fused outputs with the numpy roll-ups on random inputs.
+
+    Raises:
+        ValueError: an output is negative or differs by more than `atol`.
+    """
+    import onnxruntime
+
+    sess = onnxruntime.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+    input_info = sess.get_inputs()[0]
+    shape = [batch_size] + [dim if isinstance(dim, int) else 224 for dim in input_info.shape[1:]]
+    inputs = np.random.default_rng(0).standard_normal(shape).astype(np.float32)
+    logits, probs, family_probs, genus_probs = sess.run(
+        [sess.get_outputs()[0].name, 'probs', 'family_probs', 'genus_probs'], {input_info.name: inputs})
+
+    expected_probs = khandy.softmax(logits)
+    expected = {
+        'probs': expected_probs,
+        'family_probs': plant_identifier.family_rollup(expected_probs),
+        'genus_probs': plant_identifier.genus_rollup(expected_probs),
+    }
+    actual = {'probs': probs, 'family_probs': family_probs, 'genus_probs': genus_probs}
+    for name, value in actual.items():
+        if value.min() < 0:
+            raise ValueError(f'{name} has negative values, min {value.min()}!')
+        max_diff = np.abs(value - expected[name]).max()
+        if max_diff > atol:
+            raise ValueError(f'{name} differs from the numpy roll-up by {max_diff}!')
+
+
+def fuse_taxon_rollup(model_dir, dst_path):
+    plant_identifier = plantid.PlantIdentifier(model_dir)
+    if plant_identifier.fused_rollup:
+        raise ValueError('model already has fused roll-up outputs!')
+    src_path = os.path.join(plant_identifier.model_dir, 'quarrying_plantid_model.onnx')
+    model = onnx.load(src_path)
+    graph = model.graph
+    logits_name = graph.output[0].name
+    num_classes = len(plant_identifier.names)
+
+    opset_version = max(opset.version for opset in model.opset_import if opset.domain in ('', 'ai.onnx'))
+    if opset_version < 11:
+        raise ValueError(f'Pad with pads input needs opset >= 11, got {opset_version}!')
+
+    # logits are 2-D, so axis=1 has the same meaning before and after opset 13
+    graph.node.append(helper.make_node('Softmax', [logits_name], ['probs'], axis=1))
+    graph.output.append(helper.make_tensor_value_info(
+        'probs', onnx.TensorProto.FLOAT, ['batch_size', num_classes]))
+    # a zero column at index num_classes for the padding of shorter segments
+    graph.initializer.append(numpy_helper.from_array(np.array([0, 0, 0, 1], dtype=np.int64), 'rollup_pads'))
+    graph.node.append(helper.make_node('Pad', ['probs', 'rollup_pads'], ['rollup_padded']))
+    add_rollup_nodes(graph, 'rollup_padded', plant_identifier.family_rollup, num_classes, 'family', opset_version)
+    add_rollup_nodes(graph, 'rollup_padded', plant_identifier.genus_rollup, num_classes, 'genus', opset_version)
+    onnx.checker.check_model(model)
+    onnx.save(model, dst_path)
+    check_parity(dst_path, plant_identifier)
+    print('Saved to {}'.format(dst_path))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_dir', type=str, default='../plantid/models')
+    parser.add_argument('--dst_path', type=str, default='../plantid/models/quarrying_plantid_model_rollup.onnx')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+    fuse_taxon_rollup(args.model_dir, args.dst_path)
@@ -0,0 +1,57 @@
+"""Run the shared-memory inference server for multi-worker serving.
+
+The server owns the only ORT session of the host; uvicorn workers started
+with PLANTID_INFERENCE_SERVER set to the same address connect to it
+instead of loading the model, see plantid.InferenceServer.
+
+    export PLANTID_INFERENCE_AUTHKEY=$(python -c "import secrets; print(secrets.token_hex(16))")
+    python inference_server.py --address /tmp/plantid.sock
+    PLANTID_INFERENCE_SERVER=/tmp/plantid.sock uvicorn app:app --workers 8
+"""
+import os
+import sys
+import signal
+import argparse
+
+sys.path.insert(0, '..')
+import plantid
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--address', type=str, default=os.getenv('PLANTID_INFERENCE_SERVER', '/tmp/plantid.sock'),
+                        help="'host:port' or Unix socket path")
+    parser.add_argument('--model_dir', type=str, default=None)
+    parser.add_argument('--precision', type=str, default=os.getenv('PLANTID_PRECISION', 'fp32'))
+    parser.add_argument('--cascade_model', type=str, default=os.getenv('PLANTID_CASCADE_MODEL'),
+                        help='small model answering confident images first, see plantid.ModelCascade')
+    parser.add_argument('--cascade_min_prob', type=float, default=float(os.getenv('PLANTID_CASCADE_MIN_PROB', '0.5')))
+    parser.add_argument('--cascade_min_margin', type=float,
+                        default=float(os.getenv('PLANTID_CASCADE_MIN_MARGIN', '0')))
+    parser.add_argument('--num_slots', type=int, default=256)
+    parser.add_argument('--slots_per_client', type=int, default=32, help='max in-flight images per worker')
+    parser.add_argument('--max_batch_size', type=int, default=int(os.getenv('PLANTID_MAX_BATCH_SIZE', '32')))
+    parser.add_argument('--max_wait_ms', type=float, default=float(os.getenv('PLANTID_MAX_WAIT_MS', '5')))
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+    # required, a default key would let anyone reaching the socket run code here
+    authkey = os.getenv('PLANTID_INFERENCE_AUTHKEY', '').encode('utf-8')
+    cascade = None
+    if args.cascade_model:
+        cascade = plantid.ModelCascade(args.cascade_model, args.cascade_min_prob, args.cascade_min_margin)
+    identifier = plantid.PlantIdentifier(args.model_dir, precision=args.precision, cascade=cascade)
+    identifier.warmup(batch_sizes=sorted({1, args.max_batch_size}))
+    server = plantid.InferenceServer(
+        identifier, args.address, authkey, num_slots=args.num_slots, slots_per_client=args.slots_per_client,
+        max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print('Inference server on {}'.format(args.address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
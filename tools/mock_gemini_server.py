@@ -0,0 +1,121 @@
+"""Local stand-in for the Gemini generateContent REST API.
+
+Answers every POST with a Gemini-shaped response whose text is the JSON
+expected by InvasiveChecker; the answer is derived from the prompt, so it
+is stable per (plant, location). GET /stats returns the number of calls.
+
+Failures can be injected to exercise retries and the circuit breaker:
+--error_rate answers that fraction of calls with --error_status,
+--fail_first answers the first that many calls with it, and
+--slow_rate delays that fraction of calls by --slow_latency seconds.
+
+    python mock_gemini_server.py --port 8765 --latency 0.5
+    python mock_gemini_server.py --port 8765 --error_rate 0.3 --slow_rate 0.1 --slow_latency 20
+    InvasiveChecker(api_url='http://127.0.0.1:8765/v1beta/models/mock:generateContent')
+"""
+import re
+import sys
+import json
+import time
+import random
+import zlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def mock_answer(text):
+    is_invasive = zlib.crc32(text.encode('utf-8')) % 2 == 0
+    return {
+        'is_invasive': is_invasive,
+        'severity': 'Medium' if is_invasive else 'None',
+        'reason': 'Mock answer.'
+    }
+
+
+class MockGeminiHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    error_rate = 0.0
+    error_status = 503
+    fail_first = 0
+    slow_rate = 0.0
+    slow_latency = 0.0
+    num_calls = 0
+    num_errors = 0
+    lock = threading.Lock()
+
+    def _send_json(self, status, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send_json(200, {'num_calls': MockGeminiHandler.num_calls,
+                                  'num_errors': MockGeminiHandler.num_errors})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        with MockGeminiHandler.lock:
+            MockGeminiHandler.num_calls += 1
+            fail = MockGeminiHandler.num_calls <= self.fail_first
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        prompt = payload['contents'][0]['parts'][0]['text']
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if random.random() < self.slow_rate:
+            time.sleep(self.slow_latency)
+        if fail or random.random() < self.error_rate:
+            with MockGeminiHandler.lock:
+                MockGeminiHandler.num_errors += 1
+            self._send_json(self.error_status, {'error': {'code': self.error_status, 'message': 'Injected error.'}})
+            return
+
+        if 'JSON array' in prompt:
+            # bulk prompt of tools/build_invasive_kb.py, one 'id: latin name' line per plant
+            answer = [dict(mock_answer(line), id=int(line.split(':')[0]))
+                      for line in prompt.splitlines() if re.match(r'^\d+: ', line)]
+        else:
+            answer = mock_answer(prompt)
+        self._send_json(200, {'candidates': [{'content': {'parts': [{'text': json.dumps(answer)}]}}]})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host, port, latency=0.0, error_rate=0.0, error_status=503, slow_rate=0.0, slow_latency=0.0,
+          fail_first=0):
+    MockGeminiHandler.latency = latency
+    MockGeminiHandler.error_rate = error_rate
+    MockGeminiHandler.error_status = error_status
+    MockGeminiHandler.fail_first = fail_first
+    MockGeminiHandler.slow_rate = slow_rate
+    MockGeminiHandler.slow_latency = slow_latency
+    server = ThreadingHTTPServer((host, port), MockGeminiHandler)
+    server.daemon_threads = True
+    return server
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before answering')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='fraction of calls answered with an error')
+    parser.add_argument('--error_status', type=int, default=503)
+    parser.add_argument('--fail_first', type=int, default=0, help='calls answered with an error before any success')
+    parser.add_argument('--slow_rate', type=float, default=0.0, help='fraction of calls delayed by slow_latency')
+    parser.add_argument('--slow_latency', type=float, default=0.0)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+    server = serve(args.host, args.port, args.latency, args.error_rate,
+                   args.error_status, args.slow_rate, args.slow_latency, args.fail_first)
+    print('Mock Gemini API on http://{}:{}'.format(args.host, args.port))
+    server.serve_forever()
@@ -0,0 +1,128 @@
+"""Produce reduced precision variants of quarrying_plantid_model.onnx.
+
+- int8_dynamic: weights quantized offline, activations at run time.
+- int8_static: weights and activations quantized offline (QDQ format),
+  with activation ranges calibrated on images from `--calib_dirs`, e.g. the
+  taxon folders written by split_images.py.
+- fp16: weights and activations in float16, inputs and outputs kept float32.
+  Requires the `onnxconverter-common` package.
+
+The variants are saved next to the FP32 model under the names in
+`plantid.PlantIdentifier.MODEL_FILENAMES`; select one with
+`plantid.PlantIdentifier(precision=...)`. Measure the accuracy cost with
+eval_quantized_model.py.
+"""
+import os
+import sys
+import random
+import argparse
+
+import khandy
+import numpy as np
+import onnx
+from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat,
+                                      QuantType, quantize_dynamic, quantize_static)
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+sys.path.insert(0, '..')
+import plantid
+
+
+def sample_image_filenames(src_dirs, max_num=None, seed=0):
+    filenames = sum([khandy.get_all_filenames(src_dir) for src_dir in src_dirs], [])
+    filenames = [filename for filename in filenames
+                 if os.path.splitext(filename)[-1].lower() in ('.jpg', '.jpeg', '.png', '.bmp', '.webp')]
+    if max_num is not None and len(filenames) > max_num:
+        filenames = random.Random(seed).sample(filenames, max_num)
+    return filenames
+
+
+class ImageFolderDataReader(CalibrationDataReader):
+    """Feeds preprocessed calibration images to `quantize_static`."""
+    def __init__(self, filenames, input_name, batch_size=16):
+        self.filenames = filenames
+        self.input_name = input_name
+        self.batch_size = batch_size
+        self._iter = self._generate()
+
+    def _generate(self):
+        for start in range(0, len(self.filenames), self.batch_size):
+            tensors = []
+            for filename in self.filenames[start: start + self.batch_size]:
+                image = khandy.imread_cv(filename)
+                if image is None:
+                    continue
+                tensors.append(plantid.PlantIdentifier._preprocess(image))
+            if len(tensors) > 0:
+                yield {self.input_name: np.concatenate(tensors, axis=0)}
+
+    def get_next(self):
+        return next(self._iter, None)
+
+    def rewind(self):
+        self._iter = self._generate()
+
+
+def get_dst_path(model_dir, precision):
+    return os.path.join(model_dir, plantid.PlantIdentifier.MODEL_FILENAMES[precision])
+
+
+def quantize_int8_dynamic(src_path, dst_path):
+    quantize_dynamic(src_path, dst_path, weight_type=QuantType.QInt8)
+
+
+def quantize_int8_static(src_path, dst_path, calib_filenames, per_channel=True, batch_size=16):
+    input_name = onnx.load(src_path, load_external_data=False).graph.input[0].name
+    data_reader = ImageFolderDataReader(calib_filenames, input_name, batch_size)
+    quantize_static(src_path, dst_path, data_reader,
+                    quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8,
+                    per_channel=per_channel,
+                    calibrate_method=CalibrationMethod.MinMax)
+
+
+def convert_fp16(src_path, dst_path):
+    from onnxconverter_common import float16
+    model = onnx.load(src_path)
+    model = float16.convert_float_to_float16(model, keep_io_types=True)
+    onnx.save(model, dst_path)
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_dir', type=str, default='../plantid/models')
+    parser.add_argument('--precisions', type=str, nargs='+', default=['int8_dynamic', 'int8_static'],
+                        choices=['int8_dynamic', 'int8_static', 'fp16'])
+    parser.add_argument('--calib_dirs', type=str, nargs='*', default=[],
+                        help='image folders used to calibrate int8_static')
+    parser.add_argument('--calib_num', type=int, default=500, help='max number of calibration images')
+    parser.add_argument('--no_per_channel', action='store_true')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+    src_path = get_dst_path(args.model_dir, 'fp32')
+    if not os.path.exists(src_path):
+        raise ValueError('FP32 model does not exist!')
+
+    # symbolic shape inference and graph cleanup make quantization more effective
+    preprocessed_path = os.path.join(args.model_dir, 'quarrying_plantid_model_quant_pre.onnx')
+    quant_pre_process(src_path, preprocessed_path, skip_symbolic_shape=True)
+    try:
+        for precision in args.precisions:
+            dst_path = get_dst_path(args.model_dir, precision)
+            if precision == 'int8_dynamic':
+                quantize_int8_dynamic(preprocessed_path, dst_path)
+            elif precision == 'int8_static':
+                calib_filenames = sample_image_filenames(args.calib_dirs, args.calib_num)
+                if len(calib_filenames) == 0:
+                    raise ValueError('int8_static needs calibration images, see --calib_dirs!')
+                quantize_int8_static(preprocessed_path, dst_path, calib_filenames,
+                                     per_channel=not args.no_per_channel)
+            elif precision == 'fp16':
+                convert_fp16(src_path, dst_path)
+            print('{}: {:.1f}MB saved to {}'.format(precision, os.path.getsize(dst_path) / 1024 ** 2, dst_path))
+    finally:
+        os.remove(preprocessed_path)
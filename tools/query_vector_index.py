@@ -0,0 +1,89 @@
+"""Query a plantid.VectorIndex built by build_vector_index.py.
+
+Similar photos: the nearest reference images of every query image, and a
+label vote weighted by similarity. A query whose nearest reference image
+is less similar than --reject_threshold is reported as unknown, which
+rejects taxa missing from the reference set (open-set rejection):
+
+    python query_vector_index.py --index_path reference.vidx --images a.jpg b.jpg --topk 5 --reject_threshold 0.6
+
+Duplicates: the pairs of reference images at least --duplicate_threshold
+similar, found by searching the index with its own vectors:
+
+    python query_vector_index.py --index_path reference.vidx --duplicates --duplicate_threshold 0.98
+"""
+import sys
+import argparse
+from collections import defaultdict
+
+import numpy as np
+
+sys.path.insert(0, '..')
+import plantid
+from build_vector_index import load_image
+
+
+def vote_label(results):
+    votes = defaultdict(float)
+    for result in results:
+        votes[result['label']] += result['score']
+    return max(votes.items(), key=lambda item: item[1])[0] if votes else None
+
+
+def query_images(index, model_path, filenames, topk=5, reject_threshold=None, nprobe=8):
+    extractor = plantid.EmbeddingExtractor(model_path)
+    embeddings, valid = extractor.extract_batch(load_image(filename) for filename in filenames)
+    if np.any(valid):
+        scores, indices = index.search(embeddings[valid], topk, nprobe=nprobe)
+    else:
+        scores = indices = []
+    for filename, row_scores, row_indices in zip(np.asarray(filenames)[valid], scores, indices):
+        results = index.get_results(row_scores, row_indices)
+        if reject_threshold is not None and (len(results) == 0 or results[0]['score'] < reject_threshold):
+            label = None
+        else:
+            label = vote_label(results)
+        print('{}: {}'.format(filename, label or 'unknown'))
+        for result in results:
+            print('    {:.4f}  {}  {}'.format(result['score'], result['label'], result['path']))
+    for filename in np.asarray(filenames)[~valid]:
+        print('{}: cannot decode'.format(filename))
+
+
+def find_duplicates(index, threshold, topk=10, nprobe=8, batch_size=1024):
+    """Yield the pairs (i, j, score) with i < j and score >= threshold; at
+    most topk - 1 duplicates are found per image.
+    """
+    for start in range(0, len(index), batch_size):
+        queries = index.vectors[start: start + batch_size].astype(np.float32)
+        scores, indices = index.search(queries, topk, nprobe=nprobe)
+        for k, (row_scores, row_indices) in enumerate(zip(scores, indices)):
+            for score, index_ in zip(row_scores.tolist(), row_indices.tolist()):
+                if score >= threshold and index_ > start + k:
+                    yield start + k, index_, score
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--index_path', type=str, required=True)
+    parser.add_argument('--model_path', type=str, default='../plantid/models/quarrying_plantid_model_embedding.onnx')
+    parser.add_argument('--images', type=str, nargs='*', default=[])
+    parser.add_argument('--topk', type=int, default=5)
+    parser.add_argument('--nprobe', type=int, default=8, help='IVF lists scanned per query')
+    parser.add_argument('--reject_threshold', type=float, default=None,
+                        help='report queries whose top-1 similarity is below this as unknown')
+    parser.add_argument('--duplicates', action='store_true')
+    parser.add_argument('--duplicate_threshold', type=float, default=0.98)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+    index = plantid.VectorIndex.load(args.index_path)
+    if args.duplicates:
+        for i, j, score in find_duplicates(index, args.duplicate_threshold, nprobe=args.nprobe):
+            print('{:.4f}  {}  {}'.format(score, index.paths[i], index.paths[j]))
+    elif len(args.images) > 0:
+        query_images(index, args.model_path, args.images, args.topk, args.reject_threshold, args.nprobe)
+    else:
+        raise ValueError('pass --images or --duplicates!')